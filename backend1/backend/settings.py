@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from datetime import timedelta
+from importlib.util import find_spec
 from pathlib import Path
 import os
 from django.conf import settings
@@ -103,12 +104,92 @@ DATABASES = {
     }
 }
 
+# Cache: in-process by default; point REDIS_URL at a Redis server (requires
+# the `redis` package) so invalidations are shared by every worker.
+#
+# 'default' holds small, many entries: presence (myapp/presence.py), token
+# versions (myapp/authentication.py) and throttle counters
+# (myapp/throttling.py). Note payloads and their change stamps
+# (myapp/cache.py) get their own 'notes' cache, so big payloads can never
+# crowd those out. LocMemCache drops a third of its entries once it holds
+# MAX_ENTRIES, which would lose heartbeats and reset rate limits.
+#
+# Without REDIS_URL every worker process has its own change stamps: after a
+# write, the other workers keep answering 304 for the old payload (and
+# serving it from their cache to anonymous readers) until their stamps
+# expire, NOTES_STAMP_TIMEOUT seconds later. Set REDIS_URL whenever more than
+# one worker process serves the API.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+        'notes': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': 'notes',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'default',
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 100_000))},
+        },
+        'notes': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'notes',
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('NOTES_CACHE_MAX_ENTRIES', 5_000))},
+        },
+    }
+NOTES_CACHE_ALIAS = 'notes'
+
+# Seconds an anonymous note payload stays cached (see myapp/cache.py)
+NOTES_CACHE_TIMEOUT = int(os.environ.get('NOTES_CACHE_TIMEOUT', 300))
+# Seconds a change stamp is kept: forever in a shared cache; per process, it
+# bounds how long other workers can miss a change (see CACHES above).
+NOTES_STAMP_TIMEOUT = None if os.environ.get('REDIS_URL') else NOTES_CACHE_TIMEOUT
+
+# Presence (see myapp/presence.py): users seen within ONLINE_WINDOW seconds
+# are online; a background thread writes heartbeats to the DB every
+# PRESENCE_FLUSH_INTERVAL seconds.
+ONLINE_WINDOW = 120
+PRESENCE_FLUSH_INTERVAL = int(os.environ.get('PRESENCE_FLUSH_INTERVAL', 60))
+PRESENCE_FLUSH_IN_BACKGROUND = os.environ.get('PRESENCE_FLUSH_IN_BACKGROUND', '1') == '1'
+
+# Token revocation (see myapp/authentication.py): seconds a user's token
+# version is trusted in-process, and kept in the cache.
+AUTH_VERSION_TTL = int(os.environ.get('AUTH_VERSION_TTL', 5))
+AUTH_VERSION_CACHE_TIMEOUT = int(os.environ.get('AUTH_VERSION_CACHE_TIMEOUT', 60))
+
 REST_FRAMEWORK = {
+    # Trusts the claims in access tokens instead of loading the user per request
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'myapp.authentication.ClaimsJWTAuthentication',
     ),
-    # 'DEFAULT_RENDERER_CLASSES':('rest_framework.renderers.JSONRenderer')
+    # orjson-backed when installed; same bytes as DRF's JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': (
+        'myapp.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Budgets for myapp/throttling.py, counted in THROTTLE_CACHE_ALIAS
+    'DEFAULT_THROTTLE_RATES': {
+        'login': os.environ.get('THROTTLE_LOGIN', '20/min'),
+        'login_account': os.environ.get('THROTTLE_LOGIN_ACCOUNT', '5/min'),
+        'password_reset': os.environ.get('THROTTLE_PASSWORD_RESET', '10/hour'),
+        'password_reset_account': os.environ.get('THROTTLE_PASSWORD_RESET_ACCOUNT', '3/hour'),
+        'search': os.environ.get('THROTTLE_SEARCH', '60/min'),
+        'rating': os.environ.get('THROTTLE_RATING', '30/min'),
+    },
+    # Trusted proxies in front of the app. 0 keys throttles on REMOTE_ADDR;
+    # behind a reverse proxy or load balancer set it to the number of hops,
+    # so the client IP is taken from X-Forwarded-For. (None would trust the
+    # header as sent, letting clients dodge the per-IP limits.)
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
 }
+THROTTLE_CACHE_ALIAS = 'default'
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -128,6 +209,24 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing (see myapp/hashers.py). New and upgraded hashes use
+# PASSWORD_HASHER: 'argon2' (needs argon2-cffi; the default when installed)
+# or 'pbkdf2'. Hashes from the other one still verify and are re-hashed on
+# the next successful login, as are hashes made with a different cost.
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'argon2' if find_spec('argon2') else 'pbkdf2')
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 19 * 1024))  # KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 1))
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 1_000_000))
+PASSWORD_HASHERS = [
+    'myapp.hashers.Argon2PasswordHasher',
+    'myapp.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if PASSWORD_HASHER == 'pbkdf2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -162,6 +261,13 @@ EMAIL_PORT=587
 EMAIL_HOST_USER=os.environ.get('EMAIL_USER')
 EMAIL_HOST_PASSWORD=os.environ.get('EMAIL_PASS')
 EMAIL_USE_TLS=True
+EMAIL_TIMEOUT=30
+DEFAULT_FROM_EMAIL=EMAIL_HOST_USER or 'webmaster@localhost'
+
+# Email is queued and sent by a background thread after commit over a reused
+# SMTP connection (see myapp/outbox.py); `manage.py send_queued_email` also
+# drains the queue.
+EMAIL_OUTBOX_IN_BACKGROUND = os.environ.get('EMAIL_OUTBOX_IN_BACKGROUND', '1') == '1'
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
@@ -195,7 +301,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
-    "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
+    "TOKEN_OBTAIN_SERIALIZER": "myapp.serializers.ClaimsTokenObtainPairSerializer",
     "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
@@ -214,8 +320,31 @@ CORS_ALLOWED_ORIGINS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Let the front proxy send attachment bytes (see myapp/downloads.py):
+# 'X-Accel-Redirect' with an internal nginx location aliasing MEDIA_ROOT at
+# ATTACHMENT_ACCEL_PREFIX, or 'X-Sendfile'. Unset, Django serves them itself.
+ATTACHMENT_SENDFILE = os.environ.get('ATTACHMENT_SENDFILE') or None
+ATTACHMENT_ACCEL_PREFIX = os.environ.get('ATTACHMENT_ACCEL_PREFIX', '/protected-media/')
+
+# Resumable uploads (see myapp/uploads.py): largest attachment and chunk in
+# bytes, and seconds before an unfinished upload is purged.
+ATTACHMENT_UPLOAD_MAX_SIZE = int(os.environ.get('ATTACHMENT_UPLOAD_MAX_SIZE', 100 * 1024 * 1024))
+ATTACHMENT_UPLOAD_CHUNK_SIZE = int(os.environ.get('ATTACHMENT_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+ATTACHMENT_UPLOAD_EXPIRY = 24 * 60 * 60
+
+# Delete removed attachment files from a background thread after commit
+# (see myapp/cleanup.py); `manage.py process_file_deletions` also drains the queue.
+FILE_CLEANUP_IN_BACKGROUND = os.environ.get('FILE_CLEANUP_IN_BACKGROUND', '1') == '1'
+
+# Attachment thumbnails / PDF previews (see myapp/previews.py; needs Pillow,
+# and PyMuPDF for PDFs): worker processes, 0 to only use `generate_previews`.
+PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+
 STORAGES = {
-    # ...
+    # Uploaded files, under MEDIA_ROOT
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
     },
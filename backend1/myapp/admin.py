@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Note, NoteAttachment
+from .models import User, Note, NoteAttachment, AttachmentBlob, OutboundEmail
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
 
@@ -7,7 +7,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 class NoteAttachmentInline(admin.TabularInline):
     model = NoteAttachment
     extra = 1
-    fields = ('file', 'uploaded_at')
+    fields = ('file', 'name', 'uploaded_at')
     readonly_fields = ('uploaded_at',)
 
 
@@ -43,10 +43,6 @@ class UserAdmin(BaseUserAdmin):
     filter_horizontal = ()
     inlines = [NoteInline]
 
-    def notes_count(self, obj):
-        return obj.notes.count()
-    notes_count.short_description = "Notes"
-
 
 admin.site.register(User, UserAdmin)
 
@@ -62,5 +58,21 @@ class NoteAdmin(admin.ModelAdmin):
 
 @admin.register(NoteAttachment)
 class NoteAttachmentAdmin(admin.ModelAdmin):
-    list_display = ("note", "file", "uploaded_at")
+    list_display = ("note", "name", "file", "uploaded_at")
     list_filter = ("uploaded_at",)
+    raw_id_fields = ("blob",)
+
+
+@admin.register(AttachmentBlob)
+class AttachmentBlobAdmin(admin.ModelAdmin):
+    list_display = ("sha256", "size", "ref_count", "created_at")
+    search_fields = ("sha256",)
+    readonly_fields = ("sha256", "size", "file", "ref_count", "created_at")
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "to_email", "attempts", "next_attempt_at", "created_at")
+    list_filter = ("created_at",)
+    search_fields = ("to_email", "subject")
+    readonly_fields = ("created_at",)
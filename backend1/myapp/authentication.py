@@ -0,0 +1,118 @@
+"""
+Stateless JWT authentication.
+
+Tokens issued by the app (get_tokens_for_user and api/token/) carry the
+claims request handling needs: the user id, is_admin, is_active and the
+user's token_version. ClaimsJWTAuthentication trusts them for the token's
+lifetime instead of loading the User row on every request: request.user is
+a User with only those fields loaded, and the rest of the row is read, in
+one query, the first time a view touches any other field. Saving it never
+writes the claim fields back, since they may predate a deactivation.
+
+Revocation: User.token_version goes up whenever is_active or is_admin
+changes, which invalidates every token issued before. The current version
+is read through a small in-process cache (AUTH_VERSION_TTL seconds) backed
+by the Django cache, and saving or deleting a user drops both entries after
+commit. With a shared cache (REDIS_URL) a deactivation therefore reaches
+every worker within AUTH_VERSION_TTL seconds; with the in-process default,
+within AUTH_VERSION_CACHE_TIMEOUT. A user costs at most one query per
+cache timeout.
+
+Tokens without the version claim (issued before this existed) fall back to
+simplejwt's per-request lookup until they expire.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+VERSION_CLAIM = 'ver'
+# Seconds a version is trusted from the in-process cache
+AUTH_VERSION_TTL = getattr(settings, 'AUTH_VERSION_TTL', 5)
+# Seconds a version stays in the Django cache
+AUTH_VERSION_CACHE_TIMEOUT = getattr(settings, 'AUTH_VERSION_CACHE_TIMEOUT', 60)
+AUTH_VERSION_LOCAL_SIZE = 10000
+# Cached for users that are gone or inactive
+REVOKED = -1
+
+_local = OrderedDict()
+_lock = threading.Lock()
+
+
+def _key(user_id):
+    return f'auth:version:{user_id}'
+
+
+class ClaimsRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        # Copied into every access token made from this refresh token
+        token['is_admin'] = user.is_admin
+        token['is_active'] = user.is_active
+        token[VERSION_CLAIM] = user.token_version
+        return token
+
+
+def token_version(user_id):
+    """Current token version of an active user; None if inactive or deleted."""
+    now = time.monotonic()
+    with _lock:
+        entry = _local.get(user_id)
+    if entry is not None and entry[0] > now:
+        version = entry[1]
+    else:
+        version = cache.get(_key(user_id))
+        if version is None:
+            from myapp.models import User
+            row = User.objects.filter(pk=user_id).values_list('token_version', 'is_active').first()
+            version = row[0] if row and row[1] else REVOKED
+            cache.set(_key(user_id), version, AUTH_VERSION_CACHE_TIMEOUT)
+        with _lock:
+            _local[user_id] = (now + AUTH_VERSION_TTL, version)
+            _local.move_to_end(user_id)
+            while len(_local) > AUTH_VERSION_LOCAL_SIZE:
+                _local.popitem(last=False)
+    return None if version == REVOKED else version
+
+
+def forget(user_id):
+    """Drop the cached version of a user once the current transaction commits."""
+    def drop():
+        cache.delete(_key(user_id))
+        with _lock:
+            _local.pop(user_id, None)
+    transaction.on_commit(drop)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        from myapp.models import User
+        try:
+            # simplejwt stores the id as a string
+            user_id = User._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError) as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        version = token_version(user_id)
+        if version is None or version != validated_token[VERSION_CLAIM]:
+            raise AuthenticationFailed(_("Token has been revoked"), code='token_revoked')
+
+        return User.from_claims(
+            id=user_id,
+            is_admin=validated_token.get('is_admin', False),
+            is_active=validated_token.get('is_active', True),
+            token_version=version,
+        )
@@ -0,0 +1,69 @@
+"""
+Helpers shared by the benchmark_* management commands.
+
+The commands build a synthetic data set inside a transaction, time the code
+paths being compared against it and roll everything back, so they can be
+pointed at any database without leaving rows behind.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+WORDS = (
+    'algebra', 'biology', 'chapter', 'database', 'economics', 'formula', 'geometry',
+    'history', 'index', 'journal', 'kernel', 'lecture', 'matrix', 'network',
+    'outline', 'physics', 'question', 'revision', 'summary', 'theorem', 'unit',
+    'vector', 'workshop', 'exam', 'yearbook', 'zoology', 'programming', 'python',
+    'django', 'meeting', 'project', 'budget', 'recipe', 'travel', 'reading',
+)
+
+
+def text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def rng(seed=0):
+    return random.Random(seed)
+
+
+@contextmanager
+def rolled_back():
+    """A transaction that is always rolled back, for synthetic data."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def analyze(*models):
+    """Refresh planner statistics after a bulk insert (PostgreSQL only)."""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def timings(fn, runs):
+    """Seconds each of `runs` calls of fn() took."""
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def latency(samples):
+    """'p50 … ms, p99 … ms' for a list of timings in seconds."""
+    return (
+        f"p50 {percentile(samples, 50) * 1000:.2f} ms, "
+        f"p99 {percentile(samples, 99) * 1000:.2f} ms"
+    )
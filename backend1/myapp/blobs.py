@@ -0,0 +1,210 @@
+"""
+Content-addressed attachment storage.
+
+Every attachment body is hashed (SHA-256) while it is written, and stored
+once as an AttachmentBlob under blobs/<aa>/<bb>/<sha256><ext> no matter how
+many notes carry it. NoteAttachment.file points at the blob's file and
+NoteAttachment.name keeps the name it was uploaded under, so URLs and
+downloads work as before. Blob paths no longer depend on the note's slug.
+
+Each NoteAttachment holds one reference: attach() takes it, and the
+post_delete signal gives it back (also for cascading deletes). Blobs left
+without references are removed by collect_garbage(), run from the
+`collect_attachment_blobs` command, which also reports the bytes saved;
+their files are deleted through the cleanup queue (myapp/cleanup.py).
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Sum
+
+from myapp import cleanup, previews
+
+READ_SIZE = 64 * 1024
+# Longer extensions are dropped from the stored name (it still has the hash)
+MAX_EXTENSION = 16
+
+
+class SpooledFile(File):
+    """A file on local disk that storage may move into place instead of copying."""
+    # FileSystemStorage moves files that expose temporary_file_path()
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def blob_name(sha256, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if len(ext) > MAX_EXTENSION:
+        ext = ''
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for data in iter(lambda: fh.read(READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _hash_content(content):
+    """
+    (sha256, size, file to store) for an uploaded or in-memory File, reading
+    it once. Large files that are not on disk yet are spooled to a temporary
+    file while being hashed, so storing them later is a move, not a re-read.
+    """
+    if hasattr(content, 'temporary_file_path'):
+        path = content.temporary_file_path()
+        return file_sha256(path), os.path.getsize(path), content
+
+    digest = hashlib.sha256()
+    size = content.size
+    if size is not None and size <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest(), size, content
+
+    spool = tempfile.NamedTemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR, suffix='.blob', delete=False)
+    size = 0
+    with spool:
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+            spool.write(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size, SpooledFile(open(spool.name, 'rb'))
+
+
+def _discard(content):
+    # Spooled copies are ours to remove; Django cleans up its own uploads
+    if isinstance(content, SpooledFile):
+        content.close()
+        if os.path.exists(content.file.name):
+            os.remove(content.file.name)
+
+
+def ingest(content, filename, sha256=None):
+    """
+    Take a reference on the blob holding `content`, storing it first if this
+    is the first copy. `sha256` may be passed when the caller already hashed
+    the content. Call inside a transaction with the row that keeps the ref.
+    """
+    from myapp.models import AttachmentBlob
+    if sha256 is None:
+        sha256, size, content = _hash_content(content)
+    else:
+        size = content.size
+
+    try:
+        updated = AttachmentBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+        if updated:
+            return AttachmentBlob.objects.get(sha256=sha256)
+
+        blob = AttachmentBlob(sha256=sha256, size=size, ref_count=1)
+        blob.file.save(blob_name(sha256, filename), content, save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # Someone stored the same content at the same time; use theirs
+            blob.file.delete(save=False)
+            AttachmentBlob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+            return AttachmentBlob.objects.get(sha256=sha256)
+        previews.schedule(blob)
+        return blob
+    finally:
+        _discard(content)
+
+
+def attach(attachment, sha256=None):
+    """Point an unsaved NoteAttachment's pending upload at its blob."""
+    name = os.path.basename(attachment.file.name)
+    blob = ingest(attachment.file.file, name, sha256=sha256)
+    attachment.blob = blob
+    attachment.name = attachment.name or name
+    attachment.file = blob.file.name
+
+
+def release(blob_id):
+    """Drop one reference; the blob itself goes with the next sweep."""
+    from myapp.models import AttachmentBlob
+    AttachmentBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+
+
+def collect_garbage(dry_run=False):
+    """Delete blobs nothing references any more. Returns (blobs, bytes) freed."""
+    from myapp.models import AttachmentBlob, NoteAttachment
+    count = freed = 0
+    candidates = AttachmentBlob.objects.filter(ref_count__lte=0).values_list('pk', flat=True)
+    for pk in list(candidates.iterator()):
+        with transaction.atomic():
+            # Re-check under the row lock: an upload may have just reused it
+            blob = (
+                AttachmentBlob.objects.select_for_update()
+                .filter(pk=pk, ref_count__lte=0)
+                .exclude(Exists(NoteAttachment.objects.filter(blob=OuterRef('pk'))))
+                .first()
+            )
+            if blob is None:
+                continue
+            count += 1
+            freed += blob.size
+            if dry_run:
+                continue
+            blob.delete()
+            cleanup.schedule_delete(blob.file.name, *(blob.previews or {}).values())
+    return count, freed
+
+
+def adopt_legacy():
+    """
+    Move attachments stored before blobs existed into blob storage, deleting
+    their old copies. Returns the number of attachments adopted.
+    """
+    from myapp.models import NoteAttachment
+    adopted = 0
+    legacy = NoteAttachment.objects.filter(blob__isnull=True).exclude(file='')
+    for attachment in legacy.iterator():
+        storage = attachment.file.storage
+        old_name = attachment.file.name
+        if not storage.exists(old_name):
+            continue
+        with transaction.atomic():
+            with storage.open(old_name, 'rb') as fh:
+                sha256 = hashlib.sha256()
+                for chunk in iter(lambda: fh.read(READ_SIZE), b''):
+                    sha256.update(chunk)
+                fh.seek(0)
+                blob = ingest(File(fh, name=old_name), os.path.basename(old_name), sha256=sha256.hexdigest())
+            NoteAttachment.objects.filter(pk=attachment.pk).update(
+                blob=blob, name=attachment.name or os.path.basename(old_name), file=blob.file.name,
+            )
+            # Only deleted if no other attachment still uses the old name
+            cleanup.schedule_delete(old_name)
+        adopted += 1
+    return adopted
+
+
+def usage():
+    """
+    Storage totals: `stored` bytes on disk in blobs, `logical` bytes the
+    referencing attachments add up to, and `saved` = logical - stored.
+    """
+    from myapp.models import AttachmentBlob
+    live = AttachmentBlob.objects.filter(ref_count__gt=0)
+    totals = live.aggregate(stored=Sum('size'), logical=Sum(F('size') * F('ref_count')))
+    stored = totals['stored'] or 0
+    logical = totals['logical'] or 0
+    return {
+        'blobs': live.count(),
+        'stored': stored,
+        'logical': logical,
+        'saved': logical - stored,
+    }
@@ -0,0 +1,303 @@
+"""
+Bulk note operations, for imports and multi-select actions.
+
+    POST notes/bulk/
+    {
+        "create":     [{"title", "body", "category"?}, ...],
+        "update":     [{"slug", "title"?, "body"?, "category"?}, ...],
+        "delete":     ["slug", ...],
+        "bookmark":   ["slug", ...],
+        "unbookmark": ["slug", ...],
+        "rate":       [{"slug", "value"}, ...]
+    }
+
+Every section is optional; they are applied in that order, in one
+transaction. Each section costs a fixed number of queries however many
+items it has: one serializer validates all items, new notes get their slugs
+allocated up front and are inserted with bulk_create(), edits are written
+with bulk_update(), and bookmarks and ratings with set-based INSERT, UPDATE
+and DELETE statements. What the per-note signals would have done
+(notes_count, rating aggregates, search vectors, cache stamps) is done once
+per section instead. Deletes still go through the ORM collector, so
+attachments and counters are released as for single deletes.
+
+The response has one result per item, in request order, with an HTTP-like
+`status`: 201/200/204 when applied, 400 with `errors` for an invalid item,
+403 for someone else's note, 404 for an unknown slug. Invalid items do not
+stop the valid ones.
+"""
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from rest_framework import serializers
+
+from myapp import cache
+
+NOTES_BULK_MAX_ITEMS = getattr(settings, 'NOTES_BULK_MAX_ITEMS', 1000)
+SECTIONS = ('create', 'update', 'delete', 'bookmark', 'unbookmark', 'rate')
+
+
+def _invalid(errors):
+    return {'status': 400, 'errors': errors}
+
+
+def _not_found(slug):
+    return {'status': 404, 'slug': slug, 'errors': {'slug': ['Note not found.']}}
+
+
+def _forbidden(slug):
+    return {'status': 403, 'slug': slug, 'errors': {'slug': ['You do not have permission to modify this note.']}}
+
+
+def _slug(item):
+    value = item.get('slug') if isinstance(item, dict) else item
+    return value if isinstance(value, str) and value else None
+
+
+def _can_modify(user, note):
+    return note.user_id == user.pk or user.is_admin
+
+
+def _touch_notes(notes):
+    scopes = {cache.all_notes_scope()}
+    for note in notes:
+        scopes.update((cache.user_scope(note.user_id), cache.note_scope(note.pk)))
+    cache.touch(*scopes)
+
+
+def _sum_by_note(deltas):
+    return Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def create_notes(user, items):
+    from myapp.models import Note, User
+    from myapp.serializers import NoteBulkItemSerializer
+    serializer = NoteBulkItemSerializer()
+    results = [None] * len(items)
+    notes, positions = [], []
+    for i, item in enumerate(items):
+        try:
+            data = serializer.run_validation(item)
+        except serializers.ValidationError as exc:
+            results[i] = _invalid(exc.detail)
+            continue
+        notes.append(Note(user=user, **data))
+        positions.append(i)
+    if not notes:
+        return results
+
+    for attempt in range(Note.SLUG_MAX_ATTEMPTS):
+        Note.allocate_slugs(notes)
+        try:
+            with transaction.atomic():
+                Note.objects.bulk_create(notes)
+            break
+        except IntegrityError:
+            # Someone took one of the slugs meanwhile; allocate again
+            if attempt + 1 == Note.SLUG_MAX_ATTEMPTS:
+                raise
+
+    ids = [note.pk for note in notes]
+    Note.objects.filter(pk__in=ids).update_search_vector()
+    User.objects.filter(pk=user.pk).update(notes_count=F('notes_count') + len(notes))
+    cache.touch(cache.all_notes_scope(), cache.user_scope(user.pk))
+    for i, note in zip(positions, notes):
+        results[i] = {'status': 201, 'id': note.pk, 'slug': note.slug}
+    return results
+
+
+def update_notes(user, items):
+    from myapp.models import Note
+    from myapp.serializers import NoteBulkItemSerializer
+    serializer = NoteBulkItemSerializer(partial=True)
+    found = Note.objects.in_bulk({s for s in map(_slug, items) if s}, field_name='slug')
+    now = timezone.now()
+    results, changed = [], {}
+    for item in items:
+        slug = _slug(item)
+        if slug is None or not isinstance(item, dict):
+            results.append(_invalid({'slug': ['This field is required.']}))
+            continue
+        note = found.get(slug)
+        if note is None:
+            results.append(_not_found(slug))
+            continue
+        if not _can_modify(user, note):
+            results.append(_forbidden(slug))
+            continue
+        try:
+            data = serializer.run_validation(item)
+        except serializers.ValidationError as exc:
+            results.append({**_invalid(exc.detail), 'slug': slug})
+            continue
+        for field, value in data.items():
+            setattr(note, field, value)
+        note.updated_at = now
+        changed[note.pk] = note
+        results.append({'status': 200, 'id': note.pk, 'slug': slug})
+
+    if changed:
+        Note.objects.bulk_update(changed.values(), ['title', 'body', 'category', 'updated_at'])
+        Note.objects.filter(pk__in=changed).update_search_vector()
+        _touch_notes(changed.values())
+    return results
+
+
+def delete_notes(user, slugs):
+    from myapp.models import Note
+    found = Note.objects.in_bulk({s for s in map(_slug, slugs) if s}, field_name='slug')
+    results, doomed = [], set()
+    for item in slugs:
+        slug = _slug(item)
+        note = found.get(slug) if slug else None
+        if slug is None:
+            results.append(_invalid({'slug': ['A slug is required.']}))
+        elif note is None:
+            results.append(_not_found(slug))
+        elif not _can_modify(user, note):
+            results.append(_forbidden(slug))
+        else:
+            doomed.add(note.pk)
+            results.append({'status': 204, 'slug': slug})
+    if doomed:
+        # The collector runs the usual delete signals (counters, files, cache)
+        Note.objects.filter(pk__in=doomed).delete()
+    return results
+
+
+def set_bookmarks(user, slugs, bookmarked):
+    from myapp.models import Note
+    through = Note.bookmarks.through
+    ids = dict(Note.objects.filter(slug__in={s for s in map(_slug, slugs) if s}).values_list('slug', 'pk'))
+    if ids:
+        if bookmarked:
+            through.objects.bulk_create(
+                [through(note_id=pk, user_id=user.pk) for pk in set(ids.values())],
+                ignore_conflicts=True,
+            )
+        else:
+            through.objects.filter(user_id=user.pk, note_id__in=ids.values()).delete()
+        # Bookmarks only show up in the user's own payloads
+        cache.touch(cache.viewer_scope(user.pk))
+
+    results = []
+    for item in slugs:
+        slug = _slug(item)
+        if slug is None:
+            results.append(_invalid({'slug': ['A slug is required.']}))
+        elif slug not in ids:
+            results.append(_not_found(slug))
+        else:
+            results.append({'status': 200 if bookmarked else 204, 'slug': slug})
+    return results
+
+
+def rate_notes(user, items):
+    from myapp.models import Note, NoteRating
+    from myapp.serializers import NoteRatingSerializer
+    serializer = NoteRatingSerializer()
+    found = {
+        slug: (pk, author)
+        for slug, pk, author in Note.objects.filter(slug__in={s for s in map(_slug, items) if s})
+        .values_list('slug', 'pk', 'user_id')
+    }
+    results, wanted = [], {}
+    for item in items:
+        slug = _slug(item)
+        if slug is None or not isinstance(item, dict):
+            results.append(_invalid({'slug': ['This field is required.']}))
+            continue
+        if slug not in found:
+            results.append(_not_found(slug))
+            continue
+        try:
+            value = serializer.run_validation(item)['value']
+        except serializers.ValidationError as exc:
+            results.append({**_invalid(exc.detail), 'slug': slug})
+            continue
+        # The last rating given for a note wins
+        wanted[found[slug][0]] = value
+        results.append({'status': 200, 'slug': slug, 'value': value})
+    if not wanted:
+        return results
+
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            existing = {
+                rating.note_id: rating
+                for rating in NoteRating.objects.select_for_update().filter(user=user, note_id__in=wanted)
+            }
+            added, changed, sums, counts = [], [], {}, {}
+            for pk, value in wanted.items():
+                rating = existing.get(pk)
+                if rating is None:
+                    added.append(NoteRating(note_id=pk, user=user, value=value))
+                    sums[pk], counts[pk] = value, 1
+                elif rating.value != value:
+                    sums[pk] = value - rating.value
+                    rating.value = value
+                    rating.updated_at = now
+                    changed.append(rating)
+            NoteRating.objects.bulk_create(added)
+            NoteRating.objects.bulk_update(changed, ['value', 'updated_at'])
+            if sums:
+                Note.objects.filter(pk__in=sums).update(
+                    rating_sum=F('rating_sum') + _sum_by_note(sums),
+                    rating_count=F('rating_count') + _sum_by_note(counts),
+                )
+    except IntegrityError:
+        # A single-note rating request created one of them meanwhile
+        conflict = {'status': 409, 'errors': {'detail': ['Ratings changed concurrently; retry.']}}
+        return [r if r['status'] != 200 else {**conflict, 'slug': r['slug']} for r in results]
+
+    scopes = {cache.viewer_scope(user.pk), cache.all_notes_scope()}
+    for pk, author in found.values():
+        if pk in sums:
+            scopes.update((cache.user_scope(author), cache.note_scope(pk)))
+    cache.touch(*scopes)
+    return results
+
+
+def apply(user, payload):
+    """
+    Run the sections of a bulk request in one transaction. Returns
+    {section: [result per item]} for the sections present.
+    """
+    if not isinstance(payload, dict) or not set(payload) & set(SECTIONS):
+        raise serializers.ValidationError(
+            {'non_field_errors': [f"Expected at least one of: {', '.join(SECTIONS)}."]}
+        )
+    errors = {
+        section: ['Expected a list.']
+        for section in SECTIONS
+        if section in payload and not isinstance(payload[section], list)
+    }
+    if errors:
+        raise serializers.ValidationError(errors)
+    total = sum(len(payload.get(section, ())) for section in SECTIONS)
+    if total > NOTES_BULK_MAX_ITEMS:
+        raise serializers.ValidationError(
+            {'non_field_errors': [f'At most {NOTES_BULK_MAX_ITEMS} items per request.']}
+        )
+
+    operations = {
+        'create': lambda items: create_notes(user, items),
+        'update': lambda items: update_notes(user, items),
+        'delete': lambda items: delete_notes(user, items),
+        'bookmark': lambda items: set_bookmarks(user, items, True),
+        'unbookmark': lambda items: set_bookmarks(user, items, False),
+        'rate': lambda items: rate_notes(user, items),
+    }
+    results = {}
+    with transaction.atomic():
+        for section in SECTIONS:
+            if section in payload:
+                results[section] = operations[section](payload[section])
+    return results
@@ -0,0 +1,132 @@
+"""
+Conditional GETs for note and profile payloads, and a payload cache for
+anonymous readers.
+
+Every payload belongs to one or more scopes ("all notes", "notes of
+user 7", "note 42"). A scope's value in the cache is the time it last
+changed; model signals touch the affected scopes after each write commits.
+ETags and cache keys are derived from those timestamps, so a write makes the
+old entries unreachable instead of having to find and delete them, and a 304
+can be answered without touching the database for the payload.
+
+The backend is whatever NOTES_CACHE_ALIAS points to in CACHES: the in-process
+LocMemCache by default, or Redis when REDIS_URL is set so that every worker
+sees the same invalidations. In-process stamps are only touched in the worker
+that made the write; the others keep validating old ETags until their stamps
+expire after NOTES_STAMP_TIMEOUT seconds, so run more than one worker only
+with a shared cache.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+NOTES_CACHE_ALIAS = getattr(settings, 'NOTES_CACHE_ALIAS', 'default')
+NOTES_CACHE_TIMEOUT = getattr(settings, 'NOTES_CACHE_TIMEOUT', 300)
+# None keeps stamps until evicted
+NOTES_STAMP_TIMEOUT = getattr(settings, 'NOTES_STAMP_TIMEOUT', None)
+
+
+def _cache():
+    return caches[NOTES_CACHE_ALIAS]
+
+
+def all_notes_scope():
+    return 'notes:changed:all'
+
+
+def user_scope(user_id):
+    return f'notes:changed:user:{user_id}'
+
+
+def note_scope(note_id):
+    return f'notes:changed:note:{note_id}'
+
+
+def profile_scope(user_id):
+    # Profile fields of a user (bio, role, ...) other than name/email
+    return f'notes:changed:profile:{user_id}'
+
+
+def viewer_scope(user_id):
+    # Per-user state rendered into payloads: their ratings and bookmarks
+    return f'notes:changed:viewer:{user_id}'
+
+
+def last_changed(*scopes):
+    """Latest change time across `scopes`, as a float timestamp."""
+    cache = _cache()
+    stamps = cache.get_many(scopes)
+    missing = [s for s in scopes if s not in stamps]
+    if missing:
+        # Unknown or evicted scope: assume it just changed. This can only
+        # cause a spurious miss, never a stale hit.
+        now = time.time()
+        for scope in missing:
+            cache.add(scope, now, NOTES_STAMP_TIMEOUT)
+        stamps.update(cache.get_many(missing))
+    return max(stamps.values(), default=0.0)
+
+
+def touch(*scopes):
+    """Mark `scopes` as changed once the current transaction commits."""
+    def _touch():
+        now = time.time()
+        _cache().set_many({scope: now for scope in scopes}, NOTES_STAMP_TIMEOUT)
+    transaction.on_commit(_touch)
+
+
+def touch_note(note_id, user_id):
+    touch(all_notes_scope(), user_scope(user_id), note_scope(note_id))
+
+
+def conditional_response(request, scopes, build, last_modified=(), extra='', stream=None):
+    """
+    Answer a GET for the payload produced by `build()`, returning 304 when the
+    client's ETag / If-Modified-Since still matches. Validators come from the
+    change stamps of `scopes` (plus `last_modified` datetimes and any `extra`
+    state the payload depends on), so no serialization happens on a 304.
+
+    Anonymous payloads are also cached. Authenticated payloads carry per-user
+    fields (user_rating, is_bookmarked), so they depend on the viewer's own
+    scope and are always built fresh, through `stream()` when one is given.
+    """
+    user = request.user
+    authenticated = user.is_authenticated
+    if authenticated:
+        scopes = [*scopes, viewer_scope(user.pk)]
+
+    changed = last_changed(*scopes)
+    for value in last_modified:
+        if value is not None:
+            changed = max(changed, value.timestamp())
+    url = request.build_absolute_uri()
+    viewer = user.pk if authenticated else ''
+    digest = hashlib.md5(f'{url}|{viewer}|{changed!r}|{extra}'.encode()).hexdigest()
+    etag = f'W/"{digest}"'
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(changed))
+    if not_modified is not None:
+        response = not_modified
+    elif authenticated:
+        response = stream() if stream is not None else Response(build())
+    else:
+        key = f'notes:payload:{digest}'
+        payload = _cache().get(key)
+        if payload is None:
+            payload = build()
+            _cache().set(key, payload, NOTES_CACHE_TIMEOUT)
+        response = Response(payload)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(int(changed))
+    patch_vary_headers(response, ['Authorization'])
+    if authenticated:
+        patch_cache_control(response, private=True)
+    return response
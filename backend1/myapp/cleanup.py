@@ -0,0 +1,170 @@
+"""
+Deferred deletion of attachment files.
+
+Deleting an attachment (directly, through a note or user cascade, or when a
+blob is swept) queues its file as a FileDeletion row in the same
+transaction; nothing is unlinked inside the request. Once the transaction
+commits, a background thread in the process drains the queue in batches.
+`manage.py process_file_deletions` does the same from cron, and picks up
+anything a worker left behind. Files that an attachment or blob still
+points at are never deleted, so queueing a name twice or re-using it is
+harmless.
+
+scan_orphans() reconciles MEDIA_ROOT against the NoteAttachment and
+AttachmentBlob tables for files that no row refers to (for example from
+before this queue existed). It walks the tree lazily and looks names up in
+batches, so its memory use does not grow with the number of files.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+# Drain the queue from a background thread after each commit; with False,
+# only `process_file_deletions` does.
+FILE_CLEANUP_IN_BACKGROUND = getattr(settings, 'FILE_CLEANUP_IN_BACKGROUND', True)
+FILE_CLEANUP_BATCH_SIZE = 500
+# Give up on a file after this many failed deletes
+FILE_CLEANUP_MAX_ATTEMPTS = 5
+# Managed by myapp.uploads; never treated as orphans
+SKIP_DIRS = ('uploads',)
+
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def schedule_delete(*names):
+    """Queue stored files for deletion once the current transaction commits."""
+    from myapp.models import FileDeletion
+    names = [name for name in names if name]
+    if not names:
+        return
+    FileDeletion.objects.bulk_create([FileDeletion(name=name) for name in names])
+    if FILE_CLEANUP_IN_BACKGROUND:
+        transaction.on_commit(_wake)
+
+
+def _wake():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='file-cleanup', daemon=True)
+            _worker.start()
+    _wakeup.set()
+
+
+def _run():
+    while True:
+        _wakeup.wait()
+        _wakeup.clear()
+        try:
+            process_pending()
+        except Exception:
+            logger.exception("File cleanup failed")
+        finally:
+            close_old_connections()
+
+
+def referenced(names):
+    """The subset of `names` some attachment or blob still stores a file under."""
+    from myapp.models import AttachmentBlob, NoteAttachment
+    from myapp.previews import is_preview_name
+    names = list(names)
+    found = set(NoteAttachment.objects.filter(file__in=names).values_list('file', flat=True))
+    found.update(AttachmentBlob.objects.filter(file__in=names).values_list('file', flat=True))
+    # Previews belong to the blob whose hash starts their name
+    preview_hashes = {}
+    for name in names:
+        if is_preview_name(name):
+            preview_hashes.setdefault(os.path.basename(name).split('.', 1)[0], []).append(name)
+    if preview_hashes:
+        live = AttachmentBlob.objects.filter(sha256__in=preview_hashes).values_list('sha256', flat=True)
+        for sha256 in live:
+            found.update(preview_hashes[sha256])
+    return found
+
+
+def process_pending(batch_size=FILE_CLEANUP_BATCH_SIZE, storage=None):
+    """Delete queued files in batches. Returns (deleted, failed)."""
+    from myapp.models import FileDeletion
+    storage = storage or default_storage
+    deleted = failed = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            FileDeletion.objects.filter(pk__gt=last_pk, attempts__lt=FILE_CLEANUP_MAX_ATTEMPTS)
+            .order_by('pk')[:batch_size]
+        )
+        if not batch:
+            return deleted, failed
+        last_pk = batch[-1].pk
+        keep = referenced({row.name for row in batch})
+        done, retry = [], []
+        for row in batch:
+            if row.name in keep:
+                done.append(row.pk)
+                continue
+            try:
+                storage.delete(row.name)
+            except Exception:
+                logger.exception("Could not delete %s", row.name)
+                retry.append(row.pk)
+                failed += 1
+            else:
+                done.append(row.pk)
+                deleted += 1
+        FileDeletion.objects.filter(pk__in=done).delete()
+        if retry:
+            FileDeletion.objects.filter(pk__in=retry).update(attempts=F('attempts') + 1)
+
+
+def _walk(root, prefix=''):
+    # Depth-first, one directory listing in memory at a time
+    with os.scandir(root) as entries:
+        for entry in entries:
+            name = f'{prefix}{entry.name}'
+            if entry.is_dir(follow_symlinks=False):
+                if not prefix and entry.name in SKIP_DIRS:
+                    continue
+                yield from _walk(entry.path, f'{name}/')
+            elif entry.is_file(follow_symlinks=False):
+                yield name, entry
+
+
+def scan_orphans(root=None, min_age=3600, batch_size=1000):
+    """
+    Yield (name, size) for files under MEDIA_ROOT that no attachment or blob
+    refers to. Files younger than `min_age` seconds are skipped, since their
+    row may not have been committed yet.
+    """
+    root = root or settings.MEDIA_ROOT
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - min_age
+    batch = {}
+    for name, entry in _walk(root):
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime > cutoff:
+            continue
+        batch[name] = stat.st_size
+        if len(batch) >= batch_size:
+            yield from _unreferenced(batch)
+            batch = {}
+    if batch:
+        yield from _unreferenced(batch)
+
+
+def _unreferenced(batch):
+    keep = referenced(batch)
+    for name, size in batch.items():
+        if name not in keep:
+            yield name, size
@@ -0,0 +1,143 @@
+"""
+Attachment downloads with HTTP validators and byte ranges.
+
+Every response carries a strong ETag built from the file's size and mtime,
+Last-Modified and Accept-Ranges. A single `Range: bytes=...` is answered
+with a 206 (honouring If-Range), so interrupted downloads resume where they
+stopped. Multi-range requests get the whole file, which RFC 9110 allows.
+
+With ATTACHMENT_SENDFILE set to 'X-Accel-Redirect' (nginx) or 'X-Sendfile'
+(Apache, lighttpd), the view only checks the attachment and hands the
+transfer to the front proxy, which then also deals with ranges. The worker
+returns straight away.
+"""
+
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+# None, 'X-Accel-Redirect' or 'X-Sendfile'
+ATTACHMENT_SENDFILE = getattr(settings, 'ATTACHMENT_SENDFILE', None)
+# Internal nginx location that aliases MEDIA_ROOT (X-Accel-Redirect only)
+ATTACHMENT_ACCEL_PREFIX = getattr(settings, 'ATTACHMENT_ACCEL_PREFIX', '/protected-media/')
+
+CHUNK_SIZE = 64 * 1024
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) for a single `bytes=` range, end inclusive; None to send
+    the whole file (no usable range); ValueError when the range cannot be
+    satisfied.
+    """
+    match = _range_re.match(header.replace(' ', ''))
+    if not match:
+        # Malformed or multi-range: ignore it and send everything
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the final `last` bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # Invalid (RFC 9110 14.1.1), not unsatisfiable: ignore it
+        return None
+    if start >= size:
+        raise ValueError
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def if_range_matches(request, etag, mtime):
+    value = request.headers.get('If-Range')
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith('"'):
+        # Strong comparison
+        return value == etag
+    if value.startswith('W/'):
+        return False
+    modified = parse_http_date_safe(value)
+    return modified is not None and modified == int(mtime)
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, path, filename):
+    """Response for the file at `path`, downloaded as `filename`."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404("File not found")
+    etag = file_etag(stat)
+    mtime = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=mtime)
+    if response is None:
+        content_type = mimetypes.guess_type(filename)[0] or mimetypes.guess_type(path)[0]
+        response = _file_response(request, path, stat.st_size, etag, mtime, content_type)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if response.status_code in (200, 206):
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+def _file_response(request, path, size, etag, mtime, content_type=None):
+    content_type = content_type or 'application/octet-stream'
+
+    if ATTACHMENT_SENDFILE:
+        response = HttpResponse(content_type=content_type)
+        if ATTACHMENT_SENDFILE == 'X-Accel-Redirect':
+            relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            response['X-Accel-Redirect'] = ATTACHMENT_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative)
+        else:
+            response[ATTACHMENT_SENDFILE] = path
+        return response
+
+    header = request.headers.get('Range')
+    span = None
+    if header and request.method in ('GET', 'HEAD') and if_range_matches(request, etag, mtime):
+        try:
+            span = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if span is None:
+        # Whole file: FileResponse lets the server use wsgi.file_wrapper
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    start, end = span
+    length = end - start + 1
+    response = StreamingHttpResponse(_read_range(path, start, length), status=206, content_type=content_type)
+    response['Content-Length'] = str(length)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
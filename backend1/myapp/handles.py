@@ -0,0 +1,80 @@
+"""
+Public profile lookups by handle.
+
+Handles never change once assigned, so each process keeps a small LRU map of
+handle -> user id and resolves hits with a primary-key lookup. Old URLs that
+use an email address or display name are still understood; callers redirect
+them to the handle URL.
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from myapp.models import User
+
+HANDLE_CACHE_SIZE = getattr(settings, 'HANDLE_CACHE_SIZE', 10000)
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+handle_ids = LRUCache(HANDLE_CACHE_SIZE)
+
+
+def get_user_by_handle(handle):
+    user_id = handle_ids.get(handle)
+    if user_id is not None:
+        user = User.objects.filter(pk=user_id, handle=handle).first()
+        if user is not None:
+            return user
+        # Deleted user (and possibly a reused handle): look it up again
+        handle_ids.discard(handle)
+    user = User.objects.filter(handle=handle).first()
+    if user is not None:
+        handle_ids.set(handle, user.pk)
+    return user
+
+
+def resolve_public_user(username):
+    """
+    Returns (user, is_legacy). `is_legacy` is True when `username` matched an
+    email address or display name rather than the user's handle.
+    """
+    user = get_user_by_handle(username)
+    if user is not None:
+        return user, False
+    if '@' in username:
+        user = User.objects.filter(email=username).first()
+    else:
+        # Display names are not unique; the oldest account wins
+        user = User.objects.filter(name=username).order_by('id').first()
+    return user, user is not None
@@ -0,0 +1,26 @@
+"""
+Password hashers with their cost taken from settings.
+
+Django's hashers have the work factor baked into the class. These read it
+from settings (PASSWORD_ARGON2_* and PASSWORD_PBKDF2_ITERATIONS), so the
+cost of a login can be tuned per deployment. Each keeps Django's algorithm
+name, so existing hashes still verify. When a stored hash was made with a
+different hasher or cost, Django re-hashes the password on the next
+successful login (check_password's setter), so changing the settings
+migrates users gradually without a reset.
+"""
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    # OWASP's baseline for argon2id: 19 MiB, 2 passes, 1 lane. Far cheaper
+    # per login than Django's default (100 MiB, 8 lanes) or PBKDF2 at 1M rounds.
+    time_cost = getattr(settings, 'PASSWORD_ARGON2_TIME_COST', 2)
+    memory_cost = getattr(settings, 'PASSWORD_ARGON2_MEMORY_COST', 19 * 1024)
+    parallelism = getattr(settings, 'PASSWORD_ARGON2_PARALLELISM', 1)
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = getattr(settings, 'PASSWORD_PBKDF2_ITERATIONS', hashers.PBKDF2PasswordHasher.iterations)
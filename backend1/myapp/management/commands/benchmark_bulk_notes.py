@@ -0,0 +1,60 @@
+import contextlib
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from myapp import benchmarks, bulk, views
+from myapp.models import Note, User
+
+
+class Command(BaseCommand):
+    help = "Notes per second imported with repeated POST notes/ and with POST notes/bulk/"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = benchmarks.rng()
+        count = options['notes']
+        factory = APIRequestFactory()
+        items = [
+            {'title': benchmarks.text(rng, 4), 'body': benchmarks.text(rng, 60), 'category': 'WORK'}
+            for _ in range(count)
+        ]
+
+        def post(view, path, data, format='json'):
+            request = factory.post(path, data, format=format)
+            force_authenticate(request, user=user)
+            response = view(request)
+            if response.status_code not in (200, 201):
+                raise RuntimeError(f"{path} failed with status {response.status_code}")
+            return response
+
+        def single():
+            # As the frontend sends it; notes() logs every body, keep that out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                for item in items:
+                    post(views.notes, '/api/user/notes/', item, format='multipart')
+
+        def batched():
+            size = bulk.NOTES_BULK_MAX_ITEMS
+            for start in range(0, count, size):
+                post(views.notes_bulk, '/api/user/notes/bulk/', {'create': items[start:start + size]})
+
+        results = {}
+        with benchmarks.rolled_back():
+            user = User.objects.create_user('benchmark-bulk@example.invalid', 'benchmark', True)
+            for label, run in (('POST notes/', single), ('POST notes/bulk/', batched)):
+                started = time.perf_counter()
+                run()
+                results[label] = time.perf_counter() - started
+            created = Note.objects.filter(user=user).count()
+
+        self.stdout.write(f"{count} notes each way ({created} created in total)")
+        for label, elapsed in results.items():
+            self.stdout.write(f"{label}: {count / elapsed:,.0f} notes/s ({elapsed:.2f} s)")
+        speedup = results['POST notes/'] / results['POST notes/bulk/']
+        style = self.style.SUCCESS if speedup >= 10 else self.style.WARNING
+        self.stdout.write(style(f"bulk is {speedup:.1f}x the single-note path"))
@@ -0,0 +1,74 @@
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from myapp import benchmarks, presence
+from myapp.models import User
+from myapp.views import HeartbeatView
+
+
+class Command(BaseCommand):
+    help = "Count User row writes per second from heartbeats, per request and through the presence buffer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--minutes', type=int, default=10)
+        # The frontend pings every 60 seconds
+        parser.add_argument('--interval', type=int, default=60)
+
+    def handle(self, *args, **options):
+        users_count, interval = options['users'], options['interval']
+        seconds = options['minutes'] * 60
+        rounds = seconds // interval
+        view = HeartbeatView.as_view()
+        factory = APIRequestFactory()
+
+        def heartbeat(user):
+            request = factory.post('/api/user/heartbeat/')
+            force_authenticate(request, user=user)
+            view(request)
+
+        def per_request(user):
+            # What HeartbeatView did before the presence buffer
+            user.last_seen = timezone.now()
+            user.save(update_fields=['last_seen'])
+
+        with benchmarks.rolled_back():
+            User.objects.bulk_create(
+                User(email=f'benchmark-heartbeat-{i}@example.invalid', name=f'benchmark {i}',
+                     handle=f'benchmark-heartbeat-{i}', tc=True)
+                for i in range(users_count)
+            )
+            users = list(User.objects.filter(email__startswith='benchmark-heartbeat-'))
+            presence.flush()
+            try:
+                # Simulated time: flushes are driven by run(), not the clock
+                with mock.patch.object(presence, 'PRESENCE_FLUSH_IN_BACKGROUND', False):
+                    before = self.run(users, rounds, interval, per_request)
+                    after = self.run(users, rounds, interval, heartbeat, flush=True)
+            finally:
+                presence._cache().delete_many([presence._key(user.pk) for user in users])
+
+        self.stdout.write(
+            f"{users_count} users, one heartbeat each every {interval}s, {options['minutes']} simulated minutes"
+        )
+        for label, writes in (('per request', before), ('buffered', after)):
+            self.stdout.write(f"{label}: {writes} UPDATEs, {writes / seconds:.2f} writes/s")
+
+    def run(self, users, rounds, interval, beat, flush=False):
+        """UPDATEs issued for `rounds` heartbeats per user."""
+        # Flush whenever PRESENCE_FLUSH_INTERVAL of simulated time has passed
+        flush_every = max(1, presence.PRESENCE_FLUSH_INTERVAL // interval)
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(rounds):
+                for user in users:
+                    beat(user)
+                if flush and (i + 1) % flush_every == 0:
+                    presence.flush()
+            if flush:
+                presence.flush()
+        return sum(1 for query in queries if query['sql'].lstrip().upper().startswith('UPDATE'))
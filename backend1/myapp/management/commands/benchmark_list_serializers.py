@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from myapp import benchmarks
+from myapp.models import Note, NoteAttachment, User
+from myapp.serializers import NoteListSerializer, NoteSerializer
+
+
+class Command(BaseCommand):
+    help = "Rows per second rendering a note list with NoteSerializer and with NoteListSerializer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=5000)
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = benchmarks.rng()
+        count = options['notes']
+
+        with benchmarks.rolled_back():
+            authors = User.objects.bulk_create(
+                User(email=f'benchmark-list-{i}@example.invalid', name=f'Benchmark {i}',
+                     handle=f'benchmark-list-{i}', tc=True)
+                for i in range(20)
+            )
+            viewer = authors[0]
+            notes = Note.objects.bulk_create(
+                (
+                    Note(
+                        user=authors[i % len(authors)], slug=f'benchmark-list-{i}',
+                        title=benchmarks.text(rng, 4), body=benchmarks.text(rng, 60),
+                        rating_sum=rng.randrange(50), rating_count=rng.randrange(1, 10),
+                    )
+                    for i in range(count)
+                ),
+                batch_size=2000,
+            )
+            # Every third note has a couple of attachments; the files need not exist
+            NoteAttachment.objects.bulk_create(
+                (
+                    NoteAttachment(note=note, file=f'notes/benchmark/{note.pk}-{n}.pdf', name=f'file {n}.pdf')
+                    for note in notes[::3] for n in range(2)
+                ),
+                batch_size=2000,
+            )
+            Note.bookmarks.through.objects.bulk_create(
+                Note.bookmarks.through(note_id=note.pk, user_id=viewer.pk) for note in notes[::5]
+            )
+            benchmarks.analyze(Note, NoteAttachment)
+
+            request = Request(APIRequestFactory().get('/api/user/notes/'))
+            request.user = viewer
+            queryset = (
+                Note.objects.filter(user__in=authors)
+                .select_related('user')
+                .prefetch_related('attachments__blob')
+                .with_list_stats(viewer)
+                .order_by('-updated_at', '-created_at', '-id')
+            )
+
+            def model_serializer():
+                return NoteSerializer(queryset.all(), many=True, context={'request': request}).data
+
+            def fast_path():
+                serializer = NoteListSerializer(request)
+                return serializer.to_representation(list(serializer.values(queryset.all())))
+
+            slow = benchmarks.timings(model_serializer, options['runs'])
+            fast = benchmarks.timings(fast_path, options['runs'])
+
+        self.stdout.write(f"{count} notes, queries included")
+        for label, samples in (('NoteSerializer', slow), ('NoteListSerializer', fast)):
+            rate = count / benchmarks.percentile(samples, 50)
+            self.stdout.write(f"{label}: {rate:,.0f} rows/s ({benchmarks.latency(samples)} per list)")
@@ -0,0 +1,48 @@
+import time
+
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from myapp import presence
+from myapp.models import User
+from myapp.views import UserLoginView
+
+
+class Command(BaseCommand):
+    help = "Measure logins per second on one core with the configured password hasher"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=50)
+
+    def handle(self, *args, **options):
+        count = options['logins']
+        hasher = get_hasher()
+        # Without the login throttles, which would stop it after a few logins
+        view = UserLoginView.as_view(throttle_classes=[])
+        factory = APIRequestFactory()
+        body = {'email': 'benchmark-login@example.invalid', 'password': 'benchmark-password'}
+
+        # Everything the benchmark writes is rolled back at the end
+        with transaction.atomic():
+            User.objects.create_user(name='benchmark', tc=True, **body)
+            # The first login may re-hash the password; leave it out
+            response = view(factory.post('/api/user/login/', body, format='json'))
+            started = time.perf_counter()
+            for _ in range(count):
+                response = view(factory.post('/api/user/login/', body, format='json'))
+                if response.status_code != 200:
+                    break
+            presence.flush()
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        if response.status_code != 200:
+            self.stderr.write(f"Login failed with status {response.status_code}")
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{count / elapsed:.1f} logins/s per core with {hasher.algorithm} "
+            f"({elapsed / count * 1000:.1f} ms each)"
+        ))
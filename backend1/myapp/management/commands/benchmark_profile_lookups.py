@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from myapp import benchmarks
+from myapp.handles import handle_ids, resolve_public_user
+from myapp.models import User
+
+
+class Command(BaseCommand):
+    help = "Compare public profile lookup latency: by handle (cold and cached) against the old email/name query"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--lookups', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rng = benchmarks.rng()
+        count = options['users']
+
+        with benchmarks.rolled_back():
+            User.objects.bulk_create(
+                (
+                    User(
+                        email=f'benchmark-profile-{i}@example.invalid', name=f'Benchmark {i}',
+                        handle=f'benchmark-profile-{i}', tc=True,
+                    )
+                    for i in range(count)
+                ),
+                batch_size=10_000,
+            )
+            benchmarks.analyze(User)
+            picks = [rng.randrange(count) for _ in range(options['lookups'])]
+
+            def sample(lookup):
+                queue = iter(picks)
+                return benchmarks.timings(lambda: lookup(next(queue)), len(picks))
+
+            # What PublicUserProfileByUsername and notes_by_username used to run
+            legacy = sample(lambda i: User.objects.get(
+                Q(email=f'benchmark-profile-{i}@example.invalid') | Q(name=f'benchmark-profile-{i}')
+            ))
+            handle_ids.clear()
+            cold = sample(lambda i: resolve_public_user(f'benchmark-profile-{i}'))
+            cached = sample(lambda i: resolve_public_user(f'benchmark-profile-{i}'))
+            handle_ids.clear()
+
+        self.stdout.write(f"{count} users, {len(picks)} lookups")
+        self.stdout.write(f"email/name query: {benchmarks.latency(legacy)}")
+        self.stdout.write(f"handle, uncached: {benchmarks.latency(cold)}")
+        self.stdout.write(self.style.SUCCESS(f"handle, cached id: {benchmarks.latency(cached)}"))
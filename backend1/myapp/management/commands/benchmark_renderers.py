@@ -0,0 +1,71 @@
+import json
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from myapp import benchmarks
+from myapp.renderers import FastJSONRenderer, UserRenderer, orjson
+
+
+def legacy_render(data):
+    # UserRenderer.render before the structural error check
+    if 'ErrorDetail' in str(data):
+        return json.dumps({'errors': data})
+    return json.dumps(data)
+
+
+class Command(BaseCommand):
+    help = "Time and measure peak memory of the JSON renderers on a note list payload"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=10_000)
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        rng = benchmarks.rng()
+        notes = [self.note(rng, i) for i in range(options['notes'])]
+        fast = FastJSONRenderer()
+        renderers = {
+            'UserRenderer, before': lambda: legacy_render(notes),
+            'UserRenderer': lambda: UserRenderer().render(notes),
+            'JSONRenderer': lambda: JSONRenderer().render(notes),
+            'FastJSONRenderer': lambda: fast.render(notes),
+            'FastJSONRenderer, streamed': lambda: sum(len(c) for c in fast.render_list_stream(iter(notes))),
+        }
+        expected = JSONRenderer().render(notes)
+        if fast.render(notes) != expected or b''.join(fast.render_list_stream(iter(notes))) != expected:
+            raise CommandError("FastJSONRenderer output differs from JSONRenderer")
+
+        self.stdout.write(
+            f"{len(notes)} notes, {len(expected) / 1e6:.1f} MB of JSON, "
+            f"orjson {'installed' if orjson is not None else 'not installed'}"
+        )
+        for label, render in renderers.items():
+            samples = benchmarks.timings(render, options['runs'])
+            tracemalloc.start()
+            render()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.stdout.write(f"{label}: {benchmarks.latency(samples)}, peak {peak / 1e6:.1f} MB")
+
+    @staticmethod
+    def note(rng, i):
+        # Shaped like a NoteListSerializer row
+        return {
+            'id': i,
+            'title': benchmarks.text(rng, 4),
+            'body': benchmarks.text(rng, 60),
+            'slug': f'note-{i}',
+            'category': 'PERSONAL',
+            'created_at': '2026-10-18T12:00:00.000000Z',
+            'updated_at': '2026-10-18T12:30:00.000000Z',
+            'attachments': [],
+            'username': f'user{i % 50}@example.com',
+            'name': f'User {i % 50}',
+            'handle': f'user-{i % 50}',
+            'avg_rating': round(rng.uniform(1, 5), 1),
+            'ratings_count': rng.randrange(20),
+            'user_rating': None,
+            'is_bookmarked': False,
+        }
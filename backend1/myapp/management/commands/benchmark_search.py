@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from myapp import benchmarks
+from myapp.models import Note, User
+
+
+class Command(BaseCommand):
+    help = "Compare search_notes latency: full-text search against the old icontains filter"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=200)
+
+    def handle(self, *args, **options):
+        rng = benchmarks.rng()
+        # Whole words, type-ahead prefixes, and misses (the worst case for icontains)
+        terms = [w for w in benchmarks.WORDS] + [w[:4] for w in benchmarks.WORDS] + ['zzzmissing']
+        queries = [rng.choice(terms) for _ in range(options['queries'])]
+
+        with benchmarks.rolled_back():
+            user = User.objects.create_user('benchmark-search@example.invalid', 'benchmark', True)
+            Note.objects.bulk_create(
+                (
+                    Note(
+                        user=user, slug=f'benchmark-search-{i}',
+                        title=benchmarks.text(rng, 4), body=benchmarks.text(rng, 80),
+                    )
+                    for i in range(options['notes'])
+                ),
+                batch_size=5000,
+            )
+            Note.objects.filter(user=user).update_search_vector()
+            benchmarks.analyze(Note)
+            notes = Note.objects.filter(user=user)
+
+            def icontains(query):
+                filters = Q(title__icontains=query) | Q(body__icontains=query) | Q(category__icontains=query)
+                return list(notes.filter(filters).order_by('-id')[:10])
+
+            def full_text(query):
+                return list(notes.search(query)[:10])
+
+            queue = iter(queries * 2)
+            old = benchmarks.timings(lambda: icontains(next(queue)), len(queries))
+            new = benchmarks.timings(lambda: full_text(next(queue)), len(queries))
+
+        if connection.vendor != 'postgresql':
+            self.stderr.write("Not on PostgreSQL: search() falls back to icontains, so both paths match")
+        self.stdout.write(f"{options['notes']} notes, {len(queries)} queries")
+        self.stdout.write(f"icontains: {benchmarks.latency(old)}")
+        self.stdout.write(self.style.SUCCESS(f"full-text: {benchmarks.latency(new)}"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from myapp import blobs
+
+
+class Command(BaseCommand):
+    help = "Delete unreferenced attachment blobs and report deduplication savings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+        parser.add_argument(
+            '--adopt-legacy', action='store_true',
+            help="First move attachments stored before blobs existed into blob storage",
+        )
+
+    def handle(self, *args, **options):
+        if options['adopt_legacy']:
+            adopted = blobs.adopt_legacy()
+            self.stdout.write(f"Moved {adopted} legacy attachments into blob storage")
+        count, freed = blobs.collect_garbage(dry_run=options['dry_run'])
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(f"{verb} {count} unreferenced blobs ({filesizeformat(freed)})")
+        usage = blobs.usage()
+        self.stdout.write(self.style.SUCCESS(
+            f"{usage['blobs']} blobs hold {filesizeformat(usage['logical'])} of attachments "
+            f"in {filesizeformat(usage['stored'])}; deduplication saves {filesizeformat(usage['saved'])}"
+        ))
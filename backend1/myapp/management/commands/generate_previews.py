@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from myapp import previews
+from myapp.models import AttachmentBlob
+
+
+class Command(BaseCommand):
+    help = "Render missing attachment thumbnails and PDF previews"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-render previews that already exist")
+
+    def handle(self, *args, **options):
+        blobs = AttachmentBlob.objects.filter(ref_count__gt=0)
+        if not options['all']:
+            blobs = blobs.filter(previews__isnull=True)
+        rendered = skipped = 0
+        for blob in blobs.iterator():
+            if previews.generate(blob):
+                rendered += 1
+            else:
+                skipped += 1
+        self.stdout.write(self.style.SUCCESS(f"Rendered previews for {rendered} blobs ({skipped} without a preview)"))
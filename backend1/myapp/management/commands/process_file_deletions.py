@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from myapp import cleanup
+
+
+class Command(BaseCommand):
+    help = "Delete attachment files queued for deletion"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=cleanup.FILE_CLEANUP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted, failed = cleanup.process_pending(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} files ({failed} failed, will retry)"))
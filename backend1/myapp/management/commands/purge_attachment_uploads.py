@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from myapp import uploads
+
+
+class Command(BaseCommand):
+    help = "Remove unfinished resumable attachment uploads and their part files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=None,
+            help="Seconds since the last chunk (default: ATTACHMENT_UPLOAD_EXPIRY)",
+        )
+
+    def handle(self, *args, **options):
+        removed = uploads.purge_stale(options['max_age'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} stale uploads"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from myapp.models import Note, NoteRating
+
+
+def rebuild_rating_stats(note_model, rating_model):
+    """Recompute Note.rating_sum / rating_count from NoteRating in one UPDATE."""
+    per_note = rating_model.objects.filter(note=OuterRef('pk')).order_by().values('note')
+    return note_model.objects.update(
+        rating_sum=Coalesce(
+            Subquery(per_note.annotate(total=Sum('value')).values('total'), output_field=IntegerField()), 0
+        ),
+        rating_count=Coalesce(
+            Subquery(per_note.annotate(total=Count('id')).values('total'), output_field=IntegerField()), 0
+        ),
+    )
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized rating_sum / rating_count columns on Note"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = rebuild_rating_stats(Note, NoteRating)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates for {updated} notes"))
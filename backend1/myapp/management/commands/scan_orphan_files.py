@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+
+from myapp import cleanup
+
+
+class Command(BaseCommand):
+    help = "Find files under MEDIA_ROOT that no attachment or blob refers to"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help="Queue the orphans for deletion and process the queue")
+        parser.add_argument('--min-age', type=int, default=3600, help="Ignore files modified in the last N seconds")
+        parser.add_argument('--verbose-names', action='store_true', help="Print every orphaned file")
+
+    def handle(self, *args, **options):
+        found = total = 0
+        pending = []
+        for name, size in cleanup.scan_orphans(min_age=options['min_age']):
+            found += 1
+            total += size
+            if options['verbose_names']:
+                self.stdout.write(name)
+            if options['delete']:
+                pending.append(name)
+                if len(pending) >= cleanup.FILE_CLEANUP_BATCH_SIZE:
+                    self.queue(pending)
+                    pending = []
+        self.stdout.write(f"Found {found} orphaned files ({filesizeformat(total)})")
+        if options['delete']:
+            self.queue(pending)
+            deleted, failed = cleanup.process_pending()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} files ({failed} failed)"))
+
+    def queue(self, names):
+        with transaction.atomic():
+            cleanup.schedule_delete(*names)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from myapp import outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued outgoing email"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.EMAIL_OUTBOX_BATCH_SIZE)
+        parser.add_argument(
+            '--requeue-dead', action='store_true',
+            help="Retry messages that ran out of attempts",
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            requeued = outbox.requeue_dead()
+            self.stdout.write(f"Requeued {requeued} dead-lettered emails")
+        sent, failed = outbox.send_pending(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} emails ({failed} failed, will retry)"))
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_alter_user_last_login'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['-updated_at', '-created_at', '-id'], name='note_list_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['user', '-updated_at', '-created_at', '-id'], name='note_user_order_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:12
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Note = apps.get_model('myapp', 'Note')
+    NoteRating = apps.get_model('myapp', 'NoteRating')
+    per_note = NoteRating.objects.filter(note=OuterRef('pk')).order_by().values('note')
+    Note.objects.update(
+        rating_sum=Coalesce(
+            Subquery(per_note.annotate(total=Sum('value')).values('total'), output_field=IntegerField()), 0
+        ),
+        rating_count=Coalesce(
+            Subquery(per_note.annotate(total=Count('id')).values('total'), output_field=IntegerField()), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_note_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:13
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Note = apps.get_model('myapp', 'Note')
+    Note.objects.update(search_vector=(
+        SearchVector('title', weight='A', config='english')
+        + SearchVector('body', weight='B', config='english')
+        + SearchVector('category', weight='C', config='english')
+    ))
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS note_search_vector_idx ON myapp_note USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS note_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_note_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # GIN indexes are PostgreSQL-only, so keep the index out of model state
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
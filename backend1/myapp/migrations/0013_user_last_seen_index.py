@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_note_search_vector'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, null=True),
+        ),
+    ]
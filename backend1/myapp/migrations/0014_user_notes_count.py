@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:20
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_notes_count(apps, schema_editor):
+    User = apps.get_model('myapp', 'User')
+    Note = apps.get_model('myapp', 'Note')
+    per_user = Note.objects.filter(user=OuterRef('pk')).order_by().values('user')
+    User.objects.update(notes_count=Coalesce(
+        Subquery(per_user.annotate(total=Count('id')).values('total'), output_field=IntegerField()), 0
+    ))
+
+
+def create_prefix_indexes(apps, schema_editor):
+    # Case-insensitive prefix search (istartswith -> UPPER(col) LIKE 'X%')
+    # needs pattern_ops to use a btree index; PostgreSQL only.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in ('email', 'name'):
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS user_{column}_prefix_idx '
+            f'ON myapp_user (UPPER({column}::text) varchar_pattern_ops)'
+        )
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in ('email', 'name'):
+        schema_editor.execute(f'DROP INDEX IF EXISTS user_{column}_prefix_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_user_last_seen_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='notes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-notes_count', '-id'], name='user_notes_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-last_login', '-created_at', '-id'], name='user_last_login_idx'),
+        ),
+        migrations.RunPython(backfill_notes_count, migrations.RunPython.noop),
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
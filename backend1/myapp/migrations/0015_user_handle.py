@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_user_notes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='handle',
+            field=models.SlugField(max_length=60, null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='name',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+    ]
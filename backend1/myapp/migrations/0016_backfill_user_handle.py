@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:30
+
+from django.db import migrations
+from django.utils.text import slugify
+
+BATCH_SIZE = 2000
+MAX_LENGTH = 60
+
+
+def backfill_handles(apps, schema_editor):
+    User = apps.get_model('myapp', 'User')
+    taken = set(User.objects.exclude(handle=None).values_list('handle', flat=True))
+    pending = []
+    for user in User.objects.filter(handle=None).order_by('id').only('id', 'name', 'email').iterator():
+        base = (slugify(user.name) or slugify(user.email.split('@')[0]))[:MAX_LENGTH].strip('-') or 'user'
+        handle, n = base, 1
+        while handle in taken:
+            n += 1
+            suffix = f'-{n}'
+            handle = f"{base[:MAX_LENGTH - len(suffix)].strip('-')}{suffix}"
+        taken.add(handle)
+        user.handle = handle
+        pending.append(user)
+        if len(pending) >= BATCH_SIZE:
+            User.objects.bulk_update(pending, ['handle'])
+            pending = []
+    if pending:
+        User.objects.bulk_update(pending, ['handle'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_user_handle'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_handles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0016_backfill_user_handle'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='handle',
+            field=models.SlugField(max_length=60, unique=True),
+        ),
+    ]
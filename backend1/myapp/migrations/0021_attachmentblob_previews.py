@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0020_filedeletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachmentblob',
+            name='previews',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
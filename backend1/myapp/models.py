@@ -1,4 +1,12 @@
-from django.db import models
+import os
+import re
+import secrets
+import uuid
+
+from django.db import models, connections, router, transaction, IntegrityError
+from django.db.models import Exists, F, OuterRef, Q, Subquery
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, SearchVectorField
+from django.utils import timezone
 from django.utils.text import slugify
 from django.contrib.auth.models import (
     BaseUserManager, AbstractBaseUser
@@ -41,16 +49,127 @@ class UserManager(BaseUserManager):
         return user
     
 
+class PreserveCountersMixin:
+    """
+    Columns listed in COUNTER_FIELDS are only ever changed with F() updates.
+    A plain save() of an existing row leaves them out, so a stale in-memory
+    copy is never written back over concurrent increments.
+    """
+    COUNTER_FIELDS = ()
+
+    def preserved_fields(self):
+        """Fields a plain save() of an existing row leaves out."""
+        return set(self.COUNTER_FIELDS) | self.get_deferred_fields()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skip = self.preserved_fields()
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in skip
+            ]
+        super().save(*args, **kwargs)
+
+
+class UniqueSlugMixin:
+    """
+    Allocates a unique slug-like value (SLUG_FIELD) on first save without
+    scanning for similar ones: try the bare slug, then short random suffixes,
+    and let the unique constraint arbitrate between concurrent writers.
+    Subclasses override slug_base() and call save_with_new_slug() from save().
+    """
+    SLUG_FIELD = 'slug'
+    SLUG_FALLBACK = 'item'
+    SLUG_SUFFIX_BYTES = 3
+    SLUG_MAX_ATTEMPTS = 8
+
+    def slug_base(self):
+        # Slugified text the value is built from; empty means SLUG_FALLBACK
+        return ''
+
+    def _slug_taken(self, using, value):
+        return type(self)._default_manager.using(using).filter(**{self.SLUG_FIELD: value}).exists()
+
+    def _bare_slug(self):
+        max_length = self._meta.get_field(self.SLUG_FIELD).max_length
+        return self.slug_base()[:max_length].strip('-') or self.SLUG_FALLBACK
+
+    @classmethod
+    def _suffixed_slug(cls, base):
+        room = cls._meta.get_field(cls.SLUG_FIELD).max_length - cls.SLUG_SUFFIX_BYTES * 2 - 1
+        return f"{base[:room].strip('-')}-{secrets.token_hex(cls.SLUG_SUFFIX_BYTES)}"
+
+    def _slug_candidates(self, using):
+        base = self._bare_slug()
+        # The bare slug is only worth trying while it is free
+        if not self._slug_taken(using, base):
+            yield base
+        while True:
+            yield self._suffixed_slug(base)
+
+    @classmethod
+    def allocate_slugs(cls, objs, using='default'):
+        """
+        Give unsaved `objs` unique slugs for bulk_create(), with a couple of
+        queries for the whole batch. A concurrent writer can still take one
+        first; bulk_create() then raises IntegrityError and the caller
+        allocates again.
+        """
+        manager = cls._default_manager.using(using)
+        lookup = f'{cls.SLUG_FIELD}__in'
+        bases = [obj._bare_slug() for obj in objs]
+        taken = set(manager.filter(**{lookup: set(bases)}).values_list(cls.SLUG_FIELD, flat=True))
+        suffixed = {}
+        for obj, base in zip(objs, bases):
+            value = base
+            while value in taken:
+                value = cls._suffixed_slug(base)
+            if value != base:
+                suffixed[value] = (obj, base)
+            taken.add(value)
+            setattr(obj, cls.SLUG_FIELD, value)
+        # Random suffixes rarely clash with stored slugs; re-roll those that do
+        while suffixed:
+            clashes = manager.filter(**{lookup: list(suffixed)}).values_list(cls.SLUG_FIELD, flat=True)
+            retry = {}
+            for old in clashes:
+                obj, base = suffixed[old]
+                value = cls._suffixed_slug(base)
+                while value in taken:
+                    value = cls._suffixed_slug(base)
+                taken.add(value)
+                setattr(obj, cls.SLUG_FIELD, value)
+                retry[value] = (obj, base)
+            suffixed = retry
+
+    def save_with_new_slug(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db or 'default'
+        candidates = self._slug_candidates(using)
+        for attempt in range(self.SLUG_MAX_ATTEMPTS):
+            setattr(self, self.SLUG_FIELD, next(candidates))
+            try:
+                with transaction.atomic(using=using):
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                collided = self._slug_taken(using, getattr(self, self.SLUG_FIELD))
+                if not collided or attempt + 1 == self.SLUG_MAX_ATTEMPTS:
+                    setattr(self, self.SLUG_FIELD, None if self._meta.get_field(self.SLUG_FIELD).null else '')
+                    raise
+
+
 # ==============================
 # Custom User Model
 # ==============================
-class User(AbstractBaseUser):
+class User(UniqueSlugMixin, PreserveCountersMixin, AbstractBaseUser):
     email = models.EmailField(
         verbose_name='email address',
         max_length=255,
         unique=True,
     )
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, db_index=True)
+    # Public profile handle used in URLs (profile/<handle>/), assigned on creation
+    handle = models.SlugField(max_length=60, unique=True)
     bio = models.TextField(blank=True, null=True, default="")
     tc = models.BooleanField()
     is_active = models.BooleanField(default=True)
@@ -58,16 +177,113 @@ class User(AbstractBaseUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     # Last activity timestamp updated by heartbeat endpoint
-    last_seen = models.DateTimeField(null=True, blank=True, default=None)
+    last_seen = models.DateTimeField(null=True, blank=True, default=None, db_index=True)
+    # Maintained by Note post_save/post_delete signals
+    notes_count = models.PositiveIntegerField(default=0)
+    # Embedded in JWTs; bumped when is_active / is_admin change, which
+    # revokes every token issued before (see myapp/authentication.py)
+    token_version = models.PositiveIntegerField(default=0)
 
     objects = UserManager()
 
+    COUNTER_FIELDS = ('notes_count',)
+    SLUG_FIELD = 'handle'
+    SLUG_FALLBACK = 'user'
+    # Changing any of these revokes the user's tokens
+    TOKEN_CLAIM_FIELDS = ('is_active', 'is_admin')
+    # What from_claims() takes from the token; possibly stale, so a user
+    # built that way never writes them
+    TOKEN_FIELDS = TOKEN_CLAIM_FIELDS + ('token_version',)
+    # Embedded in every note payload (see signals.touch_author_cache)
+    AUTHOR_FIELDS = ('email', 'name')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-notes_count', '-id'], name='user_notes_count_idx'),
+            models.Index(fields=['-last_login', '-created_at', '-id'], name='user_last_login_idx'),
+        ]
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name', 'tc']
 
     def __str__(self):
         return self.email
 
+    def slug_base(self):
+        return slugify(self.name) or slugify(self.email.split('@')[0])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        user._remember_saved()
+        return user
+
+    @classmethod
+    def from_claims(cls, **claims):
+        """
+        A user built from token claims alone. Reading any other field loads
+        the rest of the row at once (see refresh_from_db); saving it never
+        writes TOKEN_FIELDS.
+        """
+        names = [f.attname for f in cls._meta.concrete_fields if f.attname in claims]
+        user = cls.from_db(router.db_for_read(cls), names, [claims[name] for name in names])
+        user._claims_only = True
+        user._from_claims = True
+        return user
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        if fields is not None and getattr(self, '_claims_only', False):
+            self._claims_only = False
+            fields = set(fields) | self.get_deferred_fields()
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._remember_saved(fields)
+
+    def _remember_saved(self, fields=None):
+        # Values of TOKEN_CLAIM_FIELDS and AUTHOR_FIELDS as stored, to spot changes on save()
+        saved = getattr(self, '_saved_values', {})
+        for name in self.TOKEN_CLAIM_FIELDS + self.AUTHOR_FIELDS:
+            if name in self.__dict__ and (fields is None or name in fields):
+                saved[name] = self.__dict__[name]
+        self._saved_values = saved
+
+    def changed_fields(self, names):
+        """
+        Which of `names` (TOKEN_CLAIM_FIELDS or AUTHOR_FIELDS) differ from the
+        stored row as last loaded or saved. During post_save, that is still
+        the row before this save.
+        """
+        saved = getattr(self, '_saved_values', {})
+        return {name for name in names if name in saved and self.__dict__.get(name, saved[name]) != saved[name]}
+
+    def preserved_fields(self):
+        fields = super().preserved_fields()
+        if getattr(self, '_from_claims', False):
+            fields |= set(self.TOKEN_FIELDS)
+        return fields
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if getattr(self, '_from_claims', False):
+            # The token's values may predate a deactivation or revocation
+            if update_fields is not None:
+                update_fields = kwargs['update_fields'] = [
+                    name for name in update_fields if name not in self.TOKEN_FIELDS
+                ]
+            changed = set()
+        else:
+            changed = self.changed_fields(self.TOKEN_CLAIM_FIELDS)
+        if update_fields is not None:
+            changed &= set(update_fields)
+        if changed:
+            self.token_version += 1
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'token_version'}
+        if self.handle:
+            super().save(*args, **kwargs)
+        else:
+            self.save_with_new_slug(*args, **kwargs)
+        self._remember_saved(update_fields)
+
     def has_perm(self, perm, obj=None):
         "Does the user have a specific permission?"
         return self.is_admin
@@ -90,7 +306,70 @@ def note_file_path(instance, filename):
     return f"notes/{instance.note.slug}/{filename}"
 
 
-class Note(models.Model):
+# Title outranks body, body outranks category
+NOTE_SEARCH_VECTOR = (
+    SearchVector('title', weight='A', config='english')
+    + SearchVector('body', weight='B', config='english')
+    + SearchVector('category', weight='C', config='english')
+)
+
+
+class NoteQuerySet(models.QuerySet):
+    def _uses_postgres(self):
+        return connections[self.db].vendor == 'postgresql'
+
+    def update_search_vector(self):
+        """Recompute search_vector for every note in the queryset (PostgreSQL only)."""
+        if not self._uses_postgres():
+            return 0
+        return self.update(search_vector=NOTE_SEARCH_VECTOR)
+
+    def search(self, query):
+        """
+        Ranked full-text search with prefix matching on the last word for
+        type-ahead. Falls back to icontains matching on non-PostgreSQL
+        databases (e.g. SQLite test runs).
+        """
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return self.none()
+        if not self._uses_postgres():
+            filters = Q(title__icontains=query) | Q(body__icontains=query) | Q(category__icontains=query)
+            return self.filter(filters).order_by('-id')
+        # Every term must match; each is a prefix so "prog" finds "programming"
+        tsquery = SearchQuery(' & '.join(f'{t}:*' for t in terms), search_type='raw', config='english')
+        return (
+            self.filter(search_vector=tsquery)
+            .annotate(rank=SearchRank(F('search_vector'), tsquery))
+            .order_by('-rank', '-id')
+        )
+
+    def with_list_stats(self, user=None):
+        """
+        Annotate the viewer's rating/bookmark state so NoteSerializer can
+        render a whole page without per-note queries. Rating aggregates are
+        stored on the note itself (rating_sum / rating_count).
+        """
+        qs = self
+        if user is not None and user.is_authenticated:
+            qs = qs.annotate(
+                annotated_user_rating=Subquery(
+                    NoteRating.objects.filter(note=OuterRef('pk'), user=user).values('value')[:1]
+                ),
+                annotated_is_bookmarked=Exists(
+                    Note.bookmarks.through.objects.filter(note=OuterRef('pk'), user=user)
+                ),
+            )
+        return qs
+
+
+class NoteManager(models.Manager.from_queryset(NoteQuerySet)):
+    def get_queryset(self):
+        # search_vector is only read inside the database; never ship it to Python
+        return super().get_queryset().defer('search_vector')
+
+
+class Note(UniqueSlugMixin, PreserveCountersMixin, models.Model):
     CATEGORY_CHOICES = [
         ('PERSONAL', 'Personal'),
         ('WORK', 'Work'),
@@ -113,27 +392,195 @@ class Note(models.Model):
     # Users can bookmark notes
     bookmarks = models.ManyToManyField('User', related_name='bookmarked_notes', blank=True)
 
+    # Denormalized rating aggregates, kept in step by set_rating() and the
+    # NoteRating post_save/post_delete signals. Rebuild with `manage.py rebuild_note_ratings`.
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    # Weighted tsvector over title/body/category, refreshed on save. Backed by
+    # a GIN index created in migration 0012 (PostgreSQL only).
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = NoteManager()
+
+    COUNTER_FIELDS = ('rating_sum', 'rating_count')
+    SLUG_FALLBACK = 'note'
+
+    class Meta:
+        indexes = [
+            # Keyset pagination walks the list in this order
+            models.Index(fields=['-updated_at', '-created_at', '-id'], name='note_list_order_idx'),
+            models.Index(fields=['user', '-updated_at', '-created_at', '-id'], name='note_user_order_idx'),
+        ]
+
+    def slug_base(self):
+        return slugify(self.title)
+
     def save(self, *args, **kwargs):
-        if not self.slug:
-            slug_base = slugify(self.title)
-            slug = slug_base
-            if Note.objects.filter(slug__startswith=slug_base).exists():
-                slug = f"{slug_base}-{Note.objects.filter(slug__startswith=slug_base).count()}"
-            self.slug = slug
-        super().save(*args, **kwargs)
+        if self.slug:
+            super().save(*args, **kwargs)
+        else:
+            self.save_with_new_slug(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'title', 'body', 'category'} & set(update_fields):
+            Note.objects.using(self._state.db).filter(pk=self.pk).update_search_vector()
 
     def __str__(self):
         return self.title
 
+    @property
+    def rating_avg(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    def set_rating(self, user, value):
+        """
+        Create or update `user`'s rating and adjust the stored aggregates with
+        F() expressions so concurrent raters never overwrite each other.
+        New ratings are counted by the NoteRating post_save signal.
+        """
+        with transaction.atomic():
+            rating = NoteRating.objects.select_for_update().filter(note=self, user=user).first()
+            if rating is None:
+                try:
+                    with transaction.atomic():
+                        NoteRating.objects.create(note=self, user=user, value=value)
+                except IntegrityError:
+                    # Another request created it first; fall through to update it
+                    rating = NoteRating.objects.select_for_update().get(note=self, user=user)
+            if rating is not None and rating.value != value:
+                delta = value - rating.value
+                rating.value = value
+                rating.save(update_fields=['value', 'updated_at'])
+                Note.objects.filter(pk=self.pk).update(rating_sum=F('rating_sum') + delta)
+        self.refresh_from_db(fields=['rating_sum', 'rating_count'])
+
+    def clear_rating(self, user):
+        # The aggregates are decremented by the NoteRating post_delete signal,
+        # which also covers ratings removed by cascading deletes.
+        with transaction.atomic():
+            for rating in NoteRating.objects.select_for_update().filter(note=self, user=user):
+                rating.delete()
+        self.refresh_from_db(fields=['rating_sum', 'rating_count'])
+
+
+class AttachmentBlob(models.Model):
+    """
+    One stored copy of a distinct attachment body, keyed by its SHA-256 and
+    shared by every NoteAttachment with that content (see myapp/blobs.py).
+    Blobs whose ref_count drops to zero are deleted by the garbage sweep.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.PositiveBigIntegerField()
+    file = models.FileField()
+    ref_count = models.IntegerField(default=0)
+    # {size name: stored file} thumbnails / first-page previews (myapp/previews.py);
+    # NULL until generated, {} when the content has no preview
+    previews = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count'], name='blob_ref_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} refs)"
+
 
 class NoteAttachment(models.Model):
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name="attachments")
     file = models.FileField(upload_to=note_file_path)
+    # Content-addressed body; NULL for attachments stored before blobs existed
+    blob = models.ForeignKey(
+        AttachmentBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='attachments'
+    )
+    # Original file name (the stored file is named after its hash)
+    name = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Attachment for {self.note.title}"
 
+    @property
+    def display_name(self):
+        return self.name or os.path.basename(self.file.name)
+
+    def save(self, *args, **kwargs):
+        # New uploads are stored once per distinct content and referenced
+        if self.file and not self.file._committed:
+            from myapp import blobs
+            replaced = self.blob_id if self.pk else None
+            with transaction.atomic():
+                blobs.attach(self)
+                super().save(*args, **kwargs)
+                if replaced is not None:
+                    blobs.release(replaced)
+            return
+        super().save(*args, **kwargs)
+
+
+class AttachmentUpload(models.Model):
+    """
+    A resumable attachment upload in progress. Chunks are appended to a part
+    file (see myapp/uploads.py); the row is deleted once the upload has been
+    completed into a NoteAttachment or aborted.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='uploads')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attachment_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    # Optional hex SHA-256 of the whole file, checked on completion
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.received}/{self.size})"
+
+
+class FileDeletion(models.Model):
+    """
+    A stored file to delete once the transaction that queued it commits
+    (see myapp/cleanup.py). Rows are written in the same transaction as the
+    delete that orphaned the file, so a rollback also cancels the deletion.
+    """
+    name = models.CharField(max_length=255)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class OutboundEmail(models.Model):
+    """
+    A queued email (see myapp/outbox.py). Deleted once sent; a row whose
+    attempts reached EMAIL_OUTBOX_MAX_ATTEMPTS is dead-lettered and keeps
+    its last error for inspection.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    to_email = models.EmailField(max_length=255)
+    # Blank sends from DEFAULT_FROM_EMAIL
+    from_email = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to_email}"
+
 
 class NoteRating(models.Model):
     note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='ratings')
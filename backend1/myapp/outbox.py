@@ -0,0 +1,181 @@
+"""
+Outgoing email, queued and sent in the background.
+
+enqueue() stores a message as an OutboundEmail row and returns; nothing
+talks to the mail server inside the request. Once the transaction commits,
+a background thread in the process drains the outbox in batches over one
+SMTP connection that it keeps open between batches (for EMAIL_OUTBOX_IDLE
+seconds), so STARTTLS and login happen once per burst rather than once per
+message. `manage.py send_queued_email` does the same from cron and picks up
+anything a worker left behind.
+
+A message that cannot be sent is retried with exponential backoff; after
+EMAIL_OUTBOX_MAX_ATTEMPTS failures it stays in the table as dead-lettered,
+with the last error, until `send_queued_email --requeue-dead` retries it.
+Sent messages are deleted, so reset links do not linger in the database.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Send from a background thread after each commit; with False, only
+# `send_queued_email` does.
+EMAIL_OUTBOX_IN_BACKGROUND = getattr(settings, 'EMAIL_OUTBOX_IN_BACKGROUND', True)
+EMAIL_OUTBOX_BATCH_SIZE = 50
+# Dead-letter a message after this many failed attempts
+EMAIL_OUTBOX_MAX_ATTEMPTS = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+# First retry after this many seconds, doubling each time up to the cap
+EMAIL_OUTBOX_RETRY_DELAY = 30
+EMAIL_OUTBOX_MAX_RETRY_DELAY = 60 * 60
+# Claimed messages are hidden from other senders for this long
+EMAIL_OUTBOX_LEASE = 5 * 60
+# Seconds the worker keeps an idle SMTP connection open
+EMAIL_OUTBOX_IDLE = getattr(settings, 'EMAIL_OUTBOX_IDLE', 30)
+
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def enqueue(subject, body, to_email, from_email=None):
+    """Queue a plain-text message; it is sent once the current transaction commits."""
+    from myapp.models import OutboundEmail
+    message = OutboundEmail.objects.create(
+        subject=subject, body=body, to_email=to_email, from_email=from_email or '',
+    )
+    if EMAIL_OUTBOX_IN_BACKGROUND:
+        transaction.on_commit(_wake)
+    return message
+
+
+def _wake():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='email-outbox', daemon=True)
+            _worker.start()
+    _wakeup.set()
+
+
+def _run():
+    connection = None
+    while True:
+        # Keep the connection while mail keeps coming; drop it once idle
+        if not _wakeup.wait(EMAIL_OUTBOX_IDLE if connection is not None else None):
+            _reset(connection)
+            connection = None
+            continue
+        _wakeup.clear()
+        try:
+            if connection is None:
+                connection = get_connection()
+            send_pending(connection=connection)
+        except Exception:
+            logger.exception("Sending queued email failed")
+            if connection is not None:
+                _reset(connection)
+                connection = None
+        finally:
+            close_old_connections()
+
+
+def retry_delay(attempts):
+    return min(EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), EMAIL_OUTBOX_MAX_RETRY_DELAY)
+
+
+def _claim(batch_size):
+    from myapp.models import OutboundEmail
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(attempts__lt=EMAIL_OUTBOX_MAX_ATTEMPTS, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk')[:batch_size]
+        )
+        if batch:
+            # Lease them, so other senders skip them while we talk to the server
+            OutboundEmail.objects.filter(pk__in=[m.pk for m in batch]).update(
+                next_attempt_at=now + timedelta(seconds=EMAIL_OUTBOX_LEASE),
+            )
+    return batch
+
+
+def _message(row, connection):
+    return EmailMessage(
+        subject=row.subject,
+        body=row.body,
+        from_email=row.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=[row.to_email],
+        connection=connection,
+    )
+
+
+def send_pending(batch_size=EMAIL_OUTBOX_BATCH_SIZE, connection=None):
+    """
+    Send due messages in batches over `connection` (opened here and closed
+    afterwards when not given). Returns (sent, failed).
+    """
+    from myapp.models import OutboundEmail
+    owned = connection is None
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        while True:
+            batch = _claim(batch_size)
+            if not batch:
+                return sent, failed
+            done = []
+            for row in batch:
+                try:
+                    # No-op while the connection is already open
+                    connection.open()
+                    connection.send_messages([_message(row, connection)])
+                except Exception as exc:
+                    failed += 1
+                    _failed(row, exc)
+                    # The server may have dropped us; reconnect for the next one
+                    _reset(connection)
+                else:
+                    sent += 1
+                    done.append(row.pk)
+            OutboundEmail.objects.filter(pk__in=done).delete()
+    finally:
+        if owned:
+            _reset(connection)
+
+
+def _reset(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def _failed(row, exc):
+    from myapp.models import OutboundEmail
+    attempts = row.attempts + 1
+    if attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+        logger.error("Giving up on email %s to %s: %s", row.pk, row.to_email, exc)
+    else:
+        logger.warning("Email %s to %s failed, will retry: %s", row.pk, row.to_email, exc)
+    OutboundEmail.objects.filter(pk=row.pk).update(
+        attempts=attempts,
+        last_error=str(exc)[:1000],
+        next_attempt_at=timezone.now() + timedelta(seconds=retry_delay(attempts)),
+    )
+
+
+def requeue_dead():
+    """Give dead-lettered messages a fresh set of attempts. Returns the count."""
+    from myapp.models import OutboundEmail
+    return OutboundEmail.objects.filter(attempts__gte=EMAIL_OUTBOX_MAX_ATTEMPTS).update(
+        attempts=0, next_attempt_at=timezone.now(),
+    )
@@ -0,0 +1,152 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class NoteCursorPagination(BasePagination):
+    """
+    Keyset pagination over the note list ordering.
+
+    The cursor encodes the (updated_at, created_at, id) values of the row at
+    the page boundary, so every page is a single indexed range scan no matter
+    how deep the client has paged. `id` is unique, which makes the ordering
+    total: rows inserted or edited while a client is paging never cause the
+    same note to be returned twice or a note to be skipped between pages.
+    """
+    ordering = ('-updated_at', '-created_at', '-id')
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def is_requested(self, request):
+        # The frontend still expects a bare list, so only paginate when the
+        # client explicitly asks for it.
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        reverse, position = self.decode_cursor(request, queryset.model)
+        if reverse:
+            queryset = queryset.order_by(*[self._flip(f) for f in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self._keyset_filter(position, reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    # -------------------------
+    # Cursor encoding
+    # -------------------------
+    def _fields(self):
+        return [f.lstrip('-') for f in self.ordering]
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def encode_cursor(self, obj, reverse):
+        position = []
+        for name in self._fields():
+            # Pages can hold model instances or values() rows
+            value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = json.dumps({'r': int(reverse), 'p': position}, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii').rstrip('=')
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return False, None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii'))
+            reverse = bool(payload['r'])
+            raw = payload['p']
+            fields = self._fields()
+            if len(raw) != len(fields):
+                raise ValueError
+            position = [
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(fields, raw)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    def _keyset_filter(self, position, reverse):
+        # Lexicographic "strictly after" on the ordering tuple:
+        # (a < A) OR (a = A AND b < B) OR (a = A AND b = B AND c < C)
+        q = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            q |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        # Redundant with the above, but the planner cannot derive a bound on
+        # the leading column from the OR; a plain `a <= A` lets the index
+        # scan start at the cursor instead of at the first row.
+        first = self.ordering[0]
+        lookup = 'lte' if first.startswith('-') != reverse else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': position[0]}) & q
+
+
+class AdminUserPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
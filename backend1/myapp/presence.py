@@ -0,0 +1,228 @@
+"""
+Write-coalescing presence tracking for the heartbeat endpoint.
+
+A heartbeat stores the user's "last seen" time in the shared cache, which is
+what online checks read, and in a per-process buffer. A background thread
+writes the buffer to User.last_seen with a single bulk UPDATE every
+PRESENCE_FLUSH_INTERVAL seconds (and the rest is written when the process
+exits), instead of one row write per heartbeat, so a worker that goes idle
+does not sit on what it holds. Only the heartbeat that brings a user back
+online is written through immediately, so DB-side queries on last_seen never
+miss an online user; they just see times up to MAX_DB_LAG seconds old.
+
+Logins go through the same buffer: record_login() queues User.last_login
+and the next flush writes it, so a burst of sign-ins costs one UPDATE per
+flush instead of one per login. A user's first login is written through,
+like a heartbeat that brings them online.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import Case, Count, DateTimeField, F, Value, When
+from django.db.models.functions import Coalesce, Greatest, TruncHour
+from django.utils import timezone
+
+PRESENCE_CACHE_ALIAS = getattr(settings, 'PRESENCE_CACHE_ALIAS', 'default')
+# Users seen within this many seconds count as online
+ONLINE_WINDOW = getattr(settings, 'ONLINE_WINDOW', 120)
+PRESENCE_FLUSH_INTERVAL = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 60)
+# Flush from a background thread on that interval; with False, only when a
+# later heartbeat or login finds the flush due (and at exit).
+PRESENCE_FLUSH_IN_BACKGROUND = getattr(settings, 'PRESENCE_FLUSH_IN_BACKGROUND', True)
+
+# How far User.last_seen can trail the cache for a user who is still active
+MAX_DB_LAG = PRESENCE_FLUSH_INTERVAL * 2
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = {}
+_pending_logins = {}
+_last_flush = time.monotonic()
+_flusher = None
+
+
+def _cache():
+    return caches[PRESENCE_CACHE_ALIAS]
+
+
+def _key(user_id):
+    return f'presence:{user_id}'
+
+
+def record(user, when=None):
+    """Note that `user` is active now; flushes the buffer when it is due."""
+    when = when or timezone.now()
+    cache = _cache()
+    previous = cache.get(_key(user.pk))
+    # Keep the cache entry a while past the online window so last_seen
+    # stays accurate until the buffer has been flushed.
+    cache.set(_key(user.pk), when, ONLINE_WINDOW + MAX_DB_LAG)
+    if previous is None:
+        # Coming (back) online: write through so last_seen queries see them
+        from myapp.models import User
+        User.objects.filter(pk=user.pk).update(last_seen=when)
+        return when
+    with _lock:
+        _pending[user.pk] = when
+        due = time.monotonic() - _last_flush >= PRESENCE_FLUSH_INTERVAL
+    _start_flusher()
+    if due:
+        flush()
+    return when
+
+
+def record_login(user, when=None):
+    """Queue User.last_login for `user`; flushes the buffer when it is due."""
+    when = when or timezone.now()
+    first = user.last_login is None
+    user.last_login = when
+    if first:
+        # First sign-in: write through so last_login queries (the admin
+        # list hides users who never logged in) see them right away
+        from myapp.models import User
+        if User.objects.filter(pk=user.pk, last_login__isnull=True).update(last_login=when):
+            return when
+    with _lock:
+        _pending_logins[user.pk] = when
+        due = time.monotonic() - _last_flush >= PRESENCE_FLUSH_INTERVAL
+    _start_flusher()
+    if due:
+        flush()
+    return when
+
+
+def _start_flusher():
+    # Started with the first buffered write, so forked workers get their own
+    global _flusher
+    if not PRESENCE_FLUSH_IN_BACKGROUND or (_flusher is not None and _flusher.is_alive()):
+        return
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run, name='presence-flush', daemon=True)
+            _flusher.start()
+
+
+def _run():
+    while True:
+        time.sleep(max(PRESENCE_FLUSH_INTERVAL - (time.monotonic() - _last_flush), 0.01))
+        if time.monotonic() - _last_flush < PRESENCE_FLUSH_INTERVAL:
+            # A heartbeat flushed meanwhile
+            continue
+        try:
+            flush()
+        except Exception:
+            logger.exception("Flushing presence failed")
+        finally:
+            close_old_connections()
+
+
+def _write(field, batch):
+    from myapp.models import User
+    value = Case(
+        *[When(pk=pk, then=Value(when)) for pk, when in batch.items()],
+        output_field=DateTimeField(),
+    )
+    # Another worker may already have written a newer time
+    return User.objects.filter(pk__in=batch).update(
+        **{field: Greatest(Coalesce(F(field), value), value)}
+    )
+
+
+def flush():
+    """Write buffered heartbeats and logins to User in one UPDATE each."""
+    global _last_flush
+    with _lock:
+        batch = dict(_pending)
+        logins = dict(_pending_logins)
+        _pending.clear()
+        _pending_logins.clear()
+        _last_flush = time.monotonic()
+    updated = 0
+    if batch:
+        updated = _write('last_seen', batch)
+    if logins:
+        _write('last_login', logins)
+    return updated
+
+
+def last_seen(user, seen_map=None):
+    """Most recent activity for `user`, from the cache or the stored column."""
+    if seen_map is not None:
+        cached = seen_map.get(user.pk)
+    else:
+        cached = _cache().get(_key(user.pk))
+    stored = getattr(user, 'last_seen', None)
+    if cached is None:
+        return stored
+    if stored is None:
+        return cached
+    return max(cached, stored)
+
+
+def last_seen_many(user_ids):
+    """{user_id: last seen} from the cache for a batch of users (one round trip)."""
+    found = _cache().get_many([_key(pk) for pk in user_ids])
+    return {pk: found[_key(pk)] for pk in user_ids if _key(pk) in found}
+
+
+def is_online(user, seen_map=None):
+    seen = last_seen(user, seen_map)
+    if not seen:
+        return False
+    return (timezone.now() - seen).total_seconds() < ONLINE_WINDOW
+
+
+def online_user_ids():
+    """
+    Ids of the users online right now, most recently seen first. The indexed
+    last_seen column narrows the candidates; the cache has the final say.
+    """
+    from myapp.models import User
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=ONLINE_WINDOW + MAX_DB_LAG)
+    stored = dict(User.objects.filter(last_seen__gte=cutoff).values_list('id', 'last_seen'))
+    seen_map = last_seen_many(list(stored))
+    online = []
+    for pk, stored_seen in stored.items():
+        seen = max(stored_seen, seen_map.get(pk) or stored_seen)
+        if (now - seen).total_seconds() < ONLINE_WINDOW:
+            online.append((seen, pk))
+    online.sort(reverse=True)
+    return [pk for _, pk in online]
+
+
+def activity_histogram(hours=24):
+    """Users per hour of their last activity over the past `hours` hours."""
+    from myapp.models import User
+    now = timezone.now()
+    start = (now - timedelta(hours=hours - 1)).replace(minute=0, second=0, microsecond=0)
+    rows = (
+        User.objects.filter(last_seen__gte=start)
+        .annotate(hour=TruncHour('last_seen'))
+        .values('hour')
+        .annotate(active=Count('id'))
+        .order_by()
+    )
+    counts = {row['hour']: row['active'] for row in rows}
+    return [
+        {'hour': bucket, 'active': counts.get(bucket, 0)}
+        for bucket in (start + timedelta(hours=i) for i in range(hours))
+    ]
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,194 @@
+"""
+Thumbnails for image attachments and first-page previews for PDFs.
+
+When a new blob is stored (see myapp/blobs.py), rendering its previews is
+handed to a process pool once the transaction commits, so uploads never wait
+for image decoding and a large PDF cannot stall a web worker. Previews are
+JPEGs stored next to the blob, at blobs/<aa>/<bb>/<sha256>.preview-<size>.jpg,
+one per entry in PREVIEW_SIZES, and recorded on AttachmentBlob.previews,
+which marks the notes showing the blob as changed (see myapp/cache.py). The
+serializers expose their URLs so list pages can show them instead of the
+originals.
+
+Rendering needs Pillow, and PyMuPDF for PDFs; without them blobs simply have
+no previews. `manage.py generate_previews` renders anything missing (e.g.
+blobs stored while the pool was down).
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from myapp import cache
+
+try:
+    from PIL import Image
+except ImportError:  # optional: no previews without Pillow
+    Image = None
+
+try:
+    import pymupdf
+except ImportError:  # optional: no PDF previews without PyMuPDF
+    pymupdf = None
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels for each preview
+PREVIEW_SIZES = getattr(settings, 'PREVIEW_SIZES', {'small': 160, 'medium': 480})
+# Worker processes; 0 leaves rendering to `generate_previews`
+PREVIEW_WORKERS = getattr(settings, 'PREVIEW_WORKERS', 2)
+PREVIEW_QUALITY = 80
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+PDF_EXTENSIONS = {'.pdf'}
+
+_pool = None
+
+
+def preview_name(blob_name, size):
+    return f'{os.path.splitext(blob_name)[0]}.preview-{size}.jpg'
+
+
+def is_preview_name(name):
+    return '.preview-' in os.path.basename(name)
+
+
+def can_preview(name):
+    ext = os.path.splitext(name)[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        return Image is not None
+    if ext in PDF_EXTENSIONS:
+        return Image is not None and pymupdf is not None
+    return False
+
+
+# -------------------------
+# Rendering (runs in the pool; no database access)
+# -------------------------
+def _first_page(path, edge):
+    with pymupdf.open(path) as doc:
+        page = doc[0]
+        # Render just large enough for the biggest preview
+        zoom = edge / max(page.rect.width, page.rect.height)
+        pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+
+def _open_image(path, edge):
+    image = Image.open(path)
+    # JPEG decoders can downscale while decoding, far cheaper than resizing
+    image.draft('RGB', (edge, edge))
+    image.seek(0)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render(source, destinations):
+    """
+    Write a JPEG preview of the file at `source` for each {size name:
+    (path, longest edge)} in `destinations`. Returns the size names written.
+    """
+    largest = max(edge for _, edge in destinations.values())
+    if os.path.splitext(source)[1].lower() in PDF_EXTENSIONS:
+        image = _first_page(source, largest)
+    else:
+        image = _open_image(source, largest)
+    written = []
+    # Largest first, so each smaller size is resized from the previous one
+    for size, (path, edge) in sorted(destinations.items(), key=lambda item: -item[1][1]):
+        image.thumbnail((edge, edge))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image.save(path, 'JPEG', quality=PREVIEW_QUALITY, optimize=True)
+        written.append(size)
+    return written
+
+
+# -------------------------
+# Scheduling (web process)
+# -------------------------
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: workers must not inherit DB connections or threads
+        _pool = ProcessPoolExecutor(PREVIEW_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _job(blob):
+    storage = blob.file.storage
+    names = {size: preview_name(blob.file.name, size) for size in PREVIEW_SIZES}
+    destinations = {size: (storage.path(name), PREVIEW_SIZES[size]) for size, name in names.items()}
+    return storage.path(blob.file.name), destinations, names
+
+
+def _record(blob_id, names, written):
+    from myapp.models import AttachmentBlob, NoteAttachment
+    previews = {size: names[size] for size in written}
+    AttachmentBlob.objects.filter(pk=blob_id).update(previews=previews)
+    if not previews:
+        # Serialized as {} before and after
+        return
+    # Cached payloads and ETags of the notes showing this blob are now stale
+    notes = NoteAttachment.objects.filter(blob_id=blob_id).values_list('note_id', 'note__user_id').distinct()
+    scopes = set()
+    for note_id, user_id in notes:
+        scopes.update((cache.user_scope(user_id), cache.note_scope(note_id)))
+    if scopes:
+        cache.touch(cache.all_notes_scope(), *scopes)
+
+
+def schedule(blob):
+    """Render previews for a newly stored blob once the transaction commits."""
+    if not PREVIEW_WORKERS:
+        return
+    if not can_preview(blob.file.name):
+        # Nothing to render; record that so it is not retried
+        from myapp.models import AttachmentBlob
+        AttachmentBlob.objects.filter(pk=blob.pk).update(previews={})
+        return
+    transaction.on_commit(lambda: _submit(blob))
+
+
+def _submit(blob):
+    source, destinations, names = _job(blob)
+    try:
+        future = _get_pool().submit(render, source, destinations)
+    except RuntimeError:
+        logger.exception("Preview pool unavailable")
+        return
+
+    def done(future):
+        # Runs on the pool's management thread
+        try:
+            written = future.result()
+        except Exception:
+            logger.exception("Preview rendering failed for blob %s", blob.pk)
+            written = []
+        try:
+            _record(blob.pk, names, written)
+        finally:
+            close_old_connections()
+    future.add_done_callback(done)
+
+
+def generate(blob):
+    """Render a blob's previews in this process and record them."""
+    if not can_preview(blob.file.name):
+        _record(blob.pk, {}, [])
+        return {}
+    source, destinations, names = _job(blob)
+    try:
+        written = render(source, destinations)
+    except Exception:
+        logger.exception("Preview rendering failed for blob %s", blob.pk)
+        written = []
+    _record(blob.pk, names, written)
+    return {size: names[size] for size in written}
@@ -1,13 +1,76 @@
 from rest_framework import renderers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.utils import encoders
 import json
 
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+
+def contains_error(data):
+  """True if a validation ErrorDetail appears anywhere in `data`."""
+  stack = [data]
+  while stack:
+    item = stack.pop()
+    if isinstance(item, ErrorDetail):
+      return True
+    if isinstance(item, dict):
+      stack.extend(item.values())
+    elif isinstance(item, (list, tuple)):
+      stack.extend(item)
+  return False
+
+
 class UserRenderer(renderers.JSONRenderer):
   charset='utf-8'
   def render(self, data, accepted_media_type=None, renderer_context=None):
-    response = ''
-    if 'ErrorDetail' in str(data):
-      response = json.dumps({'errors':data})
-    else:
-      response = json.dumps(data)
-    
-    return response
\ No newline at end of file
+    # Walk the data for ErrorDetail instead of stringifying the whole payload
+    if contains_error(data):
+      data = {'errors': data}
+    return json.dumps(data)
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+  """
+  Drop-in JSONRenderer that encodes with orjson when it is installed.
+
+  Compact output is byte-identical to JSONRenderer for the payloads this API
+  produces: UTF-8 without ASCII escaping, \\u2028/\\u2029 escaped, and
+  anything orjson does not handle natively (datetimes, Decimals, lazy
+  strings, ...) goes through DRF's encoder. Floats that need exponent
+  notation are the one difference (orjson writes 1e16 rather than 1e+16);
+  none of our fields produce them. Indented output (browsable API, or
+  `; indent=` in Accept) and payloads orjson rejects use the stock path.
+  """
+  _default = encoders.JSONEncoder().default
+  _options = (
+    orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if orjson is not None else 0
+  )
+
+  def render(self, data, accepted_media_type=None, renderer_context=None):
+    if orjson is None or data is None or not self.compact or self.ensure_ascii:
+      return super().render(data, accepted_media_type, renderer_context)
+    if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+      return super().render(data, accepted_media_type, renderer_context)
+    try:
+      ret = orjson.dumps(data, default=self._default, option=self._options)
+    except TypeError:
+      return super().render(data, accepted_media_type, renderer_context)
+    return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+  def render_list_stream(self, items):
+    """
+    Encode an iterable of list items one at a time. The concatenated chunks
+    equal render(list(items)), but the whole document is never held in memory.
+    """
+    yield b'['
+    first = True
+    for item in items:
+      if not first:
+        yield b','
+      first = False
+      yield self.render(item) if item is not None else b'null'
+    yield b']'
@@ -1,10 +1,20 @@
 from rest_framework import serializers
-from myapp.models import User, Note, NoteAttachment, NoteRating
-from django.db.models import Avg, Count
+from myapp.models import User, Note, NoteAttachment, NoteRating, AttachmentUpload
 from django.utils.encoding import smart_str, force_bytes, DjangoUnicodeDecodeError
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from myapp.utils import Util
+from myapp import presence, uploads
+from myapp.authentication import ClaimsRefreshToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from myapp.pagination import NoteCursorPagination
+from django.urls import reverse
+from rest_framework.utils.urls import replace_query_param
+from django.utils.encoding import iri_to_uri
+from django.db.models.functions import Left
+from itertools import islice
+import os
+import re
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
   # We are writing this becoz we need confirm password field in our Registratin Request
@@ -33,35 +43,60 @@ class UserLoginSerializer(serializers.ModelSerializer):
     model = User
     fields = ['email', 'password']
 
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+  # api/token/ issues the same claims as the login view (see myapp.authentication)
+  token_class = ClaimsRefreshToken
+
 class UserProfileSerializer(serializers.ModelSerializer):
-  notes_count = serializers.SerializerMethodField()
   notes = serializers.SerializerMethodField()
+  last_seen = serializers.SerializerMethodField()
   online = serializers.SerializerMethodField()
 
   class Meta:
     model = User
     fields = [
-  'id', 'email', 'name', 'bio', 'created_at', 'last_login', 'last_seen',
+  'id', 'email', 'name', 'handle', 'bio', 'created_at', 'last_login', 'last_seen',
   'is_admin', 'is_active', 'online', 'notes_count', 'notes'
     ]
 
-  def get_notes_count(self, obj):
-    return Note.objects.filter(user=obj).count()
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    # Notes are an opt-in expansion (?include=notes); by default the profile
+    # is a compact summary with the stored notes_count.
+    request = self.context.get('request')
+    include = request.query_params.get('include', '') if request is not None else ''
+    if 'notes' not in include.split(','):
+      self.fields.pop('notes')
 
   def get_notes(self, obj):
-    notes = Note.objects.filter(user=obj)
-    # Pass request context so nested serializers can compute user-specific fields
+    # First page of the author's notes through the batched list path; `next`
+    # continues in the author's public note list.
     request = self.context.get('request')
-    return NoteSerializer(notes, many=True, context={'request': request}).data
+    notes_qs = (
+      Note.objects.filter(user=obj)
+      .select_related('user')
+      .prefetch_related('attachments')
+      .with_list_stats(request.user)
+    )
+    serializer = NoteListSerializer(request)
+    paginator = NoteCursorPagination()
+    page = paginator.paginate_queryset(serializer.values(notes_qs), request)
+    paginator.base_url = replace_query_param(
+      request.build_absolute_uri(reverse('notes_by_username', kwargs={'username': obj.handle})),
+      paginator.page_size_query_param, paginator.page_size,
+    )
+    return {
+      'results': serializer.to_representation(page),
+      'next': paginator.get_next_link(),
+    }
+
+  def get_last_seen(self, obj):
+    # Heartbeats reach the DB in batches; the presence cache is fresher
+    value = presence.last_seen(obj, self.context.get('presence'))
+    return serializers.DateTimeField().to_representation(value) if value else None
 
   def get_online(self, obj):
-    from django.utils import timezone
-    if not getattr(obj, 'last_seen', None):
-      return False
-    try:
-      return (timezone.now() - obj.last_seen).total_seconds() < 120
-    except Exception:
-      return False
+    return presence.is_online(obj, self.context.get('presence'))
 
 
 class UserProfileUpdateSerializer(serializers.ModelSerializer):
@@ -145,11 +180,13 @@ class UserPasswordResetSerializer(serializers.Serializer):
       raise serializers.ValidationError('Token is not Valid or Expired')
   
 class NoteAttachmentSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='display_name', read_only=True)
     file_url = serializers.SerializerMethodField()
+    previews = serializers.SerializerMethodField()
 
     class Meta:
         model = NoteAttachment
-        fields = ['id', 'file', 'file_url', 'uploaded_at']
+        fields = ['id', 'name', 'file', 'file_url', 'previews', 'uploaded_at']
 
     def get_file_url(self, obj):
         request = self.context.get('request')
@@ -157,11 +194,56 @@ class NoteAttachmentSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.file.url)
         return None
 
+    def get_previews(self, obj):
+        # {size: url} of the thumbnails / first-page preview, once rendered
+        request = self.context.get('request')
+        stored = (obj.blob.previews if obj.blob_id else None) or {}
+        urls = {}
+        for size, name in stored.items():
+            url = obj.file.storage.url(name)
+            urls[size] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
+class AttachmentUploadSerializer(serializers.ModelSerializer):
+  # Resumable upload session (see myapp/uploads.py)
+  chunk_size = serializers.SerializerMethodField()
+
+  class Meta:
+    model = AttachmentUpload
+    fields = ['id', 'filename', 'size', 'received', 'sha256', 'chunk_size', 'created_at']
+    read_only_fields = ['id', 'received', 'created_at']
+    extra_kwargs = {
+      'size': {'min_value': 1},
+      'sha256': {'required': False},
+    }
+
+  def validate_size(self, value):
+    if value > uploads.ATTACHMENT_UPLOAD_MAX_SIZE:
+      raise serializers.ValidationError(f"Attachments are limited to {uploads.ATTACHMENT_UPLOAD_MAX_SIZE} bytes")
+    return value
+
+  def validate_sha256(self, value):
+    if value and not re.fullmatch(r'[0-9a-fA-F]{64}', value):
+      raise serializers.ValidationError("Expected a hex SHA-256 digest")
+    return value.lower()
+
+  def validate_filename(self, value):
+    # Only the base name is kept; storage adds the folder
+    name = os.path.basename(value.replace('\\', '/'))
+    if not name:
+      raise serializers.ValidationError("A file name is required")
+    return name
+
+  def get_chunk_size(self, obj):
+    return uploads.ATTACHMENT_UPLOAD_CHUNK_SIZE
+
 
 class NoteSerializer(serializers.ModelSerializer):
   attachments = NoteAttachmentSerializer(many=True, read_only=True)
   username = serializers.CharField(source='user.email', read_only=True)
   name = serializers.CharField(source='user.name', read_only=True)
+  handle = serializers.CharField(source='user.handle', read_only=True)
   avg_rating = serializers.SerializerMethodField()
   ratings_count = serializers.SerializerMethodField()
   user_rating = serializers.SerializerMethodField()
@@ -169,7 +251,7 @@ class NoteSerializer(serializers.ModelSerializer):
 
   class Meta:
     model = Note
-    fields = ['id', 'title', 'body', 'slug', 'category', 'created_at', 'updated_at', 'attachments', 'username', 'name', 'avg_rating', 'ratings_count', 'user_rating', 'is_bookmarked']
+    fields = ['id', 'title', 'body', 'slug', 'category', 'created_at', 'updated_at', 'attachments', 'username', 'name', 'handle', 'avg_rating', 'ratings_count', 'user_rating', 'is_bookmarked']
 
     read_only_fields = ['slug', 'created_at', 'updated_at']
 
@@ -180,17 +262,22 @@ class NoteSerializer(serializers.ModelSerializer):
     return super().create(validated_data)
 
   def get_avg_rating(self, obj):
-    agg = obj.ratings.aggregate(avg=Avg('value'))
-    return round(agg['avg'], 1) if agg['avg'] is not None else None
+    avg = obj.rating_avg
+    return round(avg, 1) if avg is not None else None
 
   def get_ratings_count(self, obj):
-    return obj.ratings.aggregate(cnt=Count('id'))['cnt'] or 0
+    return obj.rating_count
+
+  # List views annotate these via Note.objects.with_list_stats(); fall back
+  # to per-note queries for single instances that were fetched without it.
 
   def get_user_rating(self, obj):
     request = self.context.get('request')
     user = getattr(request, 'user', None)
     if not user or not user.is_authenticated:
       return None
+    if hasattr(obj, 'annotated_user_rating'):
+      return obj.annotated_user_rating
     r = obj.ratings.filter(user=user).first()
     return r.value if r else None
 
@@ -199,9 +286,175 @@ class NoteSerializer(serializers.ModelSerializer):
     user = getattr(request, 'user', None)
     if not user or not user.is_authenticated:
       return False
+    if hasattr(obj, 'annotated_is_bookmarked'):
+      return bool(obj.annotated_is_bookmarked)
     return obj.bookmarks.filter(id=user.id).exists()
 
 
+class NoteListSerializer:
+  """
+  Read-only fast path for note lists. Renders `.values()` rows into exactly
+  the JSON NoteSerializer produces for list views, with the attachments of a
+  whole batch fetched in one query, and without per-field serializer dispatch.
+  The querysets must come from Note.objects...with_list_stats(viewer).
+
+  Clients can ask for a sparse fieldset with ?fields=a,b and/or ?exclude=a,b,
+  or for the `card` projection (?fields=card, on its own), which replaces
+  `body` with a `snippet` truncated in the database. Only the columns the requested fields
+  need are selected, so a card list never reads note bodies.
+  """
+  fields = (
+    'id', 'title', 'body', 'slug', 'category', 'created_at', 'updated_at',
+    'attachments', 'username', 'name', 'handle', 'avg_rating', 'ratings_count',
+    'user_rating', 'is_bookmarked',
+  )
+  projections = {
+    'card': (
+      'id', 'title', 'snippet', 'slug', 'category', 'updated_at', 'name', 'handle',
+      'avg_rating', 'ratings_count', 'user_rating', 'is_bookmarked',
+    ),
+  }
+  snippet_length = 200
+  # Columns each output field reads
+  columns = {
+    'id': ('id',),
+    'title': ('title',),
+    'body': ('body',),
+    'snippet': ('snippet',),
+    'slug': ('slug',),
+    'category': ('category',),
+    'created_at': ('created_at',),
+    'updated_at': ('updated_at',),
+    'attachments': (),
+    'username': ('user__email',),
+    'name': ('user__name',),
+    'handle': ('user__handle',),
+    'avg_rating': ('rating_sum', 'rating_count'),
+    'ratings_count': ('rating_count',),
+    'user_rating': ('annotated_user_rating',),
+    'is_bookmarked': ('annotated_is_bookmarked',),
+  }
+  # Always selected: keyset pagination and the attachment lookup need them
+  keyset_columns = ('updated_at', 'created_at', 'id')
+  viewer_columns = ('annotated_user_rating', 'annotated_is_bookmarked')
+
+  def __init__(self, request, output=None):
+    self.request = request
+    user = getattr(request, 'user', None)
+    self.authenticated = bool(user and user.is_authenticated)
+    self.datetime = serializers.DateTimeField().to_representation
+    self.storage = NoteAttachment._meta.get_field('file').storage
+    self.host = request.build_absolute_uri('/')[:-1] if request is not None else None
+    # `output` is the result of get_output_fields(), when the caller has it
+    self.output = self.get_output_fields(request) if output is None else output
+    self.getters = [(name, self.getter(name)) for name in self.output]
+
+  @classmethod
+  def get_output_fields(cls, request):
+    params = request.query_params if request is not None else {}
+    requested = [f for f in params.get('fields', '').split(',') if f]
+    excluded = [f for f in params.get('exclude', '').split(',') if f]
+    unknown = sorted(set(requested + excluded) - set(cls.columns) - set(cls.projections))
+    if unknown:
+      raise serializers.ValidationError({'fields': [f'Unknown note field: {name}' for name in unknown]})
+    # A projection is a whole fieldset: it can only be asked for on its own
+    projection = [f for f in requested if f in cls.projections]
+    if projection and len(set(requested)) > 1:
+      raise serializers.ValidationError(
+        {'fields': [f'{projection[0]} is a projection and cannot be combined with other fields']}
+      )
+    excluded_projections = [f for f in excluded if f in cls.projections]
+    if excluded_projections:
+      raise serializers.ValidationError(
+        {'exclude': [f'{name} is a projection and cannot be excluded' for name in excluded_projections]}
+      )
+    if projection:
+      output = cls.projections[projection[0]]
+    elif requested:
+      output = [f for f in (*cls.fields, 'snippet') if f in requested]
+    else:
+      output = cls.fields
+    return [f for f in output if f not in excluded]
+
+  def getter(self, name):
+    if name in ('created_at', 'updated_at'):
+      to_datetime = self.datetime
+      return lambda row, attachments: to_datetime(row[name])
+    if name == 'attachments':
+      return lambda row, attachments: attachments[row['id']]
+    if name == 'avg_rating':
+      return lambda row, attachments: (
+        round(row['rating_sum'] / row['rating_count'], 1) if row['rating_count'] else None
+      )
+    if name == 'user_rating' and not self.authenticated:
+      return lambda row, attachments: None
+    if name == 'is_bookmarked':
+      if not self.authenticated:
+        return lambda row, attachments: False
+      return lambda row, attachments: bool(row['annotated_is_bookmarked'])
+    column = self.columns[name][0]
+    return lambda row, attachments: row[column]
+
+  def values(self, queryset):
+    columns = dict.fromkeys(self.keyset_columns)
+    for name in self.output:
+      columns.update(dict.fromkeys(self.columns[name]))
+    if not self.authenticated:
+      for column in self.viewer_columns:
+        columns.pop(column, None)
+    queryset = queryset.prefetch_related(None)
+    if 'snippet' in columns:
+      queryset = queryset.annotate(snippet=Left('body', self.snippet_length))
+    return queryset.values(*columns)
+
+  def file_url(self, name):
+    if not name:
+      return None
+    url = self.storage.url(name)
+    if self.request is None:
+      return url
+    if url.startswith('/') and not url.startswith('//'):
+      return iri_to_uri(self.host + url)
+    return self.request.build_absolute_uri(url)
+
+  def attachments_for(self, note_ids):
+    to_datetime = self.datetime
+    grouped = {pk: [] for pk in note_ids}
+    rows = (
+      NoteAttachment.objects.filter(note_id__in=note_ids)
+      .order_by('id')
+      .values_list('note_id', 'id', 'name', 'file', 'blob__previews', 'uploaded_at')
+    )
+    for note_id, pk, display_name, name, previews, uploaded_at in rows:
+      url = self.file_url(name)
+      grouped[note_id].append({
+        'id': pk,
+        'name': display_name or os.path.basename(name),
+        'file': url,
+        'file_url': url if self.request is not None else None,
+        'previews': {size: self.file_url(preview) for size, preview in (previews or {}).items()},
+        'uploaded_at': to_datetime(uploaded_at),
+      })
+    return grouped
+
+  def to_representation(self, rows):
+    """Render a batch of rows from values(); one query for their attachments."""
+    attachments = None
+    if 'attachments' in self.output:
+      attachments = self.attachments_for([row['id'] for row in rows])
+    getters = self.getters
+    return [{name: get(row, attachments) for name, get in getters} for row in rows]
+
+  def iter_representation(self, queryset, chunk_size=500):
+    """Yield rendered notes for a whole queryset, `chunk_size` rows per batch."""
+    rows = self.values(queryset).iterator(chunk_size=chunk_size)
+    while True:
+      batch = list(islice(rows, chunk_size))
+      if not batch:
+        return
+      yield from self.to_representation(batch)
+
+
 class NoteRatingSerializer(serializers.ModelSerializer):
   class Meta:
     model = NoteRating
@@ -211,32 +464,32 @@ class NoteRatingSerializer(serializers.ModelSerializer):
     }
 
 
+class NoteBulkItemSerializer(serializers.ModelSerializer):
+  # One instance validates every item of a bulk request (see myapp/bulk.py)
+  class Meta:
+    model = Note
+    fields = ['title', 'body', 'category']
+
+
 # Admin-facing lightweight serializer for managing users
 class AdminUserSerializer(serializers.ModelSerializer):
-  notes_count = serializers.SerializerMethodField()
+  last_seen = serializers.SerializerMethodField()
   online = serializers.SerializerMethodField()
 
   class Meta:
     model = User
     fields = [
-      'id', 'email', 'name', 'is_admin', 'is_active', 'created_at', 'last_login', 'last_seen', 'online', 'notes_count'
+      'id', 'email', 'name', 'handle', 'is_admin', 'is_active', 'created_at', 'last_login', 'last_seen', 'online', 'notes_count'
     ]
-    read_only_fields = ['id', 'email', 'created_at', 'last_login', 'last_seen', 'online', 'notes_count']
+    read_only_fields = ['id', 'email', 'handle', 'created_at', 'last_login', 'last_seen', 'online', 'notes_count']
 
-  def get_notes_count(self, obj):
-    # Use annotated value if present to avoid N+1; fallback to query
-    val = getattr(obj, 'notes_count', None)
-    if isinstance(val, int):
-      return val
-    return Note.objects.filter(user=obj).count()
+
+  def get_last_seen(self, obj):
+    # Heartbeats reach the DB in batches; the presence cache is fresher
+    value = presence.last_seen(obj, self.context.get('presence'))
+    return serializers.DateTimeField().to_representation(value) if value else None
 
   def get_online(self, obj):
-    from django.utils import timezone
-    if not getattr(obj, 'last_seen', None):
-      return False
-    try:
-      return (timezone.now() - obj.last_seen).total_seconds() < 120
-    except Exception:
-      return False
+    return presence.is_online(obj, self.context.get('presence'))
 
 
@@ -0,0 +1,120 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from myapp import authentication, blobs, cache, cleanup
+from myapp.models import Note, NoteAttachment, NoteRating, User
+
+
+# Rating aggregates on Note: creates and deletes are counted here, value
+# changes are applied by Note.set_rating().
+@receiver(post_save, sender=NoteRating)
+def increment_note_rating_stats(sender, instance, created, **kwargs):
+    if not created:
+        return
+    Note.objects.filter(pk=instance.note_id).update(
+        rating_sum=F('rating_sum') + instance.value,
+        rating_count=F('rating_count') + 1,
+    )
+
+
+@receiver(post_delete, sender=NoteRating)
+def decrement_note_rating_stats(sender, instance, **kwargs):
+    # Also runs for ratings removed by cascading user/note deletes
+    Note.objects.filter(pk=instance.note_id).update(
+        rating_sum=F('rating_sum') - instance.value,
+        rating_count=F('rating_count') - 1,
+    )
+
+
+@receiver(post_save, sender=Note)
+def increment_user_notes_count(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(pk=instance.user_id).update(notes_count=F('notes_count') + 1)
+
+
+@receiver(post_delete, sender=Note)
+def decrement_user_notes_count(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.user_id).update(notes_count=F('notes_count') - 1)
+
+
+@receiver(post_delete, sender=NoteAttachment)
+def release_attachment_file(sender, instance, **kwargs):
+    # Also runs for attachments removed by cascading note/user deletes.
+    # Blob files are shared and go with the blob sweep; older per-note files
+    # are queued for deletion after commit.
+    if instance.blob_id is not None:
+        blobs.release(instance.blob_id)
+    elif instance.file:
+        cleanup.schedule_delete(instance.file.name)
+
+
+# Change stamps for conditional GETs and cached payloads (see myapp.cache)
+@receiver([post_save, post_delete], sender=Note)
+def touch_note_cache(sender, instance, **kwargs):
+    cache.touch_note(instance.pk, instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=NoteAttachment)
+def touch_attachment_cache(sender, instance, **kwargs):
+    try:
+        note = instance.note
+    except Note.DoesNotExist:
+        return
+    cache.touch_note(note.pk, note.user_id)
+
+
+@receiver([post_save, post_delete], sender=NoteRating)
+def touch_rating_cache(sender, instance, **kwargs):
+    cache.touch(cache.viewer_scope(instance.user_id))
+    try:
+        note = instance.note
+    except Note.DoesNotExist:
+        return
+    cache.touch_note(note.pk, note.user_id)
+
+
+@receiver(m2m_changed, sender=Note.bookmarks.through)
+def touch_bookmark_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    # Bookmarks only show up in the bookmarking user's own payloads
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        cache.touch(cache.viewer_scope(instance.pk))
+    elif action == 'post_clear':
+        # pk_set is not provided for clear(); touch every payload of the note
+        cache.touch_note(instance.pk, instance.user_id)
+    else:
+        cache.touch(*[cache.viewer_scope(pk) for pk in pk_set])
+
+
+@receiver(post_save, sender=User)
+def touch_author_cache(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    fields = set(update_fields) if update_fields is not None else None
+    # last_seen / last_login feed Last-Modified directly
+    if fields is not None and fields <= {'last_seen', 'last_login'}:
+        return
+    cache.touch(cache.profile_scope(instance.pk))
+    # Notes embed the author's email and name. A plain save() lists every
+    # field in update_fields (PreserveCountersMixin), so compare values.
+    changed = instance.changed_fields(User.AUTHOR_FIELDS)
+    if fields is not None:
+        changed &= fields
+    if changed:
+        cache.touch(cache.all_notes_scope(), cache.user_scope(instance.pk))
+
+
+# Cached token versions (see myapp.authentication)
+@receiver(post_save, sender=User)
+def forget_token_version(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        return
+    if update_fields is None or {'token_version', 'is_active'} & set(update_fields):
+        authentication.forget(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_token_version(sender, instance, **kwargs):
+    authentication.forget(instance.pk)
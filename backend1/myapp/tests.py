@@ -1,3 +1,1312 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from concurrent.futures import Future
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+from myapp import authentication, blobs, cache, cleanup, outbox, presence, previews, renderers, uploads, views
+from myapp.handles import handle_ids
+from myapp.pagination import AdminUserPagination, NoteCursorPagination
+from myapp.renderers import FastJSONRenderer, UserRenderer
+from myapp.models import (
+    AttachmentBlob, AttachmentUpload, FileDeletion, Note, NoteAttachment, NoteRating, OutboundEmail, User,
+)
+from myapp.serializers import NoteListSerializer, NoteSerializer
+from myapp.throttling import LoginAccountThrottle, LoginThrottle
+
+
+def body(response):
+    """Decoded JSON of a plain or streamed response."""
+    if response.streaming:
+        return json.loads(b''.join(response.streaming_content))
+    return response.json()
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        # Payloads, presence and throttle counters live in the caches
+        for alias in caches:
+            caches[alias].clear()
+        self.client = APIClient()
+
+    def make_user(self, name):
+        return User.objects.create_user(f'{name}@example.com', name, True, 'secret-password')
+
+
+class NoteCursorPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        for i in range(25):
+            Note.objects.create(user=self.user, title=f'note {i}', body='body')
+        # Ties on updated_at and created_at must still page by id
+        Note.objects.filter(pk__in=Note.objects.values('pk')[:10]).update(
+            updated_at=timezone.now() - timedelta(days=1),
+            created_at=timezone.now() - timedelta(days=2),
+        )
+
+    def pages(self, url):
+        page = body(self.client.get(url))
+        pages = [page]
+        while page['next']:
+            page = body(self.client.get(page['next']))
+            pages.append(page)
+        return pages
+
+    def test_pages_follow_the_unpaginated_order(self):
+        expected = [note['id'] for note in body(self.client.get('/api/user/notes/'))]
+        pages = self.pages('/api/user/notes/?page_size=7')
+        self.assertEqual([len(p['results']) for p in pages], [7, 7, 7, 4])
+        self.assertEqual([n['id'] for p in pages for n in p['results']], expected)
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_previous_returns_the_earlier_page(self):
+        pages = self.pages('/api/user/notes/?page_size=7')
+        back = body(self.client.get(pages[2]['previous']))
+        self.assertEqual(back['results'], pages[1]['results'])
+
+    def test_invalid_cursor_is_404(self):
+        self.assertEqual(self.client.get('/api/user/notes/?cursor=nonsense').status_code, 404)
+
+
+class NoteListQueryCountTests(APITestCase):
+    """A list page costs the same queries however many notes it holds."""
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = self.make_user('viewer')
+        authors = [self.viewer, self.make_user('bob'), self.make_user('carol')]
+        for i in range(60):
+            note = Note.objects.create(user=authors[i % 3], title=f'note {i}', body='body')
+            NoteRating.objects.create(note=note, user=authors[1], value=i % 5 + 1)
+            NoteRating.objects.create(note=note, user=authors[2], value=3)
+            note.bookmarks.add(self.viewer)
+        self.client.force_authenticate(self.viewer)
+
+    def assertPageQueries(self, url, total):
+        for size in (5, 50):
+            caches['notes'].clear()
+            # The notes with their rating and bookmark state, then their attachments
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {'page_size': size})
+            self.assertEqual(len(body(response)['results']), min(size, total))
+
+    def test_notes(self):
+        self.assertPageQueries('/api/user/notes/', 60)
+
+    def test_my_notes(self):
+        self.assertPageQueries('/api/user/notes/mine/', 20)
+
+    def test_bookmarked_notes(self):
+        self.assertPageQueries('/api/user/notes/bookmarked/', 60)
+
+    def test_annotated_values(self):
+        note = body(self.client.get('/api/user/notes/', {'page_size': 60}))['results'][-1]
+        self.assertEqual(note['ratings_count'], 2)
+        self.assertEqual(note['avg_rating'], 2.0)
+        self.assertIsNone(note['user_rating'])
+        self.assertTrue(note['is_bookmarked'])
+
+
+# SQLite has a single writer; parallel creates fail with "database table is locked"
+@unittest.skipUnless(connection.vendor == 'postgresql', 'needs concurrent writers')
+class ConcurrentSlugTests(TransactionTestCase):
+    """Same-title notes created from parallel threads all get distinct slugs."""
+
+    threads = 8
+    per_thread = 250
+
+    def test_parallel_same_title_creates(self):
+        user = User.objects.create_user('slugs@example.com', 'slugs', True, 'secret-password')
+        errors = []
+        start = threading.Barrier(self.threads)
+
+        def create():
+            try:
+                start.wait()
+                for _ in range(self.per_thread):
+                    Note.objects.create(user=user, title='Same Title', body='body')
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=create) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        slugs = list(Note.objects.values_list('slug', flat=True))
+        self.assertEqual(len(slugs), self.threads * self.per_thread)
+        self.assertEqual(len(set(slugs)), len(slugs))
+        self.assertIn('same-title', slugs)
+        user.refresh_from_db()
+        self.assertEqual(user.notes_count, len(slugs))
+
+
+class ConditionalGetTests(APITestCase):
+    """A matching If-None-Match is answered without serializing anything."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.note = Note.objects.create(user=self.user, title='A note', body='body')
+        self.note.bookmarks.add(self.user)
+
+    def assertNotModifiedWithout(self, url, serializer, authenticated=False):
+        if authenticated:
+            self.client.force_authenticate(self.user)
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        with mock.patch(f'myapp.views.{serializer}', wraps=getattr(views, serializer)) as patched:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        patched.assert_not_called()
+
+    def test_notes(self):
+        self.assertNotModifiedWithout('/api/user/notes/', 'NoteListSerializer')
+
+    def test_my_notes(self):
+        self.assertNotModifiedWithout('/api/user/notes/mine/', 'NoteListSerializer', authenticated=True)
+
+    def test_bookmarked_notes(self):
+        self.assertNotModifiedWithout('/api/user/notes/bookmarked/', 'NoteListSerializer', authenticated=True)
+
+    def test_note_detail(self):
+        self.assertNotModifiedWithout(f'/api/user/notes/{self.note.slug}/', 'NoteSerializer')
+
+    def test_profile(self):
+        self.assertNotModifiedWithout('/api/user/profile/', 'UserProfileSerializer', authenticated=True)
+
+    def test_write_changes_the_etag(self):
+        etag = self.client.get('/api/user/notes/')['ETag']
+        # Scopes are touched once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            Note.objects.create(user=self.user, title='Another note', body='body')
+        response = self.client.get('/api/user/notes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(body(response)), 2)
+
+    def author_saved(self, user, **kwargs):
+        scopes = (cache.all_notes_scope(), cache.user_scope(self.user.pk))
+        before = [cache.last_changed(scope) for scope in scopes]
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save(**kwargs)
+        return [cache.last_changed(scope) for scope in scopes] != before
+
+    def test_profile_save_keeps_note_payloads(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new-password')
+        self.assertFalse(self.author_saved(user))
+        user.bio = 'Hello'
+        self.assertFalse(self.author_saved(user, update_fields=['bio', 'name']))
+
+    def test_author_change_touches_note_payloads(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.name = 'Alice Liddell'
+        self.assertTrue(self.author_saved(user))
+        # Stored now; saving it again is not a change
+        self.assertFalse(self.author_saved(user))
+        user.email = 'liddell@example.com'
+        self.assertTrue(self.author_saved(user, update_fields=['email']))
+        user.name = 'Alice'
+        self.assertFalse(self.author_saved(user, update_fields=['bio']))
+        self.assertTrue(self.author_saved(user, update_fields=['name']))
+
+
+class LoginTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        presence.flush()
+        self.addCleanup(presence.flush)
+        for target, value in (
+            ('myapp.presence.PRESENCE_FLUSH_INTERVAL', 60 * 60),
+            ('myapp.presence.PRESENCE_FLUSH_IN_BACKGROUND', False),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = self.make_user('alice')
+
+    def login(self):
+        response = self.client.post(
+            '/api/user/login/', {'email': self.user.email, 'password': 'secret-password'}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_first_login_shows_in_the_admin_list(self):
+        admin = self.make_user('admin')
+        User.objects.filter(pk=admin.pk).update(is_admin=True)
+        self.login()
+        self.client.force_authenticate(User.objects.get(pk=admin.pk))
+        emails = [row['email'] for row in self.client.get('/api/user/admin/users/').json()]
+        self.assertEqual(emails, [self.user.email])
+
+    def test_forwarded_for_does_not_dodge_the_ip_limit(self):
+        limit = LoginThrottle().num_requests
+        for i in range(limit + 1):
+            response = self.client.post(
+                '/api/user/login/', {'email': f'guess{i}@example.com', 'password': 'guess'},
+                format='json', headers={'X-Forwarded-For': f'203.0.113.{i}'},
+            )
+        self.assertEqual(response.status_code, 429)
+
+    def test_token_endpoint_shares_the_login_limits(self):
+        limit = LoginAccountThrottle().num_requests
+        body = {'email': self.user.email, 'password': 'guess'}
+        for _ in range(limit):
+            self.assertEqual(self.client.post('/api/user/api/token/', body, format='json').status_code, 401)
+        self.assertEqual(self.client.post('/api/user/api/token/', body, format='json').status_code, 429)
+        self.assertEqual(self.client.post('/api/user/login/', body, format='json').status_code, 429)
+
+    def test_later_logins_are_buffered(self):
+        self.login()
+        first = User.objects.get(pk=self.user.pk).last_login
+        self.login()
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_login, first)
+        presence.flush()
+        self.assertGreater(User.objects.get(pk=self.user.pk).last_login, first)
+
+
+class PresenceFlushTests(TransactionTestCase):
+    """The background flusher writes buffered heartbeats without further traffic."""
+
+    def setUp(self):
+        for alias in caches:
+            caches[alias].clear()
+        presence.flush()
+
+    def test_idle_buffer_is_written(self):
+        user = User.objects.create_user('idle@example.com', 'idle', True, 'secret-password')
+        with mock.patch('myapp.presence.PRESENCE_FLUSH_INTERVAL', 0.2):
+            # Coming online is written through; the next heartbeat is buffered
+            presence.record(user, timezone.now() - timedelta(seconds=30))
+            seen = presence.record(user)
+            deadline = time.monotonic() + 5
+            while User.objects.get(pk=user.pk).last_seen != seen and time.monotonic() < deadline:
+                time.sleep(0.05)
+        self.assertEqual(User.objects.get(pk=user.pk).last_seen, seen)
+
+
+class ClaimsAuthenticationTests(APITestCase):
+    """Requests authenticated from token claims, without loading the user row."""
+
+    def setUp(self):
+        super().setUp()
+        authentication._local.clear()
+        self.addCleanup(authentication._local.clear)
+        self.user = self.make_user('alice')
+        response = self.client.post(
+            '/api/user/login/', {'email': self.user.email, 'password': 'secret-password'}, format='json',
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['token']['access']}")
+
+    def test_bookmark(self):
+        note = Note.objects.create(user=self.make_user('bob'), title='Shared', body='body')
+        response = self.client.post(f'/api/user/notes/{note.slug}/bookmark/')
+        self.assertEqual(response.status_code, 200)
+        self.assertQuerySetEqual(note.bookmarks.all(), [self.user])
+
+    def test_profile_update(self):
+        response = self.client.patch('/api/user/profile/', {'name': 'Alice B'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.objects.get(pk=self.user.pk).name, 'Alice B')
+
+    def test_saving_never_writes_the_token_fields(self):
+        # Authenticated just before an admin deactivated the account
+        user = User.from_claims(id=self.user.pk, is_admin=False, is_active=True, token_version=0)
+        deactivated = User.objects.get(pk=self.user.pk)
+        deactivated.is_active = False
+        deactivated.save()
+
+        user.name = 'Alice B'
+        user.save()
+        user.set_password('new-password')
+        user.save(update_fields=['password', 'is_active', 'token_version'])
+        row = User.objects.get(pk=self.user.pk)
+        self.assertEqual((row.name, row.is_active, row.token_version), ('Alice B', False, 1))
+        self.assertTrue(row.check_password('new-password'))
+
+
+class AdminUsersTests(APITestCase):
+    url = '/api/user/admin/users/'
+
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_user('admin')
+        User.objects.filter(pk=self.admin.pk).update(is_admin=True)
+        self.client.force_authenticate(User.objects.get(pk=self.admin.pk))
+        now = timezone.now()
+        self.users = {}
+        for i, name in enumerate(('alice', 'albert', 'bob', 'carol')):
+            user = self.make_user(name)
+            User.objects.filter(pk=user.pk).update(last_login=now - timedelta(hours=i), notes_count=i)
+            self.users[name] = user
+        self.make_user('never')
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def names(self, rows):
+        return [row['name'] for row in rows]
+
+    def test_admins_only(self):
+        self.client.force_authenticate(self.users['alice'])
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_unpaginated_by_default(self):
+        self.assertEqual(self.names(self.get()), ['alice', 'albert', 'bob', 'carol'])
+        self.assertEqual(len(self.get(all='1')), 6)
+
+    def test_page_shape(self):
+        page = self.get(page_size=3)
+        self.assertEqual(set(page), {'count', 'next', 'previous', 'results'})
+        self.assertEqual((page['count'], self.names(page['results'])), (4, ['alice', 'albert', 'bob']))
+        self.assertIn('page=2', page['next'])
+        self.assertEqual(self.names(self.get(page=2, page_size=3)['results']), ['carol'])
+
+    def test_page_size_is_capped(self):
+        User.objects.bulk_create(
+            User(email=f'bulk{i}@example.com', name=f'bulk {i}', handle=f'bulk-{i}', tc=True,
+                 last_login=timezone.now())
+            for i in range(AdminUserPagination.max_page_size + 5)
+        )
+        page = self.get(page_size=1000)
+        self.assertEqual(len(page['results']), AdminUserPagination.max_page_size)
+
+    def test_prefix_search_and_filters(self):
+        self.assertEqual(self.names(self.get(q='al')), ['alice', 'albert'])
+        self.assertEqual(self.names(self.get(q='BOB@')), ['bob'])
+        User.objects.filter(pk=self.users['bob'].pk).update(is_active=False)
+        self.assertEqual(self.names(self.get(is_active='false')), ['bob'])
+        self.assertEqual(self.get(is_admin='true'), [])
+
+    def test_ordering(self):
+        self.assertEqual(self.names(self.get(ordering='-notes_count')), ['carol', 'bob', 'albert', 'alice'])
+        # Unknown keys fall back to the default
+        self.assertEqual(self.names(self.get(ordering='password')), ['alice', 'albert', 'bob', 'carol'])
+
+    def test_online_filter(self):
+        presence.record(self.users['bob'])
+        presence.record(self.users['carol'], timezone.now() - timedelta(seconds=presence.ONLINE_WINDOW + 5))
+        self.assertEqual(self.names(self.get(online='true')), ['bob'])
+        self.assertEqual(self.names(self.get(online='false')), ['alice', 'albert', 'carol'])
+        row, = self.get(online='true')
+        self.assertTrue(row['online'])
+
+
+class AdminOnlineUsersTests(APITestCase):
+    url = '/api/user/admin/users/online/'
+
+    def setUp(self):
+        super().setUp()
+        admin = self.make_user('admin')
+        User.objects.filter(pk=admin.pk).update(is_admin=True)
+        self.client.force_authenticate(User.objects.get(pk=admin.pk))
+        now = timezone.now()
+        self.users = [self.make_user(name) for name in ('alice', 'bob', 'carol', 'dave')]
+        # Seen 10s, 20s and 30s ago; dave is past the online window
+        for i, user in enumerate(self.users[:3], start=1):
+            presence.record(user, now - timedelta(seconds=10 * i))
+        presence.record(self.users[3], now - timedelta(seconds=presence.ONLINE_WINDOW + 5))
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_admins_only(self):
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_online_users_most_recent_first(self):
+        data = self.get()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([row['name'] for row in data['results']], ['alice', 'bob', 'carol'])
+        self.assertTrue(all(row['online'] for row in data['results']))
+
+    def test_pages(self):
+        first = self.get(page_size=2)
+        self.assertEqual((first['count'], len(first['results'])), (3, 2))
+        self.assertIn('page=2', first['next'])
+        second = self.get(page=2, page_size=2)
+        self.assertEqual([row['name'] for row in second['results']], ['carol'])
+        self.assertIsNone(second['next'])
+
+    def test_histogram(self):
+        histogram = self.get(hours=6)['histogram']
+        self.assertEqual(len(histogram), 6)
+        self.assertEqual(sum(bucket['active'] for bucket in histogram), 4)
+        self.assertEqual(len(self.get(hours=1000)['histogram']), 168)
+        self.assertEqual(len(self.get(hours='x')['histogram']), 24)
+
+
+class PublicProfileTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        handle_ids.clear()
+        self.user = self.make_user('alice')
+
+    def test_by_handle(self):
+        response = self.client.get(f'/api/user/profile/{self.user.handle}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['handle'], self.user.handle)
+
+    def test_email_redirects_to_handle(self):
+        for path in ('profile/alice@example.com/', 'notes/by-user/alice@example.com/'):
+            response = self.client.get(f'/api/user/{path}')
+            self.assertEqual(response.status_code, 301)
+            self.assertTrue(response['Location'].endswith(path.replace('alice@example.com', self.user.handle)))
+
+    def test_unknown(self):
+        self.assertEqual(self.client.get('/api/user/profile/nobody/').status_code, 404)
+
+
+class TemporaryMediaMixin:
+    """Stores files in a throwaway MEDIA_ROOT on the local filesystem."""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        storages = {
+            **settings.STORAGES,
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        }
+        override = override_settings(MEDIA_ROOT=media, STORAGES=storages)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class ProfileNotesTests(APITestCase):
+    """Profiles leave notes out unless asked for, then embed one page."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.page_size = NoteCursorPagination.page_size
+        for i in range(self.page_size + 3):
+            Note.objects.create(user=self.user, title=f'note {i}', body='body')
+        Note.objects.create(user=self.make_user('bob'), title='not hers', body='body')
+        self.url = f'/api/user/profile/{self.user.handle}/'
+
+    def test_compact_by_default(self):
+        data = self.client.get(self.url).json()
+        self.assertNotIn('notes', data)
+        self.assertEqual(data['notes_count'], self.page_size + 3)
+
+    def test_include_notes(self):
+        notes = self.client.get(self.url, {'include': 'notes'}).json()['notes']
+        self.assertEqual(set(notes), {'results', 'next'})
+        self.assertEqual(len(notes['results']), self.page_size)
+        listed = f'/api/user/notes/by-user/{self.user.handle}/'
+        self.assertIn(listed, notes['next'])
+
+        rest = body(self.client.get(notes['next']))
+        self.assertEqual(len(rest['results']), 3)
+        self.assertIsNone(rest['next'])
+        ids = [n['id'] for n in notes['results'] + rest['results']]
+        self.assertEqual(sorted(ids), sorted(Note.objects.filter(user=self.user).values_list('id', flat=True)))
+
+    def test_own_profile(self):
+        self.client.force_authenticate(self.user)
+        self.assertNotIn('notes', self.client.get('/api/user/profile/').json())
+        data = self.client.get('/api/user/profile/', {'include': 'notes'}).json()
+        self.assertEqual(len(data['notes']['results']), self.page_size)
+
+
+class NoteListSerializerParityTests(TemporaryMediaMixin, APITestCase):
+    """NoteListSerializer renders exactly the JSON NoteSerializer does."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_user('author')
+        self.viewer = self.make_user('viewer')
+        rated = Note.objects.create(user=self.author, title='Rated', body='Body with ünïcode', category='WORK')
+        rated.set_rating(self.viewer, 4)
+        rated.set_rating(self.author, 5)
+        rated.bookmarks.add(self.viewer)
+
+        with_files = Note.objects.create(user=self.author, title='Files', body='body')
+        attachment = NoteAttachment(note=with_files, file=ContentFile(b'%PDF-1.4', name='report.pdf'))
+        attachment.save()
+        AttachmentBlob.objects.filter(pk=attachment.blob_id).update(
+            previews={'small': 'blobs/aa/bb/preview-small.jpg', 'large': 'blobs/aa/bb/preview-large.jpg'}
+        )
+        NoteAttachment(note=with_files, file=ContentFile(b'text', name='notes.txt')).save()
+        # Stored before content-addressed blobs: no blob, no original name
+        legacy = storages['default'].save('notes/files/old file.txt', ContentFile(b'old'))
+        NoteAttachment.objects.create(note=with_files, file=legacy)
+
+        Note.objects.create(user=self.viewer, title='Plain', body='')
+
+    def render_both(self, user):
+        request = Request(APIRequestFactory().get('/api/user/notes/'))
+        request.user = user
+        notes = (
+            Note.objects.select_related('user')
+            .prefetch_related('attachments__blob')
+            .with_list_stats(user)
+            .order_by('-updated_at', '-created_at', '-id')
+        )
+        fast = NoteListSerializer(request)
+        renderer = JSONRenderer()
+        return (
+            renderer.render(NoteSerializer(notes, many=True, context={'request': request}).data),
+            renderer.render(fast.to_representation(list(fast.values(notes)))),
+        )
+
+    def test_signed_in_viewer(self):
+        expected, fast = self.render_both(self.viewer)
+        self.assertEqual(fast, expected)
+        rated = next(n for n in json.loads(fast) if n['title'] == 'Rated')
+        self.assertEqual((rated['user_rating'], rated['is_bookmarked'], rated['avg_rating']), (4, True, 4.5))
+
+    def test_anonymous_viewer(self):
+        expected, fast = self.render_both(AnonymousUser())
+        self.assertEqual(fast, expected)
+
+    def test_attachments_and_previews(self):
+        expected, fast = self.render_both(self.viewer)
+        files = next(n for n in json.loads(fast) if n['title'] == 'Files')['attachments']
+        self.assertEqual([a['name'] for a in files], ['report.pdf', 'notes.txt', 'old file.txt'])
+        self.assertEqual(set(files[0]['previews']), {'small', 'large'})
+        self.assertTrue(files[0]['previews']['small'].startswith('http://testserver/media/blobs/'))
+        self.assertEqual(files[2]['previews'], {})
+
+
+class NoteFieldsetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        Note.objects.create(user=self.user, title='A note', body='x' * 500)
+
+    def notes(self, **params):
+        return self.client.get('/api/user/notes/', params)
+
+    def test_fields_and_exclude(self):
+        self.assertEqual(list(body(self.notes(fields='id,title'))[0]), ['id', 'title'])
+        self.assertNotIn('body', body(self.notes(exclude='body,attachments'))[0])
+
+    def test_card_projection(self):
+        card = body(self.notes(fields='card'))[0]
+        self.assertNotIn('body', card)
+        self.assertEqual(len(card['snippet']), NoteListSerializer.snippet_length)
+
+    def test_projection_cannot_be_combined_or_excluded(self):
+        for params in ({'fields': 'card,title'}, {'fields': 'title,card'}, {'exclude': 'card'}):
+            response = self.notes(**params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_unknown_field(self):
+        self.assertEqual(self.notes(fields='password').status_code, 400)
+
+
+class AttachmentDownloadTests(TemporaryMediaMixin, APITestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        note = Note.objects.create(user=self.make_user('alice'), title='Files', body='body')
+        self.attachment = NoteAttachment(note=note, file=ContentFile(self.content, name='data.bin'))
+        self.attachment.save()
+        self.url = f'/api/user/download/attachment/{self.attachment.pk}/'
+
+    def get(self, **headers):
+        # Range='...', If_Range='...' -> Range, If-Range headers
+        headers = {name.replace('_', '-'): value for name, value in headers.items()}
+        response = self.client.get(self.url, headers=headers)
+        data = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, data
+
+    def test_whole_file(self):
+        response, data = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('data.bin', response['Content-Disposition'])
+
+    def test_ranges(self):
+        size = len(self.content)
+        for header, start, end in (
+            ('bytes=0-99', 0, 99),
+            ('bytes=100-', 100, size - 1),
+            ('bytes=-50', size - 50, size - 1),
+            ('bytes=10000-20000', 10000, size - 1),
+        ):
+            response, data = self.get(Range=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(data, self.content[start:end + 1], header)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_invalid_ranges_are_ignored(self):
+        for header in ('bytes=5-2', 'bytes=0-1,5-6', 'items=0-1'):
+            response, data = self.get(Range=header)
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(data, self.content)
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        response, _ = self.get(Range='bytes=0-9', If_Range=etag)
+        self.assertEqual(response.status_code, 206)
+        response, data = self.get(Range='bytes=0-9', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, self.content)
+
+    def test_if_none_match(self):
+        etag = self.get()[0]['ETag']
+        self.assertEqual(self.get(If_None_Match=etag)[0].status_code, 304)
+
+    def test_proxy_hand_off(self):
+        with mock.patch('myapp.downloads.ATTACHMENT_SENDFILE', 'X-Accel-Redirect'):
+            response, data = self.get(Range='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.attachment.file.name}')
+        with mock.patch('myapp.downloads.ATTACHMENT_SENDFILE', 'X-Sendfile'):
+            response, _ = self.get()
+        self.assertEqual(response['X-Sendfile'], self.attachment.file.path)
+
+    def test_missing_file(self):
+        self.attachment.file.storage.delete(self.attachment.file.name)
+        self.assertEqual(self.get()[0].status_code, 404)
+
+
+class AttachmentUploadTests(TemporaryMediaMixin, APITestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.client.force_authenticate(self.user)
+        self.note = Note.objects.create(user=self.user, title='Files', body='body')
+        partial = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, partial, ignore_errors=True)
+        patcher = mock.patch('myapp.uploads.ATTACHMENT_UPLOAD_DIR', partial)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.partial = partial
+        response = self.client.post(
+            f'/api/user/notes/{self.note.slug}/uploads/',
+            {'filename': 'data.bin', 'size': len(self.content)}, format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.upload = AttachmentUpload.objects.get(pk=response.data['id'])
+        self.url = f'/api/user/uploads/{self.upload.pk}/'
+
+    def put(self, first, last, **headers):
+        return self.client.put(
+            self.url, self.content[first:last + 1], content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes {first}-{last}/{len(self.content)}', **headers},
+        )
+
+    def assert_no_staging_files(self):
+        self.assertEqual([name for name in os.listdir(self.partial) if name.endswith('.chunk')], [])
+
+    def test_resume_and_complete(self):
+        self.assertEqual(self.put(0, 4095).data['received'], 4096)
+        # A chunk that does not continue the upload says where to resume
+        response = self.put(6000, 8191)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['received'], 4096)
+        self.assertEqual(self.put(4096, len(self.content) - 1).data['received'], len(self.content))
+        self.assert_no_staging_files()
+
+        response = self.client.post(f'{self.url}complete/')
+        self.assertEqual(response.status_code, 201)
+        attachment = NoteAttachment.objects.get(note=self.note)
+        with attachment.file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+        self.assertEqual(os.listdir(self.partial), [])
+
+    def test_bad_checksum_is_not_written(self):
+        self.put(0, 4095)
+        response = self.put(4096, 8191, X_Chunk_SHA256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('checksum', str(response.data))
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.received, 4096)
+        self.assertEqual(os.path.getsize(uploads.part_path(self.upload)), 4096)
+        self.assert_no_staging_files()
+
+    def test_offset_is_checked_again_after_the_body_is_read(self):
+        upload = self.upload
+
+        class Racing:
+            # Another request finishes the same range while this body is read
+            def __init__(self, data):
+                self.data = data
+
+            def read(self, size):
+                AttachmentUpload.objects.filter(pk=upload.pk).update(received=1024)
+                data, self.data = self.data[:size], self.data[size:]
+                return data
+
+        with self.assertRaises(uploads.UploadConflict):
+            uploads.write_chunk(upload, Racing(self.content[:1024]), 0, 1024, len(self.content))
+        self.assertEqual(os.path.getsize(uploads.part_path(upload)), 0)
+        self.assert_no_staging_files()
+
+
+@mock.patch('myapp.outbox.EMAIL_OUTBOX_IN_BACKGROUND', False)
+class OutboxTests(TestCase):
+    """send_pending against the locmem backend the test runner installs."""
+
+    def setUp(self):
+        self.connection = get_connection()
+
+    def enqueue(self, count):
+        return [outbox.enqueue(f'Subject {i}', 'Body', f'user{i}@example.com') for i in range(count)]
+
+    def failing(self, *outcomes):
+        # Each call of send_messages raises or returns the next outcome
+        return mock.patch.object(self.connection, 'send_messages', side_effect=outcomes)
+
+    def test_sent_messages_are_deleted(self):
+        self.enqueue(3)
+        self.assertEqual(outbox.send_pending(batch_size=2, connection=self.connection), (3, 0))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [f'user{i}@example.com' for i in range(3)])
+        self.assertEqual(mail.outbox[0].from_email, settings.DEFAULT_FROM_EMAIL)
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_failure_is_retried_later(self):
+        failed, sent = self.enqueue(2)
+        with self.failing(SMTPException('450 try again'), 1), self.assertLogs('myapp.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_pending(connection=self.connection), (1, 1))
+        self.assertQuerySetEqual(OutboundEmail.objects.all(), [failed])
+        failed.refresh_from_db()
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('450 try again', failed.last_error)
+        delay = (failed.next_attempt_at - timezone.now()).total_seconds()
+        self.assertAlmostEqual(delay, outbox.retry_delay(1), delta=5)
+        # Not due yet
+        self.assertEqual(outbox.send_pending(connection=self.connection), (0, 0))
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.send_pending(connection=self.connection), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_dead_letter_and_requeue(self):
+        message, = self.enqueue(1)
+        OutboundEmail.objects.update(attempts=outbox.EMAIL_OUTBOX_MAX_ATTEMPTS - 1)
+        with self.failing(SMTPException('550 mailbox unavailable')), self.assertLogs('myapp.outbox', 'ERROR') as logs:
+            self.assertEqual(outbox.send_pending(connection=self.connection), (0, 1))
+        self.assertIn('Giving up', logs.output[0])
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, outbox.EMAIL_OUTBOX_MAX_ATTEMPTS)
+
+        # Dead-lettered: skipped even once due
+        OutboundEmail.objects.update(next_attempt_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(outbox.send_pending(connection=self.connection), (0, 0))
+        self.assertTrue(OutboundEmail.objects.exists())
+
+        self.assertEqual(outbox.requeue_dead(), 1)
+        self.assertEqual(outbox.send_pending(connection=self.connection), (1, 0))
+        self.assertEqual(mail.outbox[0].subject, 'Subject 0')
+        self.assertFalse(OutboundEmail.objects.exists())
+
+
+class SearchNotesTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.client.force_authenticate(self.user)
+        self.notes = {
+            title: Note.objects.create(user=self.user, title=title, body=body)
+            for title, body in (
+                ('Python basics', 'variables and loops'),
+                ('Shopping', 'milk, eggs, a programming book'),
+                ('Django tips for python users', 'views and models'),
+            )
+        }
+        Note.objects.create(user=self.make_user('bob'), title='Python internals', body='bytecode')
+
+    def search(self, query):
+        response = self.client.get('/api/user/search_notes/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def titles(self, query):
+        return {row['title'] for row in self.search(query)}
+
+    def test_only_own_notes(self):
+        self.assertEqual(self.titles('python'), {'Python basics', 'Django tips for python users'})
+
+    def test_prefix_and_body_matches(self):
+        self.assertEqual(self.titles('program'), {'Shopping'})
+        self.assertEqual(self.titles('loops'), {'Python basics'})
+
+    def test_result_shape(self):
+        row, = self.search('shopping')
+        self.assertEqual(row, {
+            'id': self.notes['Shopping'].pk, 'title': 'Shopping', 'body_snippet': 'milk, eggs, a programming book',
+        })
+
+    def test_empty_queries(self):
+        for query in ('', '   ', '!!!'):
+            self.assertEqual(self.search(query), [])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'full-text search needs PostgreSQL')
+    def test_every_term_anywhere(self):
+        # Words need not be adjacent; stemming matches other forms
+        self.assertEqual(self.titles('python tip'), {'Django tips for python users'})
+        self.assertEqual(self.titles('views model'), {'Django tips for python users'})
+
+
+class NoteRatingStatsTests(APITestCase):
+    """Note.rating_sum / rating_count follow ratings as they change."""
+
+    def setUp(self):
+        super().setUp()
+        self.note = Note.objects.create(user=self.make_user('author'), title='Rated', body='body')
+        self.alice, self.bob = self.make_user('alice'), self.make_user('bob')
+
+    def assert_stats(self, total, count):
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.rating_sum, self.note.rating_count), (total, count))
+
+    def test_set_change_and_clear(self):
+        self.note.set_rating(self.alice, 4)
+        self.note.set_rating(self.bob, 2)
+        self.assert_stats(6, 2)
+        self.note.set_rating(self.alice, 5)
+        self.note.set_rating(self.alice, 5)
+        self.assert_stats(7, 2)
+        self.note.clear_rating(self.bob)
+        self.note.clear_rating(self.bob)
+        self.assert_stats(5, 1)
+        self.alice.delete()
+        self.assert_stats(0, 0)
+
+    def test_rate_endpoint(self):
+        self.client.force_authenticate(self.alice)
+        url = f'/api/user/notes/{self.note.slug}/rate/'
+        response = self.client.post(url, {'value': 3}, format='json')
+        self.assertEqual((response.data['avg_rating'], response.data['ratings_count']), (3, 1))
+        self.assertEqual(self.client.post(url, {'value': 6}, format='json').status_code, 400)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assert_stats(0, 0)
+
+    def test_rebuild_reconciles_drift(self):
+        self.note.set_rating(self.alice, 4)
+        self.note.set_rating(self.bob, 1)
+        unrated = Note.objects.create(user=self.alice, title='Unrated', body='body')
+        Note.objects.update(rating_sum=99, rating_count=7)
+        call_command('rebuild_note_ratings', stdout=io.StringIO())
+        self.assert_stats(5, 2)
+        unrated.refresh_from_db()
+        self.assertEqual((unrated.rating_sum, unrated.rating_count), (0, 0))
+
+
+class NotesBulkTests(APITestCase):
+    url = '/api/user/notes/bulk/'
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.other = self.make_user('bob')
+        self.client.force_authenticate(self.user)
+        self.mine = Note.objects.create(user=self.user, title='Mine', body='body')
+        self.theirs = Note.objects.create(user=self.other, title='Theirs', body='body')
+
+    def post(self, payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def statuses(self, results):
+        return [item['status'] for item in results]
+
+    def test_create(self):
+        before = cache.last_changed(cache.all_notes_scope())
+        results = self.post({'create': [
+            {'title': 'Same title', 'body': 'one'},
+            {'body': 'no title'},
+            {'title': 'Same title', 'body': 'two', 'category': 'WORK'},
+        ]})['create']
+        self.assertEqual(self.statuses(results), [201, 400, 201])
+        self.assertIn('title', results[1]['errors'])
+        first, third = Note.objects.get(pk=results[0]['id']), Note.objects.get(pk=results[2]['id'])
+        self.assertEqual((first.body, third.category), ('one', 'WORK'))
+        self.assertNotEqual(first.slug, third.slug)
+        self.assertEqual([first.slug, third.slug], [results[0]['slug'], results[2]['slug']])
+        self.assertEqual(User.objects.get(pk=self.user.pk).notes_count, 3)
+        self.assertGreater(cache.last_changed(cache.all_notes_scope()), before)
+
+    def test_update(self):
+        before = cache.last_changed(cache.note_scope(self.mine.pk))
+        results = self.post({'update': [
+            {'slug': self.mine.slug, 'title': 'Renamed'},
+            {'slug': self.theirs.slug, 'title': 'Hijacked'},
+            {'slug': 'missing', 'title': 'Nope'},
+            {'slug': self.mine.slug, 'category': 'NOPE'},
+            {'title': 'No slug'},
+        ]})['update']
+        self.assertEqual(self.statuses(results), [200, 403, 404, 400, 400])
+        self.mine.refresh_from_db()
+        self.assertEqual(self.mine.title, 'Renamed')
+        self.assertEqual(Note.objects.get(pk=self.theirs.pk).title, 'Theirs')
+        self.assertGreater(cache.last_changed(cache.note_scope(self.mine.pk)), before)
+
+    def test_delete(self):
+        results = self.post({'delete': [self.mine.slug, self.theirs.slug, 'missing', '']})['delete']
+        self.assertEqual(self.statuses(results), [204, 403, 404, 400])
+        self.assertQuerySetEqual(Note.objects.all(), [self.theirs])
+        self.assertEqual(User.objects.get(pk=self.user.pk).notes_count, 0)
+
+    def test_bookmark_and_unbookmark(self):
+        results = self.post({'bookmark': [self.mine.slug, self.theirs.slug, self.theirs.slug, 'missing']})
+        self.assertEqual(self.statuses(results['bookmark']), [200, 200, 200, 404])
+        self.assertEqual(set(self.user.bookmarked_notes.all()), {self.mine, self.theirs})
+        results = self.post({'unbookmark': [self.theirs.slug]})
+        self.assertEqual(self.statuses(results['unbookmark']), [204])
+        self.assertQuerySetEqual(self.user.bookmarked_notes.all(), [self.mine])
+
+    def test_rate(self):
+        self.theirs.set_rating(self.other, 2)
+        self.theirs.set_rating(self.user, 1)
+        results = self.post({'rate': [
+            {'slug': self.mine.slug, 'value': 5},
+            {'slug': self.theirs.slug, 'value': 4},
+            {'slug': self.mine.slug, 'value': 9},
+            {'slug': 'missing', 'value': 3},
+        ]})['rate']
+        self.assertEqual(self.statuses(results), [200, 200, 400, 404])
+        for note, total, count in ((self.mine, 5, 1), (self.theirs, 6, 2)):
+            note.refresh_from_db()
+            self.assertEqual((note.rating_sum, note.rating_count), (total, count))
+        self.assertEqual(NoteRating.objects.get(note=self.theirs, user=self.user).value, 4)
+
+    def test_sections_share_one_transaction(self):
+        with mock.patch('myapp.bulk.rate_notes', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(self.url, {
+                    'create': [{'title': 'Lost', 'body': 'body'}],
+                    'delete': [self.mine.slug],
+                    'rate': [{'slug': self.theirs.slug, 'value': 3}],
+                }, format='json')
+        self.assertQuerySetEqual(Note.objects.order_by('pk'), [self.mine, self.theirs])
+        self.assertEqual(User.objects.get(pk=self.user.pk).notes_count, 1)
+
+    def test_request_errors(self):
+        for payload in ({}, {'create': 'not a list'}):
+            self.assertEqual(self.client.post(self.url, payload, format='json').status_code, 400)
+        with mock.patch('myapp.bulk.NOTES_BULK_MAX_ITEMS', 2):
+            response = self.client.post(self.url, {'delete': ['a', 'b'], 'bookmark': ['c']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ImmediateExecutor:
+    """Runs submitted work in the calling thread (stands in for the preview pool)."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(fn)
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class AttachmentPreviewTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.note = Note.objects.create(user=self.make_user('alice'), title='Pictures', body='body')
+        self.pool = ImmediateExecutor()
+        for target, value in (
+            ('myapp.previews._get_pool', lambda: self.pool),
+            ('myapp.previews.PREVIEW_WORKERS', 1),
+            # The callback normally runs on the pool's own thread
+            ('myapp.previews.close_old_connections', lambda: None),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def attach(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            attachment = NoteAttachment(note=self.note, file=ContentFile(content, name=name))
+            attachment.save()
+        return NoteAttachment.objects.select_related('blob').get(pk=attachment.pk)
+
+    def png(self):
+        buffer = io.BytesIO()
+        previews.Image.new('RGB', (640, 320), 'teal').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def get_note(self, **headers):
+        return self.client.get(f'/api/user/notes/{self.note.slug}/', headers=headers)
+
+    @unittest.skipUnless(previews.Image, 'needs Pillow')
+    def test_image_previews(self):
+        attachment = self.attach('photo.png', self.png())
+        self.assertEqual(len(self.pool.submitted), 1)
+        self.assertEqual(set(attachment.blob.previews), set(previews.PREVIEW_SIZES))
+        storage = attachment.file.storage
+        with storage.open(attachment.blob.previews['small']) as fh:
+            self.assertEqual(max(previews.Image.open(fh).size), previews.PREVIEW_SIZES['small'])
+
+        urls = body(self.get_note())['attachments'][0]['previews']
+        self.assertEqual(set(urls), set(previews.PREVIEW_SIZES))
+        self.assertTrue(urls['small'].endswith('.preview-small.jpg'))
+
+    @unittest.skipUnless(previews.Image, 'needs Pillow')
+    def test_recorded_previews_change_the_etag(self):
+        with mock.patch('myapp.previews.PREVIEW_WORKERS', 0):
+            attachment = self.attach('photo.png', self.png())
+        response = self.get_note()
+        self.assertEqual(body(response)['attachments'][0]['previews'], {})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            previews.generate(attachment.blob)
+        response = self.get_note(If_None_Match=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(body(response)['attachments'][0]['previews']), set(previews.PREVIEW_SIZES))
+
+    def test_not_previewable(self):
+        attachment = self.attach('notes.txt', b'plain text')
+        self.assertEqual(self.pool.submitted, [])
+        self.assertEqual(attachment.blob.previews, {})
+        self.assertEqual(body(self.get_note())['attachments'][0]['previews'], {})
+
+
+class AttachmentBlobTests(TemporaryMediaMixin, APITestCase):
+    content = b'%PDF-1.4 the same handout' * 100
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('myapp.cleanup.FILE_CLEANUP_IN_BACKGROUND', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        author = self.make_user('alice')
+        self.notes = [Note.objects.create(user=author, title=f'Lecture {i}', body='body') for i in range(2)]
+
+    def attach(self, note, content=None, name='handout.pdf'):
+        attachment = NoteAttachment(note=note, file=ContentFile(content or self.content, name=name))
+        attachment.save()
+        return attachment
+
+    def exists(self, name):
+        return storages['default'].exists(name)
+
+    def queued(self):
+        return set(FileDeletion.objects.values_list('name', flat=True))
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = (self.attach(note) for note in self.notes)
+        other = self.attach(self.notes[0], b'different', name='other.pdf')
+        blob = AttachmentBlob.objects.get(sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual((first.blob_id, second.blob_id), (blob.pk, blob.pk))
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(other.blob_id, blob.pk)
+        self.assertEqual(blobs.usage()['saved'], len(self.content))
+
+    def test_deleting_one_keeps_the_file(self):
+        first, second = (self.attach(note) for note in self.notes)
+        first.delete()
+        blob = AttachmentBlob.objects.get(pk=second.blob_id)
+        self.assertEqual(blob.ref_count, 1)
+        self.assertEqual(blobs.collect_garbage(), (0, 0))
+        self.assertEqual(self.queued(), set())
+        self.assertTrue(self.exists(blob.file.name))
+        with second.file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.content)
+
+    def test_deleting_the_last_queues_removal(self):
+        attachments = [self.attach(note) for note in self.notes]
+        name = attachments[0].file.name
+        self.notes[0].delete()
+        attachments[1].delete()
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 0)
+
+        self.assertEqual(blobs.collect_garbage(dry_run=True), (1, len(self.content)))
+        self.assertTrue(AttachmentBlob.objects.exists())
+        self.assertEqual(blobs.collect_garbage(), (1, len(self.content)))
+        self.assertFalse(AttachmentBlob.objects.exists())
+        self.assertEqual(self.queued(), {name})
+        self.assertEqual(cleanup.process_pending(), (1, 0))
+        self.assertFalse(self.exists(name))
+
+    def test_reused_before_the_sweep(self):
+        self.attach(self.notes[0]).delete()
+        again = self.attach(self.notes[1])
+        self.assertEqual(blobs.collect_garbage(), (0, 0))
+        self.assertTrue(self.exists(again.file.name))
+
+    def test_adopt_legacy(self):
+        storage = storages['default']
+        old = [storage.save(f'notes/lecture-{i}/handout.pdf', ContentFile(self.content)) for i in range(2)]
+        for note, name in zip(self.notes, old):
+            NoteAttachment.objects.create(note=note, file=name)
+
+        self.assertEqual(blobs.adopt_legacy(), 2)
+        blob = AttachmentBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        for attachment in NoteAttachment.objects.all():
+            self.assertEqual((attachment.blob_id, attachment.file.name), (blob.pk, blob.file.name))
+            self.assertEqual(attachment.name, 'handout.pdf')
+        self.assertEqual(self.queued(), set(old))
+        self.assertEqual(cleanup.process_pending(), (2, 0))
+        self.assertFalse(any(self.exists(name) for name in old))
+        self.assertTrue(self.exists(blob.file.name))
+
+
+class FileCleanupTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('myapp.cleanup.FILE_CLEANUP_IN_BACKGROUND', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = storages['default']
+        note = Note.objects.create(user=self.make_user('alice'), title='Files', body='body')
+        self.attachment = NoteAttachment(note=note, file=ContentFile(b'kept', name='kept.txt'))
+        self.attachment.save()
+
+    def save(self, name, content=b'data', age=2 * 3600):
+        name = self.storage.save(name, ContentFile(content))
+        then = time.time() - age
+        os.utime(self.storage.path(name), (then, then))
+        return name
+
+    def test_failed_delete_is_retried(self):
+        name = self.save('notes/old/stale.txt')
+        cleanup.schedule_delete(name)
+        with mock.patch.object(self.storage, 'delete', side_effect=OSError('busy')):
+            with self.assertLogs('myapp.cleanup', 'ERROR'):
+                self.assertEqual(cleanup.process_pending(storage=self.storage), (0, 1))
+        self.assertEqual(FileDeletion.objects.get().attempts, 1)
+        self.assertTrue(self.storage.exists(name))
+
+        self.assertEqual(cleanup.process_pending(storage=self.storage), (1, 0))
+        self.assertFalse(FileDeletion.objects.exists())
+        self.assertFalse(self.storage.exists(name))
+
+    def test_gives_up_after_max_attempts(self):
+        cleanup.schedule_delete(self.save('notes/old/stuck.txt'))
+        FileDeletion.objects.update(attempts=cleanup.FILE_CLEANUP_MAX_ATTEMPTS)
+        self.assertEqual(cleanup.process_pending(storage=self.storage), (0, 0))
+        self.assertTrue(FileDeletion.objects.exists())
+
+    def test_referenced_files_are_kept(self):
+        cleanup.schedule_delete(self.attachment.file.name)
+        self.assertEqual(cleanup.process_pending(storage=self.storage), (0, 0))
+        self.assertFalse(FileDeletion.objects.exists())
+        self.assertTrue(self.storage.exists(self.attachment.file.name))
+
+    def test_orphan_scan(self):
+        os.utime(self.storage.path(self.attachment.file.name), (0, 0))
+        orphan = self.save('notes/old/orphan.txt', b'orphan')
+        self.save('notes/old/new.txt', age=0)
+        self.save('uploads/partial/some.part')
+
+        self.assertEqual(list(cleanup.scan_orphans()), [(orphan, 6)])
+        out = io.StringIO()
+        call_command('scan_orphan_files', '--delete', stdout=out)
+        self.assertIn('Found 1 orphaned files', out.getvalue())
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertTrue(self.storage.exists(self.attachment.file.name))
+        self.assertTrue(self.storage.exists('notes/old/new.txt'))
+
+
+class FastJSONRendererTests(TestCase):
+    """FastJSONRenderer writes the bytes DRF's JSONRenderer would."""
+
+    def payload(self):
+        when = datetime(2025, 3, 4, 5, 6, 7, 890123, tzinfo=dt_timezone.utc)
+        return ReturnList([
+            ReturnDict({
+                'id': 1,
+                'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+                'title': 'Ünïcode “quotes”   line separator </script>',
+                'created_at': when,
+                'naive': datetime(2025, 3, 4, 5, 6, 7),
+                'day': date(2025, 3, 4),
+                'at': dt_time(5, 6, 7, 120000),
+                'duration': timedelta(hours=1, seconds=3),
+                'price': Decimal('12.50'),
+                'ratio': 0.1 + 0.2,
+                'flags': (True, False, None),
+                'label': gettext_lazy('Work'),
+                'counts': {1: 'one', 'two': 2},
+            }, serializer=None),
+            {'nested': [[], {}, '']},
+        ], serializer=None)
+
+    def assert_same(self, data):
+        expected = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        return expected
+
+    def test_matches_json_renderer(self):
+        self.assertIsNotNone(renderers.orjson, 'orjson is not installed; nothing to compare')
+        rendered = self.assert_same(self.payload())
+        row = json.loads(rendered)[0]
+        self.assertEqual(row['created_at'], '2025-03-04T05:06:07.890123Z')
+        # Bare Decimals are floats to the encoder; DecimalField makes them strings
+        self.assertEqual((row['price'], row['uuid']), (12.5, '12345678-1234-5678-1234-567812345678'))
+        self.assertIn(b'\\u2028', rendered)
+        for value in ([], {}, 'text', 0, None):
+            self.assert_same(value)
+        # orjson spells exponents without the sign ('1e300', not '1e+300'); the values are the same
+        for value in (1e300, 1e-7, -2.5e-12, float(2 ** 63)):
+            self.assertEqual(json.loads(FastJSONRenderer().render(value)), json.loads(JSONRenderer().render(value)))
+
+    def test_stock_path_without_orjson(self):
+        with mock.patch('myapp.renderers.orjson', None):
+            self.assert_same(self.payload())
+
+    def test_indented_output_uses_the_stock_path(self):
+        data = self.payload()
+        expected = JSONRenderer().render(data, 'application/json; indent=2')
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'), expected)
+
+    def test_list_stream_framing(self):
+        items = list(self.payload()) + [None]
+        renderer = FastJSONRenderer()
+        self.assertEqual(b''.join(renderer.render_list_stream(iter(items))), JSONRenderer().render(items))
+        self.assertEqual(b''.join(renderer.render_list_stream(iter([]))), b'[]')
+
+    def test_decodes_like_user_renderer(self):
+        data = {'name': 'Ünïcode', 'count': 3, 'items': [1.5, None, True], 'nested': {'a': []}}
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(UserRenderer().render(data)))
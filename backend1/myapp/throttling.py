@@ -0,0 +1,120 @@
+"""
+Request throttling for the auth, search and rating endpoints.
+
+DRF's SimpleRateThrottle keeps a list of request times per client and
+rewrites it on every request, so each check costs O(limit) and concurrent
+workers overwrite each other's lists. SlidingWindowThrottle keeps two
+counters per client instead, for the current and the previous fixed window,
+and estimates the requests in the last `duration` seconds as
+
+    current + previous * (share of the previous window still in range)
+
+Each check is one get_many() and one incr(), both atomic on Redis and the
+in-process cache, and nothing is written to the database. Budgets are the
+usual DEFAULT_THROTTLE_RATES scopes. Point THROTTLE_CACHE_ALIAS (default:
+the default cache) at a shared cache so limits hold across workers.
+
+Clients are keyed by IP (DRF's get_ident, which honours NUM_PROXIES), by
+user, or by the account a login or password reset is aimed at, so one IP
+cannot spread guesses over many accounts and many IPs cannot focus on one.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+THROTTLE_CACHE_ALIAS = getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[THROTTLE_CACHE_ALIAS]
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window, offset = divmod(self.now, self.duration)
+        current_key = f'{self.key}:{int(window)}'
+        previous_key = f'{self.key}:{int(window) - 1}'
+        counts = self.cache.get_many([previous_key, current_key])
+        self.current = counts.get(current_key, 0)
+        self.previous = counts.get(previous_key, 0)
+        self.elapsed = offset / self.duration
+        if self.current + self.previous * (1 - self.elapsed) >= self.num_requests:
+            return self.throttle_failure()
+
+        try:
+            self.cache.incr(current_key)
+        except ValueError:
+            # First request of the window; it must outlive the next window too
+            if not self.cache.add(current_key, 1, self.duration * 2):
+                self.cache.incr(current_key)
+        return True
+
+    def wait(self):
+        remaining = self.duration * (1 - self.elapsed)
+        if self.current < self.num_requests and self.previous:
+            # Until enough of the previous window has slid out of range
+            needed = 1 - (self.num_requests - self.current) / self.previous
+            return max(needed - self.elapsed, 0) * self.duration
+        return remaining
+
+
+class IPThrottle(SlidingWindowThrottle):
+    """Per client IP, signed in or not."""
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserThrottle(SlidingWindowThrottle):
+    """Per user when signed in, otherwise per client IP."""
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user-{request.user.pk}'
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class AccountThrottle(SlidingWindowThrottle):
+    """Per email address the request is about (login, password reset)."""
+    def get_cache_key(self, request, view):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        digest = hashlib.sha256(email.strip().lower().encode()).hexdigest()[:32]
+        return self.cache_format % {'scope': self.scope, 'ident': digest}
+
+
+class LoginThrottle(IPThrottle):
+    scope = 'login'
+
+
+class LoginAccountThrottle(AccountThrottle):
+    scope = 'login_account'
+
+
+class PasswordResetThrottle(IPThrottle):
+    scope = 'password_reset'
+
+
+class PasswordResetAccountThrottle(AccountThrottle):
+    scope = 'password_reset_account'
+
+
+class SearchThrottle(UserThrottle):
+    scope = 'search'
+
+
+class RatingThrottle(UserThrottle):
+    scope = 'rating'
@@ -0,0 +1,206 @@
+"""
+Resumable, chunked attachment uploads.
+
+    POST   notes/<slug>/uploads/      {filename, size, sha256?}  -> upload id
+    PUT    uploads/<id>/              one chunk, Content-Range: bytes a-b/size
+    GET    uploads/<id>/              how much has been received (to resume)
+    POST   uploads/<id>/complete/     verify and attach to the note
+    DELETE uploads/<id>/              abort
+
+Each chunk is streamed from the request into a staging file under
+ATTACHMENT_UPLOAD_DIR, then appended to the upload's part file there;
+nothing is buffered in memory or spooled by the multipart parser. Sizes are
+checked against the headers before any of the body is read. A chunk must
+start where the previous one ended; a client that lost its connection asks
+for `received` and continues from there. On completion the SHA-256 of the
+assembled file is checked and the part file is moved (not copied, on local
+storage) into blob storage (see myapp/blobs.py).
+"""
+
+import hashlib
+import os
+import re
+import secrets
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, ValidationError
+
+from myapp import blobs
+
+ATTACHMENT_UPLOAD_MAX_SIZE = getattr(settings, 'ATTACHMENT_UPLOAD_MAX_SIZE', 100 * 1024 * 1024)
+ATTACHMENT_UPLOAD_CHUNK_SIZE = getattr(settings, 'ATTACHMENT_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+ATTACHMENT_UPLOAD_DIR = getattr(
+    settings, 'ATTACHMENT_UPLOAD_DIR', os.path.join(settings.MEDIA_ROOT, 'uploads', 'partial')
+)
+# Unfinished uploads older than this are removed by `purge_attachment_uploads`
+ATTACHMENT_UPLOAD_EXPIRY = getattr(settings, 'ATTACHMENT_UPLOAD_EXPIRY', 24 * 60 * 60)
+
+READ_SIZE = 64 * 1024
+_content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Chunk does not continue the upload.'
+    default_code = 'upload_conflict'
+
+    def __init__(self, received, detail=None):
+        super().__init__(detail)
+        # Tell the client where to resume (kept as a number in the body)
+        self.detail = {'detail': self.detail, 'received': received}
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Upload is too large.'
+    default_code = 'upload_too_large'
+
+
+def part_path(upload):
+    return os.path.join(ATTACHMENT_UPLOAD_DIR, f'{upload.pk}.part')
+
+
+def start(note, user, filename, size, sha256=''):
+    """Open an upload session for `note`; sizes were validated by the serializer."""
+    from myapp.models import AttachmentUpload
+    upload = AttachmentUpload.objects.create(
+        note=note, user=user, filename=filename, size=size, sha256=sha256.lower(),
+    )
+    os.makedirs(ATTACHMENT_UPLOAD_DIR, exist_ok=True)
+    open(part_path(upload), 'wb').close()
+    return upload
+
+
+def parse_content_range(header, length):
+    """(offset, total) from a chunk's Content-Range, checked against its length."""
+    match = _content_range_re.match((header or '').strip())
+    if not match:
+        raise ParseError('Content-Range: bytes <first>-<last>/<size> is required.')
+    first, last, total = (int(v) for v in match.groups())
+    if last < first or last - first + 1 != length:
+        raise ParseError('Content-Range does not match Content-Length.')
+    return first, total
+
+
+def write_chunk(upload, stream, offset, length, total, checksum=None):
+    """
+    Append `length` bytes read from `stream` at `offset`. Everything that can
+    be checked from the headers is checked before reading the body. The body
+    is read into a staging file outside any transaction, so a slow client
+    never holds the upload's row lock (or a database transaction) open; only
+    then is the row locked, the offset checked again and the verified bytes
+    copied into the part file. A chunk that arrives short or fails its
+    checksum never reaches the part file.
+    """
+    from myapp.models import AttachmentUpload
+    if length > ATTACHMENT_UPLOAD_CHUNK_SIZE:
+        raise UploadTooLarge(f'Chunks are limited to {ATTACHMENT_UPLOAD_CHUNK_SIZE} bytes.')
+    if total != upload.size or offset + length > upload.size:
+        raise ValidationError('Chunk exceeds the declared upload size.')
+    if offset != upload.received:
+        raise UploadConflict(upload.received)
+
+    staging = _receive(upload, stream, length, checksum)
+    try:
+        with transaction.atomic():
+            # Serialize chunk writers for the same upload
+            upload = AttachmentUpload.objects.select_for_update().get(pk=upload.pk)
+            if offset != upload.received:
+                # Another request wrote this range while we were reading
+                raise UploadConflict(upload.received)
+            with open(staging, 'rb') as src, open(part_path(upload), 'r+b') as fh:
+                fh.seek(offset)
+                fh.truncate()
+                shutil.copyfileobj(src, fh, READ_SIZE)
+            upload.received = offset + length
+            upload.save(update_fields=['received', 'updated_at'])
+    finally:
+        os.remove(staging)
+    return upload
+
+
+def _receive(upload, stream, length, checksum=None):
+    """Read one chunk from `stream` into a staging file of its own; returns its path."""
+    path = os.path.join(ATTACHMENT_UPLOAD_DIR, f'{upload.pk}.{secrets.token_hex(4)}.chunk')
+    digest = hashlib.sha256() if checksum else None
+    remaining = length
+    try:
+        with open(path, 'wb') as fh:
+            while remaining:
+                data = stream.read(min(READ_SIZE, remaining))
+                if not data:
+                    break
+                fh.write(data)
+                if digest is not None:
+                    digest.update(data)
+                remaining -= len(data)
+        if remaining:
+            raise ParseError('Chunk ended before Content-Length bytes were received.')
+        if digest is not None and digest.hexdigest() != checksum.lower():
+            raise ValidationError('Chunk checksum does not match.')
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def complete(upload):
+    """Verify the assembled file and turn it into a NoteAttachment."""
+    from myapp.models import AttachmentUpload, NoteAttachment
+    with transaction.atomic():
+        upload = AttachmentUpload.objects.select_for_update().select_related('note').get(pk=upload.pk)
+        if upload.received != upload.size:
+            raise UploadConflict(upload.received, 'Upload is not complete.')
+        path = part_path(upload)
+        # One pass both verifies the upload and keys its blob
+        sha256 = blobs.file_sha256(path)
+        if upload.sha256 and sha256 != upload.sha256:
+            raise ValidationError('File checksum does not match; restart the upload.')
+
+        attachment = NoteAttachment(note=upload.note)
+        attachment.file = blobs.SpooledFile(open(path, 'rb'), name=upload.filename)
+        blobs.attach(attachment, sha256=sha256)
+        attachment.save()
+        upload.delete()
+    if os.path.exists(path):
+        os.remove(path)
+    return attachment
+
+
+def abort(upload):
+    path = part_path(upload)
+    upload.delete()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def purge_stale(max_age=None):
+    """
+    Remove uploads untouched for `max_age` seconds, and part files whose
+    upload no longer exists (e.g. the note was deleted), along with chunk
+    staging files left behind by requests that never finished. Returns the
+    count.
+    """
+    from myapp.models import AttachmentUpload
+    cutoff = timezone.now() - timedelta(seconds=max_age if max_age is not None else ATTACHMENT_UPLOAD_EXPIRY)
+    removed = 0
+    for upload in AttachmentUpload.objects.filter(updated_at__lt=cutoff).iterator():
+        abort(upload)
+        removed += 1
+    if os.path.isdir(ATTACHMENT_UPLOAD_DIR):
+        live = {str(pk) for pk in AttachmentUpload.objects.values_list('pk', flat=True)}
+        with os.scandir(ATTACHMENT_UPLOAD_DIR) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if entry.stat().st_mtime >= cutoff.timestamp():
+                    continue
+                # Staging files of chunks whose request died with the worker
+                if ext == '.chunk' or (ext == '.part' and stem not in live):
+                    os.remove(entry.path)
+                    removed += 1
+    return removed
@@ -5,9 +5,10 @@ from myapp.views import (
     SendPasswordResetEmailView, UserChangePasswordView, UserLoginView,
     UserPasswordResetView, UserProfileView, UserRegistrationView, test_api,
     UserProfileDetailView, rate_note, bookmark_note, PublicUserProfileByUsername,
-    AdminUsersView, AdminUserDetailView, HeartbeatView
+    AdminUsersView, AdminUserDetailView, AdminOnlineUsersView, HeartbeatView,
+    AttachmentUploadStartView, AttachmentUploadView, AttachmentUploadCompleteView, TokenObtainView,
 )
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns=[
     path('test_api/', test_api, name='test_api'),
@@ -29,6 +30,8 @@ urlpatterns=[
     # Current user's notes and bookmarked
     path('notes/mine/', views.my_notes, name='my_notes'),
     path('notes/bookmarked/', views.bookmarked_notes, name='bookmarked_notes'),
+    # Many notes at once (create/update/delete/bookmark/rate)
+    path('notes/bulk/', views.notes_bulk, name='notes_bulk'),
     # Public notes by username/email
     path('notes/by-user/<str:username>/', views.notes_by_username, name='notes_by_username'),
 
@@ -39,6 +42,11 @@ urlpatterns=[
     path('notes/<slug:slug>/rate/', rate_note, name='rate_note'),
     path('notes/<slug:slug>/bookmark/', bookmark_note, name='bookmark_note'),
 
+    # Resumable attachment uploads: start, send chunks, complete
+    path('notes/<slug:slug>/uploads/', AttachmentUploadStartView.as_view(), name='attachment-upload-start'),
+    path('uploads/<uuid:upload_id>/', AttachmentUploadView.as_view(), name='attachment-upload'),
+    path('uploads/<uuid:upload_id>/complete/', AttachmentUploadCompleteView.as_view(), name='attachment-upload-complete'),
+
     path("search_notes/", views.search_notes, name="search_notes"),
     path("users/<int:user_id>/", UserProfileDetailView.as_view(), name="user-profile"),
     # public profile by username (email or display name)
@@ -46,10 +54,11 @@ urlpatterns=[
     path("download/attachment/<int:pk>/", views.download_attachment, name="download_attachment"),
     # Admin user management
     path("admin/users/", AdminUsersView.as_view(), name="admin-users"),
+    path("admin/users/online/", AdminOnlineUsersView.as_view(), name="admin-users-online"),
     path("admin/users/<int:user_id>/", AdminUserDetailView.as_view(), name="admin-user-detail"),
     # Heartbeat
     path("heartbeat/", HeartbeatView.as_view(), name="heartbeat"),
 
-    path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
+    path("api/token/", TokenObtainView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
 ]
\ No newline at end of file
@@ -1,5 +1,5 @@
-import os
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, HttpResponsePermanentRedirect, StreamingHttpResponse
+from django.urls import reverse
 from rest_framework.response import Response
 from rest_framework import status,viewsets,permissions
 from rest_framework.views import APIView
@@ -13,21 +13,32 @@ from myapp.serializers import (
     UserRegistrationSerializer
 )
 from django.contrib.auth import authenticate
-from myapp.renderers import UserRenderer
+from myapp.renderers import FastJSONRenderer, UserRenderer
+from myapp.pagination import AdminUserPagination, NoteCursorPagination
+from myapp import bulk, cache, presence, uploads
+from myapp.handles import resolve_public_user
+from myapp.downloads import serve_file
+from myapp.throttling import (
+    LoginAccountThrottle, LoginThrottle, PasswordResetAccountThrottle, PasswordResetThrottle,
+    RatingThrottle, SearchThrottle,
+)
+from myapp.cache import conditional_response
 from django.shortcuts import get_object_or_404
-from rest_framework_simplejwt.tokens import RefreshToken
+from myapp.authentication import ClaimsRefreshToken
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.exceptions import AuthenticationFailed
-from .models import Note, NoteAttachment, User, NoteRating
-from .serializers import NoteSerializer, NoteRatingSerializer, AdminUserSerializer
-from django.db.models import Avg, Count
-from rest_framework.decorators import api_view, parser_classes, permission_classes
+from rest_framework_simplejwt.views import TokenObtainPairView
+from .models import Note, NoteAttachment, User, AttachmentUpload
+from .serializers import (
+    NoteSerializer, NoteListSerializer, NoteRatingSerializer, AdminUserSerializer,
+    NoteAttachmentSerializer, AttachmentUploadSerializer,
+)
+from rest_framework.decorators import api_view, parser_classes, permission_classes, throttle_classes
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import FileResponse, Http404
+from django.http import Http404
 from rest_framework.permissions import AllowAny
 from django.db.models import Q
 from rest_framework.permissions import BasePermission
-from django.utils import timezone
 # =====================
 # JWT Token Helper
 # =====================
@@ -35,7 +46,7 @@ def get_tokens_for_user(user):
     if not user.is_active:
         raise AuthenticationFailed("User is not active")
 
-    refresh = RefreshToken.for_user(user)
+    refresh = ClaimsRefreshToken.for_user(user)
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
@@ -68,6 +79,7 @@ class UserRegistrationView(APIView):
 
 class UserLoginView(APIView):
     renderer_classes = [UserRenderer]
+    throttle_classes = [LoginThrottle, LoginAccountThrottle]
 
     def post(self, request, format=None):
         serializer = UserLoginSerializer(data=request.data)
@@ -76,12 +88,8 @@ class UserLoginView(APIView):
         password = serializer.data.get('password')
         user = authenticate(email=email, password=password)
         if user is not None:
-            # Record last login time for admin dashboard
-            try:
-                user.last_login = timezone.now()
-                user.save(update_fields=["last_login"])
-            except Exception:
-                pass
+            # Last login for the admin dashboard; buffered and written in batches
+            presence.record_login(user)
             token = get_tokens_for_user(user)
             return Response({
                 'token': token,
@@ -95,13 +103,25 @@ class UserLoginView(APIView):
             return Response({'errors': {'non_field_errors': ['Email or Password is not Valid']}}, status=status.HTTP_404_NOT_FOUND)
 
 
+class TokenObtainView(TokenObtainPairView):
+    # Takes a password too, so it shares UserLoginView's budgets
+    throttle_classes = [LoginThrottle, LoginAccountThrottle]
+
+
 class UserProfileView(APIView):
     renderer_classes = [UserRenderer]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
-        serializer = UserProfileSerializer(request.user, context={"request": request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        user = request.user
+        return conditional_response(
+            request,
+            [cache.user_scope(user.pk), cache.profile_scope(user.pk)],
+            lambda: UserProfileSerializer(user, context={"request": request}).data,
+            last_modified=[presence.last_seen(user), user.last_login],
+            # `online` flips with the clock rather than with a write
+            extra=presence.is_online(user),
+        )
 
     def patch(self, request, format=None):
         serializer = UserProfileUpdateSerializer(
@@ -120,33 +140,100 @@ class IsAdmin(BasePermission):
         return bool(request.user and request.user.is_authenticated and request.user.is_admin)
 
 
+def query_flag(value):
+    """Parse a boolean query parameter; None when absent."""
+    if value is None:
+        return None
+    return value.strip().lower() in ['1', 'true', 't', 'yes', 'y']
+
+
 class AdminUsersView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin]
+    orderings = {
+        'last_login': ('last_login', 'created_at', 'id'),
+        'created_at': ('created_at', 'id'),
+        'notes_count': ('notes_count', 'id'),
+        'email': ('email', 'id'),
+    }
+    default_ordering = '-last_login'
+
+    def get_ordering(self, request):
+        # ?ordering=notes_count / -notes_count / email / ...; unknown keys
+        # fall back to the default. `id` keeps page boundaries stable.
+        value = request.query_params.get('ordering', self.default_ordering)
+        if value.lstrip('-') not in self.orderings:
+            value = self.default_ordering
+        prefix = '-' if value.startswith('-') else ''
+        return [f'{prefix}{f}' for f in self.orderings[value.lstrip('-')]]
 
     def get(self, request):
+        params = request.query_params
         # By default show users who have logged in at least once
-        show_all = request.query_params.get('all') in ['1', 'true', 'True']
-        base = User.objects.all()
-        # Annotate total notes per user
-        base = base.annotate(notes_count=Count('notes'))
-        if show_all:
-            qs = base.order_by('-last_login', '-created_at')
-        else:
-            qs = base.filter(last_login__isnull=False).order_by('-last_login', '-created_at')
-        data = AdminUserSerializer(qs, many=True).data
+        show_all = query_flag(params.get('all'))
+        qs = User.objects.all()
+        if not show_all:
+            qs = qs.filter(last_login__isnull=False)
+
+        # Prefix search on email / name (UPPER(...) pattern indexes on PostgreSQL)
+        search = params.get('q', '').strip()
+        if search:
+            qs = qs.filter(Q(email__istartswith=search) | Q(name__istartswith=search))
+        for flag in ('is_admin', 'is_active'):
+            value = query_flag(params.get(flag))
+            if value is not None:
+                qs = qs.filter(**{flag: value})
+        online = query_flag(params.get('online'))
+        if online is not None:
+            online_ids = presence.online_user_ids()
+            qs = qs.filter(id__in=online_ids) if online else qs.exclude(id__in=online_ids)
+
+        qs = qs.order_by(*self.get_ordering(request))
+
+        # Page only when asked to; the admin UI still loads the full list
+        paginator = AdminUserPagination()
+        paginated = 'page' in params or paginator.page_size_query_param in params
+        users = paginator.paginate_queryset(qs, request, view=self) if paginated else list(qs)
+        seen_map = presence.last_seen_many([u.pk for u in users])
+        data = AdminUserSerializer(users, many=True, context={'presence': seen_map}).data
+        if paginated:
+            return paginator.get_paginated_response(data)
         return Response(data)
 
 
+class AdminOnlineUsersView(APIView):
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        try:
+            hours = min(max(int(request.query_params.get('hours', 24)), 1), 168)
+        except ValueError:
+            hours = 24
+        online_ids = presence.online_user_ids()
+        paginator = AdminUserPagination()
+        page_ids = paginator.paginate_queryset(online_ids, request, view=self)
+        users = User.objects.filter(id__in=page_ids)
+        by_id = {u.pk: u for u in users}
+        page = [by_id[pk] for pk in page_ids if pk in by_id]
+        seen_map = presence.last_seen_many(page_ids)
+        return Response({
+            'count': len(online_ids),
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': AdminUserSerializer(page, many=True, context={'presence': seen_map}).data,
+            'histogram': presence.activity_histogram(hours),
+        })
+
+
 class HeartbeatView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         try:
-            request.user.last_seen = timezone.now()
-            request.user.save(update_fields=['last_seen'])
+            # Buffered and written to User.last_seen in periodic batches
+            last_seen = presence.record(request.user)
             return Response({
                 'ok': True,
-                'last_seen': request.user.last_seen,
+                'last_seen': last_seen,
             })
         except Exception as e:
             return Response({'ok': False, 'error': str(e)}, status=500)
@@ -203,6 +290,7 @@ class UserChangePasswordView(APIView):
 
 class SendPasswordResetEmailView(APIView):
     renderer_classes = [UserRenderer]
+    throttle_classes = [PasswordResetThrottle, PasswordResetAccountThrottle]
 
     def post(self, request, format=None):
         serializer = SendPasswordResetEmailSerializer(data=request.data)
@@ -223,7 +311,49 @@ class UserPasswordResetView(APIView):
 # Notes Endpoints
 # =====================
 
+def note_list_payload(request, notes_qs, serializer):
+    # Paginate with a keyset cursor when the client asks for it
+    # (?cursor= / ?page_size=), otherwise keep returning the full list.
+    paginator = NoteCursorPagination()
+    if paginator.is_requested(request):
+        page = paginator.paginate_queryset(serializer.values(notes_qs), request)
+        return paginator.get_paginated_response(serializer.to_representation(page)).data
+    return serializer.to_representation(list(serializer.values(notes_qs)))
+
+
+def note_list_stream(request, notes_qs, output):
+    """
+    For unpaginated JSON lists, a callable that streams the notes in batches
+    (serialized and encoded as they are read) instead of building the whole
+    payload; None when the response has to be rendered normally.
+    """
+    renderer = getattr(request, 'accepted_renderer', None)
+    if not isinstance(renderer, FastJSONRenderer) or 'indent' in (request.accepted_media_type or ''):
+        return None
+    if NoteCursorPagination().is_requested(request):
+        return None
+
+    def stream():
+        rows = NoteListSerializer(request, output).iter_representation(notes_qs)
+        return StreamingHttpResponse(renderer.render_list_stream(rows), content_type=renderer.media_type)
+    return stream
+
+
+def note_list_response(request, scopes, notes_qs):
+    """Conditional, cached or streamed response for a note list (see cache.py)."""
+    # Parses ?fields= / ?exclude= up front so a bad fieldset is a 400; the
+    # serializer itself is only built when there is a payload to render.
+    output = NoteListSerializer.get_output_fields(request)
+    return conditional_response(
+        request,
+        scopes,
+        lambda: note_list_payload(request, notes_qs, NoteListSerializer(request, output)),
+        stream=note_list_stream(request, notes_qs, output),
+    )
+
+
 @api_view(['GET']) 
+@throttle_classes([SearchThrottle])
 def search_notes(request):
     query = request.GET.get('q', '').strip()
 
@@ -231,16 +361,8 @@ def search_notes(request):
         if not query:
             return Response([])
 
-        filters = Q(title__icontains=query) | Q(body__icontains=query)
-
-        if 'category' in [f.name for f in Note._meta.get_fields()]:
-            filters |= Q(category__icontains=query)
-
-        if 'attachment' in [f.name for f in Note._meta.get_fields()]:
-            filters |= Q(attachment__icontains=query)
-
         # ✅ Restrict search to logged-in user
-        notes = Note.objects.filter(filters, user=request.user).order_by('-id')[:10]
+        notes = Note.objects.filter(user=request.user).search(query)[:10]
 
         result_data = [
             {
@@ -267,10 +389,11 @@ def notes(request):
         notes_qs = (
             Note.objects.all()
             .order_by('-updated_at', '-created_at', '-id')
-            .prefetch_related('attachments', 'bookmarks', 'ratings')
+            .select_related('user')
+            .prefetch_related('attachments')
+            .with_list_stats(request.user)
         )
-        serializer = NoteSerializer(notes_qs, many=True, context={'request': request})
-        return Response(serializer.data)
+        return note_list_response(request, [cache.all_notes_scope()], notes_qs)
 
     # POST
     # Log Authorization header for debugging
@@ -315,8 +438,12 @@ def note_detail(request, slug):
     # PUBLIC: Anyone can view
     # -------------------------
     if request.method == 'GET':
-        serializer = NoteSerializer(note, context={'request': request})
-        return Response(serializer.data)
+        return conditional_response(
+            request,
+            [cache.note_scope(note.pk), cache.user_scope(note.user_id)],
+            lambda: NoteSerializer(note, context={'request': request}).data,
+            last_modified=[note.updated_at],
+        )
 
     # -------------------------
     # PROTECTED: Only owner can edit/delete
@@ -365,19 +492,12 @@ def note_detail(request, slug):
 
             note.save()
 
-            # Delete attachments that are not in keep_ids
-            current_attachments = list(note.attachments.all())
-            for att in current_attachments:
-                # If keep_ids is None -> client didn't send the field, so don't delete anything.
-                # If keep_ids is an explicit set (possibly empty) -> delete attachments not present in keep_ids.
-                if keep_ids is not None and att.id not in keep_ids:
-                    # delete file from storage
-                    try:
-                        if att.file and hasattr(att.file, 'path') and os.path.exists(att.file.path):
-                            os.remove(att.file.path)
-                    except Exception as e:
-                        print('Failed to remove file from storage:', e)
-                    att.delete()
+            # Delete attachments that are not in keep_ids.
+            # If keep_ids is None -> client didn't send the field, so don't delete anything.
+            # If keep_ids is an explicit set (possibly empty) -> delete attachments not present in keep_ids.
+            # Their files are removed after commit (see myapp/cleanup.py).
+            if keep_ids is not None:
+                note.attachments.exclude(id__in=keep_ids).delete()
 
             # Handle new uploaded files
             files = request.FILES.getlist('attachments')
@@ -404,23 +524,30 @@ def note_detail(request, slug):
 # ⭐ Rate a note (create/update/delete user rating)
 @api_view(['POST', 'DELETE'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([RatingThrottle])
 def rate_note(request, slug):
     note = get_object_or_404(Note, slug=slug)
     if request.method == 'DELETE':
-        NoteRating.objects.filter(note=note, user=request.user).delete()
+        note.clear_rating(request.user)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     serializer = NoteRatingSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
     value = serializer.validated_data['value']
-    rating, created = NoteRating.objects.update_or_create(
-        note=note, user=request.user, defaults={'value': value}
-    )
+    note.set_rating(request.user, value)
     # return updated aggregates
     payload = NoteSerializer(note, context={'request': request}).data
     return Response(payload, status=status.HTTP_200_OK)
 
 
+# 📦 Create / update / delete / bookmark / rate many notes at once
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def notes_bulk(request):
+    # One transaction; one result per item (see myapp/bulk.py)
+    return Response(bulk.apply(request.user, request.data), status=status.HTTP_200_OK)
+
+
 # 🔖 Bookmark a note (toggle)
 @api_view(['POST', 'DELETE'])
 @permission_classes([IsAuthenticated])
@@ -452,6 +579,62 @@ def upload_note(request):
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+# ⏫ Resumable attachment uploads (see myapp/uploads.py)
+class AttachmentUploadStartView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, slug):
+        note = get_object_or_404(Note, slug=slug)
+        if note.user != request.user and not getattr(request.user, 'is_admin', False):
+            return Response({"error": "You do not have permission to modify this note"}, status=status.HTTP_403_FORBIDDEN)
+        serializer = AttachmentUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = uploads.start(note, request.user, **serializer.validated_data)
+        return Response(AttachmentUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+class AttachmentUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, upload_id):
+        return get_object_or_404(AttachmentUpload, pk=upload_id, user=request.user)
+
+    def get(self, request, upload_id):
+        return Response(AttachmentUploadSerializer(self.get_upload(request, upload_id)).data)
+
+    def put(self, request, upload_id):
+        upload = self.get_upload(request, upload_id)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length <= 0:
+            return Response({"error": "Content-Length is required"}, status=status.HTTP_411_LENGTH_REQUIRED)
+        offset, total = uploads.parse_content_range(request.headers.get('Content-Range'), length)
+        # The body is read from the raw stream; request.data is never parsed
+        upload = uploads.write_chunk(
+            upload, request.stream, offset, length, total,
+            checksum=request.headers.get('X-Chunk-SHA256'),
+        )
+        return Response(AttachmentUploadSerializer(upload).data)
+
+    def delete(self, request, upload_id):
+        uploads.abort(self.get_upload(request, upload_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class AttachmentUploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        upload = get_object_or_404(AttachmentUpload, pk=upload_id, user=request.user)
+        attachment = uploads.complete(upload)
+        return Response(
+            NoteAttachmentSerializer(attachment, context={'request': request}).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
 class NoteViewSet(viewsets.ModelViewSet):
     serializer_class = NoteSerializer
     permission_classes = [permissions.IsAuthenticated]  # only logged-in users
@@ -464,13 +647,20 @@ class NoteViewSet(viewsets.ModelViewSet):
         # ✅ attach user automatically
         serializer.save(user=self.request.user)
 
+def redirect_to_handle(request, url_name, user):
+    # Old email/name URLs move permanently to the handle URL
+    url = reverse(url_name, kwargs={'username': user.handle})
+    query = request.META.get('QUERY_STRING')
+    return HttpResponsePermanentRedirect(f'{url}?{query}' if query else url)
+
+
 # view another user's profile by id
 class UserProfileDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, user_id, format=None):
         try:
-            user = User.objects.prefetch_related("notes").get(id=user_id)
+            user = User.objects.get(id=user_id)
         except User.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -482,10 +672,11 @@ class PublicUserProfileByUsername(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request, username, format=None):
-        try:
-            user = User.objects.get(Q(email=username) | Q(name=username))
-        except User.DoesNotExist:
+        user, legacy = resolve_public_user(username)
+        if user is None:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+        if legacy:
+            return redirect_to_handle(request, 'public-user-profile', user)
 
         serializer = UserProfileSerializer(user, context={"request": request})
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -498,42 +689,39 @@ def my_notes(request):
     notes_qs = (
         Note.objects.filter(user=request.user)
         .order_by('-updated_at', '-created_at', '-id')
-        .prefetch_related("attachments", "bookmarks", "ratings")
+        .select_related("user")
+        .prefetch_related("attachments")
+        .with_list_stats(request.user)
     )
-    serializer = NoteSerializer(notes_qs, many=True, context={"request": request})
-    return Response(serializer.data)
+    return note_list_response(request, [cache.user_scope(request.user.pk)], notes_qs)
 
 
 # 🌐 Public: notes by username/email
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def notes_by_username(request, username):
-    try:
-        user = User.objects.get(Q(email=username) | Q(name=username))
-    except User.DoesNotExist:
+    user, legacy = resolve_public_user(username)
+    if user is None:
         return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+    if legacy:
+        return redirect_to_handle(request, 'notes_by_username', user)
 
     notes_qs = (
         Note.objects.filter(user=user)
         .order_by('-updated_at', '-created_at', '-id')
-        .prefetch_related("attachments", "bookmarks", "ratings")
+        .select_related("user")
+        .prefetch_related("attachments")
+        .with_list_stats(request.user)
     )
-    serializer = NoteSerializer(notes_qs, many=True, context={"request": request})
-    return Response(serializer.data)
+    return note_list_response(request, [cache.user_scope(user.pk)], notes_qs)
     
 def download_attachment(request, pk):
     attachment = get_object_or_404(NoteAttachment, pk=pk)
     if not attachment.file:
         raise Http404("No file attached")
 
-    file_path = attachment.file.path
-    if not os.path.exists(file_path):
-        raise Http404("File not found")
-
-    response = FileResponse(open(file_path, 'rb'), as_attachment=True)
-    # Optionally set filename in Content-Disposition
-    response["Content-Disposition"] = f'attachment; filename="{os.path.basename(file_path)}"'
-    return response
+    # Range / If-Range and validators, or hand-off to the proxy (see downloads.py)
+    return serve_file(request, attachment.file.path, attachment.display_name)
 
 
 # 🔖 Current user's bookmarked notes
@@ -543,7 +731,9 @@ def bookmarked_notes(request):
     notes_qs = (
         Note.objects.filter(bookmarks=request.user)
         .order_by('-updated_at', '-created_at', '-id')
-        .prefetch_related("attachments", "bookmarks", "ratings")
+        .select_related("user")
+        .prefetch_related("attachments")
+        .with_list_stats(request.user)
     )
-    serializer = NoteSerializer(notes_qs, many=True, context={"request": request})
-    return Response(serializer.data)
\ No newline at end of file
+    # Bookmarked notes can belong to anyone, so any note change counts
+    return note_list_response(request, [cache.all_notes_scope()], notes_qs)
\ No newline at end of file
@@ -117,8 +117,10 @@ const NoteCard = ({ note }) => {
     setRatingsCount(note.ratings_count ?? 0);
     setUserRating(note.user_rating ?? null);
   }, [note.avg_rating, note.ratings_count, note.user_rating]);
-  const profilePath = note.username
-    ? `/user-profile/${encodeURIComponent(note.username)}`
+  // Old payloads may lack the handle; email links still resolve (via a redirect)
+  const profileKey = note.handle || note.username;
+  const profilePath = profileKey
+    ? `/user-profile/${encodeURIComponent(profileKey)}`
     : undefined;
 
   const toggleBookmark = async () => {
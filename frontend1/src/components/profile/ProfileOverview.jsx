@@ -90,7 +90,7 @@ const ProfileOverview = ({
               isSelf
                 ? "/profile/notes"
                 : `/user-profile/${encodeURIComponent(
-                    profileUsername || user?.username || user?.name || ""
+                    profileUsername || user?.handle || user?.username || user?.name || ""
                   )}/notes`
             }
             className="text-xs text-indigo-600 hover:text-indigo-800"
@@ -324,7 +324,7 @@ const EditNote = () => {
             {existingAttachments.map((att, index) => {
               const url = att?.file_url || att?.file || "";
               const isImage = url.match(/\.(jpg|jpeg|png|gif|webp|bmp)$/i);
-              const fileName = url.split("/").pop();
+              const fileName = att?.name || url.split("/").pop();
               return (
                 <div
                   key={att?.id || index}
@@ -345,7 +345,7 @@ const EditNote = () => {
                       className="w-full block"
                     >
                       <img
-                        src={url}
+                        src={att?.previews?.small || url}
                         alt={fileName}
                         className="h-24 w-full object-cover rounded-md"
                       />
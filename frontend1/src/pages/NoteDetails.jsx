@@ -318,7 +318,7 @@ const NoteDetailPage = ({ currentUser }) => {
             <div className="flex items-center justify-between mb-8">
               {/* Author Mini-Profile */}
               <Link
-                to={`/user-profile/${note.username}`}
+                to={`/user-profile/${encodeURIComponent(note.handle || note.username)}`}
                 className="flex items-center transition-transform duration-300 ease-in-out hover:scale-105"
               >
                 <div className="flex-shrink-0 relative group">
@@ -495,7 +495,7 @@ const NoteDetailPage = ({ currentUser }) => {
                     att.file_url &&
                     att.file_url.match(/\.(jpg|jpeg|png|gif|bmp|webp)$/i);
                   const downloadUrl = `https://noresharing-app-fullstack-2.onrender.com/api/user/download/attachment/${att.id}/`;
-                  const fileName = att.file_url.split("/").pop();
+                  const fileName = att.name || att.file_url.split("/").pop();
 
                   return (
                     <div
@@ -511,7 +511,7 @@ const NoteDetailPage = ({ currentUser }) => {
                             className="block w-full h-full"
                           >
                             <img
-                              src={att.file_url}
+                              src={att.previews?.medium || att.file_url}
                               alt="Attachment"
                               className="w-full h-full object-cover transition-transform duration-200 hover:scale-105"
                             />
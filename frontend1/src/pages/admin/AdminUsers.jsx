@@ -157,9 +157,9 @@ export default function AdminUsers() {
               {displayUsers.map((u) => (
                 <tr key={u.id} className="border-b last:border-0">
                   <td className="py-2 pr-4 font-medium">
-                    {u.email ? (
+                    {u.handle ? (
                       <Link
-                        to={`/user-profile/${encodeURIComponent(u.email)}`}
+                        to={`/user-profile/${encodeURIComponent(u.handle)}`}
                         state={{ from: location.pathname + location.search }}
                         className="text-indigo-600 hover:text-indigo-800 hover:underline"
                         title="View user profile"
@@ -220,10 +220,10 @@ export default function AdminUsers() {
                     )}
                   </td>
                   <td className="py-2 pr-4">
-                    {u.email && typeof u.notes_count === "number" ? (
+                    {u.handle && typeof u.notes_count === "number" ? (
                       <Link
                         to={`/user-profile/${encodeURIComponent(
-                          u.email
+                          u.handle
                         )}/notes`}
                         state={{ from: location.pathname + location.search }}
                         className="text-indigo-600 hover:text-indigo-800 hover:underline"
@@ -58,8 +58,20 @@ const PublicProfile = () => {
             )}/`
           ),
         ]);
-        setUser(profileRes.data);
+        const profile = profileRes.data;
+        setUser(profile);
         setNotes(notesRes.data || []);
+        if (profile.handle && profile.handle !== username) {
+          // Old email/name link: carry on under the handle URL, so later
+          // requests skip the server's redirect
+          const oldBase = `/user-profile/${encodeURIComponent(username)}`;
+          navigate(
+            `/user-profile/${encodeURIComponent(
+              profile.handle
+            )}${location.pathname.slice(oldBase.length)}`,
+            { replace: true, state: location.state }
+          );
+        }
       } catch {
         setError("Failed to load profile");
       } finally {